@@ -1,9 +1,10 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+from eventbus import DequeEventBus
+
 import datetime
 import pprint
-import queue
 import time
 
 
@@ -13,7 +14,8 @@ class Backtest(object):
 	an event-driven backtest.
 	"""
 	def __init__(self, csv_dir, symbol_list, initial_capital, heartbeat, start_date, 
-				data_handler, execution_handler, portfolio, strategy):
+				data_handler, execution_handler, portfolio, strategy, event_bus=DequeEventBus,
+				journal=None, risk_gate=None, result_cache=None, memory_monitor=None):
 		"""
 		Initialises the backtest.
 
@@ -27,6 +29,19 @@ class Backtest(object):
 			execution_handler (Class) -  Handles the orders/fills for trades.
 			portfolio (Class) -  Keeps track of portfolio current and prior positions.
 			strategy (Class)  - Generates signals based on market data.
+			event_bus (Class) - EventBus carrying events between the components,
+				DequeEventBus by default (PriorityEventBus for live sources).
+			journal - Optional path of an EventJournal recording every
+				event processed, for replay and diffing of runs.
+			risk_gate - Optional PreTradeRiskGate every order must pass
+				before it reaches the execution handler.
+			result_cache - Optional ResultCache. Identical earlier runs are
+				then returned by simulate_trading without simulating, and
+				the trading instances are only created on a cache miss.
+				It is not used with a journal or memory_monitor, which
+				need a run to record.
+			memory_monitor - Optional MemoryMonitor sampling the size of the
+				engine structures and the process RSS while the backtest runs.
 		"""
 		self.csv_dir = csv_dir
 		self.symbol_list = symbol_list
@@ -38,15 +53,27 @@ class Backtest(object):
 		self.executionHandler_class = execution_handler
 		self.portfolio_class = portfolio
 		self.strategy_class = strategy
-
-		self.events_queue = queue.Queue()
+		self.eventBus_class = event_bus
+
+		self.events_queue = event_bus()
+		self.journal_path = journal
+		self.journal = None
+		self.risk_gate = risk_gate
+		self.result_cache = result_cache
+		self.memory_monitor = memory_monitor
+		if self.result_cache is not None and (journal is not None or memory_monitor is not None):
+			print("Result cache bypassed: the journal and memory monitor need a run to record.")
+			self.result_cache = None
+		self.results = None
 
 		self.signals = 0
 		self.orders = 0
 		self.fills = 0
+		self.fill_log = []
 		self.num_strates = 1
 
-		self._generate_trading_instances()
+		if self.result_cache is None:
+			self._generate_trading_instances()
 
 	def _generate_trading_instances(self):
 		"""
@@ -63,64 +90,160 @@ class Backtest(object):
 												self.start_date, self.initial_capital
 											)
 		self.execution_handler = self.executionHandler_class(self.events_queue)
+		self.execution_handler.attach(self.data_handler)
+		if self.risk_gate is not None:
+			# The throttle runs on bar time, so rejections are reproducible
+			self.risk_gate.attach(self.data_handler, clock=self._bar_seconds)
+			if hasattr(self.execution_handler, 'cancel_callbacks'):
+				self.execution_handler.cancel_callbacks.append(self.risk_gate.on_cancel)
+				self.execution_handler.activate_callbacks.append(self.risk_gate.on_activate)
+		if self.journal_path is not None:
+			from journal import EventJournal
+			self.journal = EventJournal(self.journal_path,
+										clock=lambda: getattr(self.data_handler, 'latest_datetime', None))
+
+	def _bar_seconds(self):
+		"""
+		Returns the latest bar datetime in seconds.
+		"""
+		latest = getattr(self.data_handler, 'latest_datetime', None)
+		return 0.0 if latest is None else latest.timestamp()
+
+	def _process_events(self):
+		"""
+		Dispatches the events on the bus until it is empty.
+		"""
+		get_event = self.events_queue.get
+		while len(self.events_queue):
+			event = get_event()
+			if event is not None:
+				if self.journal is not None:
+					self.journal.record(event)
+
+				if event.type == 'MARKET':
+					if self.risk_gate is not None:
+						self.risk_gate.update_prices()
+					self.execution_handler.on_market(event)
+					self.strategy.calculate_signals(event)
+					self.portfolio.update_timeindex(event)
+
+				elif event.type == 'SIGNAL':
+					self.signals += 1
+					self.portfolio.update_signal(event)
+
+				elif event.type == 'ORDER':
+					self.orders += 1
+					if self.risk_gate is None or event.order_type == 'CXL' or self.risk_gate.check(event):
+						self.execution_handler.execute_order(event)
+
+				elif event.type == 'FILL':
+					self.fills += 1
+					self.fill_log.append((event.timeindex, event.symbol, event.direction,
+										  event.quantity, event.fill_cost, event.commission))
+					if self.risk_gate is not None:
+						self.risk_gate.on_fill(event)
+					self.portfolio.update_fill(event)
 
 	def _run_backtest(self):
 		"""
 		Executes the backtest.
 		"""
 		i = 0
-		while True:
-			i += 1
-			print(i)
-			# Update the market bars
-			if self.data_handler.continue_backtest == True:
-				self.data_handler.update_bars()
-			else:
-				break
-
-			# Handle the events
+		try:
 			while True:
-				try:
-					event = self.events_queue.get(False)
-				except queue.Empty:
-					break
+				i += 1
+				print(i)
+				# Update the market bars
+				if self.data_handler.continue_backtest == True:
+					self.data_handler.update_bars()
 				else:
-					if event is not None:
-						if event.type == 'MARKET':
-							self.strategy.calculate_signals(event)
-							self.portfolio.update_timeindex(event)
-
-						elif event.type == 'SIGNAL':
-							self.signals += 1
-							self.portfolio.update_signal(event)
-
-						elif event.type == 'ORDDER':
-							self.orders += 1
-							self.execution_handler.execute_order(event)
+					break
 
-						elif event.type == 'FILL':
-							self.fills += 1
-							self.portfolio.update_fill(event)
-			time.sleep(self.heartbeat)
+				# Handle the events until the bus is empty
+				self._process_events()
+				# Signals held for sizing become orders once all of the
+				# bar's signals are in, and are filled on the same bar
+				end_of_bar = getattr(self.portfolio, 'end_of_bar', None)
+				if end_of_bar is not None and end_of_bar():
+					self._process_events()
+				if self.memory_monitor is not None:
+					self.memory_monitor.sample_backtest(self, i)
+				time.sleep(self.heartbeat)
+
+			if self.memory_monitor is not None:
+				self.memory_monitor.sample_backtest(self, i, force=True)
+		finally:
+			# A crashed run still leaves a readable journal
+			if self.journal is not None:
+				self.journal.close()
 
 	def _output_performance(self):
 		"""
 		Outputs the strategy performance from backtest.
 		"""
 		print("Creating summary stats...")
+		self.portfolio.create_equity_curve()
 		stats = self.portfolio.output_summary_stats()
+		ledger = getattr(self.portfolio, 'ledger', None)
+		self.results = {
+			'equity_curve': self.portfolio.equity_curve,
+			'fills': self.fill_log,
+			'stats': stats,
+			'trades': ledger.trades_frame() if ledger is not None else None,
+			'trade_stats': ledger.trade_stats() if ledger is not None else [],
+			'signals': self.signals,
+			'orders': self.orders,
+			'fill_count': self.fills,
+		}
 		
 		print("Creating equity curve...")
-		print(self.portfolio.equity_curve.tail(10))
-		pprint.pprint(stats)
-		print("Signals: {}".format(self.signals))
-		print("Orders: {}".format(self.orders))
-		print("Fills: {}".format(self.fills))
+		self._print_results(self.results)
+		if self.risk_gate is not None:
+			self.results['risk'] = self.risk_gate.summary()
+			pprint.pprint(self.results['risk'])
+		if self.memory_monitor is not None:
+			self.results['memory'] = self.memory_monitor.report()
+			pprint.pprint(self.results['memory'])
+
+	def _print_results(self, results, cached=False):
+		print(results['equity_curve'].tail(10))
+		pprint.pprint(results['stats'])
+		if results.get('trade_stats'):
+			pprint.pprint(results['trade_stats'])
+		print("Signals: {}".format(results['signals']))
+		print("Orders: {}".format(results['orders']))
+		print("Fills: {}".format(results['fill_count']))
+		if cached and results.get('risk'):
+			pprint.pprint(results['risk'])
 
 	def simulate_trading(self):
 		"""
 		Simulates the backtest and outputs portfolio performance.
+		Returns the results dict (equity_curve, fills, stats, trades,
+		trade_stats, the signal/order/fill counts and the risk gate
+		summary), from the result cache if this configuration has been
+		run before. On a cache hit nothing is simulated, so the
+		data_handler, portfolio, strategy and execution_handler
+		instances do not exist.
 		"""
+		key = None
+		if self.result_cache is not None:
+			key = self.result_cache.make_key(self)
+			results = self.result_cache.get(key)
+			if results is not None:
+				print("Loaded cached results {}".format(key[:12]))
+				self.results = results
+				self.signals, self.orders, self.fills = \
+					results['signals'], results['orders'], results['fill_count']
+				self.fill_log = results['fills']
+				self._print_results(results, cached=True)
+				return results
+			self._generate_trading_instances()
+
 		self._run_backtest()
 		self._output_performance()
+		if key is not None:
+			# The memory report describes this run only
+			self.result_cache.put(key, dict((k, v) for k, v in self.results.items() if k != 'memory'))
+		return self.results
 		
\ No newline at end of file
@@ -4,9 +4,11 @@ from eventhandler import MarketEvent
 from abc import ABCMeta, abstractmethod
 
 import datetime
+import heapq
 import os, os.path
+import queue
+import threading
 import numpy as np 
-import pandas as pd 
 
 """
 TO DO: create a live market feed handler to replace
@@ -23,7 +25,7 @@ class DataHandler(object):
 	__metaclass__ = ABCMeta
 
 	@abstractmethod
-	def get_latest_bar(self, symbol):
+	def get_latest_bar(self, symbol, timeframe=None):
 		"""
 		Returns the last bar updated.
 		"""
@@ -31,21 +33,21 @@ class DataHandler(object):
 
 
 	@abstractmethod
-	def get_latest_bars(self, symbol, N=1):
+	def get_latest_bars(self, symbol, N=1, timeframe=None):
 		"""
 		Returns the last N bars updated.
 		"""
 		raise NotImplementedError("Should implement get_latest_bars()")
 
 	@abstractmethod
-	def get_latest_bar_datetime(self, symbol):
+	def get_latest_bar_datetime(self, symbol, timeframe=None):
 		"""
 		Returns a Python datetime object for the last bar.
 		"""
 		raise NotImplementedError("Should implement get_latest_bar_datetime()")
 
 	@abstractmethod
-	def get_latest_bar_value(self, symbol, val_type):
+	def get_latest_bar_value(self, symbol, val_type, timeframe=None):
 		"""
 		Returns one of the Open, High, Low, Close, Volume or OI
 		from the last bar.
@@ -53,13 +55,28 @@ class DataHandler(object):
 		raise NotImplementedError("Should implement get_latest_bar_value()")
 
 	@abstractmethod
-	def get_latest_bars_values(self, symbol, val_type, N=1):
+	def get_latest_bars_values(self, symbol, val_type, N=1, timeframe=None):
 		"""
 		Returns the last N bar values from the
 		latest_symbol list, or N-k if less available.
 		"""
 		raise NotImplementedError("Should implement get_latest_bars_values()")
 
+	def get_latest_snapshot(self, val_type):
+		"""
+		Returns the latest val_type value of every symbol as one
+		NumPy array aligned with symbol_list (NaN where a symbol
+		has no bar yet). Handlers should override this with a
+		version that does not go through get_latest_bar_value.
+		"""
+		values = np.full(len(self.symbol_list), np.nan)
+		for i, s in enumerate(self.symbol_list):
+			try:
+				values[i] = self.get_latest_bar_value(s, val_type)
+			except IndexError:
+				pass
+		return values
+
 	@abstractmethod
 	def update_bars(self):
 		"""
@@ -76,9 +93,21 @@ class HistoricCSVDataHandler(DataHandler):
 	each requested symbol from disk and provide an interface
 	to obtain the "latest" bar in a manner identical to a live
 	trading interface.
+
+	Optionally maintains higher timeframe bars (e.g. hourly and
+	daily views of minute data) that are built incrementally as
+	each base bar arrives and are queried through the same
+	get_latest_bar* methods via their timeframe argument.
+
+	The bars of every symbol are padded forward onto the union of
+	all symbols' dates, so every symbol has a bar on every update
+	and updated_symbols is always the whole universe: update_bars
+	does work for each symbol on each bar. ChunkedCSVDataHandler
+	(without pad) only touches the symbols with a bar, driven by a
+	heap of the streams' next timestamps, for sparse universes.
 	"""
 
-	def __init__(self, events_queue, csv_dir, symbol_list):
+	def __init__(self, events_queue, csv_dir, symbol_list, timeframes=None):
 		"""
 		Initializes the historic data handler by requesting
 		the location of the CSV files and a list of symbols.
@@ -89,14 +118,32 @@ class HistoricCSVDataHandler(DataHandler):
 			events_queue - The Event Queue
 			csv_dir - Absolute directory path to the CSV files.
 			symbol_list - A list of symbol strings.
+			timeframes - Optional list of fixed pandas offset strings
+				e.g. ['1h', '1D'] to aggregate the base bars into, or
+				('volume', threshold) / ('dollar', threshold) tuples.
 		"""
 
 		self.events_queue = events_queue
 		self.csv_dir = csv_dir
 		self.symbol_list = symbol_list
+		self.timeframes = timeframes or []
+		# pandas and the aggregators are only imported by the handlers
+		# that need them, see open_csv_files
+		from timeframes import make_aggregator
 
 		self.symbol_data = {}
+		# The reindexed frames the symbol_data generators run over
+		self.symbol_frames = {}
 		self.latest_symbol_data = {}
+		self.symbol_index = dict((s, i) for i, s in enumerate(self.symbol_list))
+		self.snapshots = {}
+		# Symbols that received a bar on the latest update
+		self.updated_symbols = []
+		self.latest_datetime = None
+		self.timeframe_data = dict(
+			(s, dict((tf, make_aggregator(tf)) for tf in self.timeframes))
+			for s in self.symbol_list
+		)
 		self.continue_backtest = True
 
 		self.open_csv_files()
@@ -108,12 +155,13 @@ class HistoricCSVDataHandler(DataHandler):
 
 		#### Assumed to be Yahoo! data currently ####
 		"""
+		import pandas as pd
 
 		comb_idx = None 
 		for s in self.symbol_list:
 			# Load the CSV file with no header information, idxed on date
 			self.symbol_data[s] = pd.read_csv(os.path.join(self.csv_dir, "{}.csv".format(s)),
-												header=None, index_col=None, parse_dates=True,
+												header=None, index_col=0, parse_dates=True,
 												names=[ 'datetime', 'open','high','low', 
 														'close', 'volume', 'adj_close'])
 			
@@ -121,13 +169,15 @@ class HistoricCSVDataHandler(DataHandler):
 			if comb_idx is None:
 				comb_idx = self.symbol_data[s].index
 			else:
-				comb_idx.union(self.symbol_data[s].index)
+				comb_idx = comb_idx.union(self.symbol_data[s].index)
 
 			# Set the latest symbol_data to None
 			self.latest_symbol_data[s] = []
-			# Reindex the dataframes
-			for s in self.symbol_list:
-				self.symbol_data[s] = self.symbol_data[s].reindex(index=comb_idx, method='pad').iterrows()
+
+		# Reindex the dataframes
+		for s in self.symbol_list:
+			self.symbol_frames[s] = self.symbol_data[s].reindex(index=comb_idx, method='pad')
+			self.symbol_data[s] = self.symbol_frames[s].iterrows()
 
 	def get_new_bar(self, symbol):
 		"""
@@ -136,63 +186,72 @@ class HistoricCSVDataHandler(DataHandler):
 		for bar in self.symbol_data[symbol]:
 			yield bar
 
-	def get_latest_bar(self, symbol):
+	def _get_bars_list(self, symbol, timeframe=None):
+		"""
+		Returns the list of (datetime, bar) tuples for a symbol,
+		either the base bars or those of an aggregated timeframe.
+		"""
+		if timeframe is None:
+			return self.latest_symbol_data[symbol]
+		return self.timeframe_data[symbol][timeframe].bars
+
+	def get_latest_bar(self, symbol, timeframe=None):
 		"""
 		Returns the last bar from the latest_symbol list.
 		"""
 		try:
-			bars_list = self.latest_symbol_data[symbol] # why create copy slow
+			bars_list = self._get_bars_list(symbol, timeframe)
 		except KeyError:
-			print("Symbol not found in historical dataset.")
+			print("Symbol or timeframe not found in historical dataset.")
 			raise
 		else:
 			return bars_list[-1]
 
-	def get_latest_bars(self, symbol, N=1):
+	def get_latest_bars(self, symbol, N=1, timeframe=None):
 		"""
 		Returns the last N bars from latest_symbol list
 		"""
 		try:
-			bars_list = self.latest_symbol_data[symbol] # why create copy slow
+			bars_list = self._get_bars_list(symbol, timeframe)
 		except KeyError:
-			print("Symbol not found in historical dataset.")
+			print("Symbol or timeframe not found in historical dataset.")
 			raise
 		else:
 			return bars_list[-N:]
 
-	def get_latest_bar_datetime(self, symbol):
+	def get_latest_bar_datetime(self, symbol, timeframe=None):
 		"""
 		Returns a python datetime object for the last bar.
 		"""
 		try:
-			bars_list = self.latest_symbol_data[symbol]
+			bars_list = self._get_bars_list(symbol, timeframe)
 		except KeyError:
-			print("Symbol not found in hostorical dataset.")
+			print("Symbol or timeframe not found in hostorical dataset.")
 			raise
 		else:
 			return bars_list[-1][0]
 
-	def get_latest_bar_value(self, symbol, val_type):
+	def get_latest_bar_value(self, symbol, val_type, timeframe=None):
 		"""
 		Returns one of the Open, High, Low, Close, Volume or OI
 		values from the pandas Bar series object.
 		"""
 		try:
-			bars_list = self.latest_symbol_data[symbol]
+			bars_list = self._get_bars_list(symbol, timeframe)
 		except KeyError:
-			print("That symbol is not available in the historical data set.")
+			print("That symbol or timeframe is not available in the historical data set.")
 			raise
 		else:
 			return getattr(bars_list[-1][1], val_type)
 
-	def get_latest_bars_values(self, symbol, val_type, N=1):
+	def get_latest_bars_values(self, symbol, val_type, N=1, timeframe=None):
 		"""
 		Returns the last N bar values from the latest_symbol list
 		"""
 		try:
-			bars_list = self.get_latest_bars(symbol, N)
+			bars_list = self.get_latest_bars(symbol, N, timeframe)
 		except KeyError:
-			print("That symbol is not available in the hostrical data set.")
+			print("That symbol or timeframe is not available in the hostrical data set.")
 			raise
 		else:
 			return np.array([getattr(b[1], val_type) for b in bars_list])
@@ -200,9 +259,10 @@ class HistoricCSVDataHandler(DataHandler):
 	def update_bars(self):
 		"""
 		Pushes the latest bar to the latest_symbol_data structure
-		for all symbols in the symbol list.
+		for all symbols in the symbol list (all of them have one,
+		see the class docstring).
 		"""
-
+		self.updated_symbols = []
 		for s in self.symbol_list:
 			try:
 				bar = next(self.get_new_bar(s))
@@ -211,5 +271,463 @@ class HistoricCSVDataHandler(DataHandler):
 				self.continue_backtest = False
 			else:
 				if bar:
-					self.latest_symbol_data[s].append(bar)
+					self._append_bar(s, bar)
+					self.updated_symbols.append(s)
+		self.events_queue.put(MarketEvent())
+
+	def get_latest_snapshot(self, val_type):
+		"""
+		Returns the latest val_type value of every symbol as one
+		NumPy array aligned with symbol_list (NaN where a symbol
+		has no bar yet).
+
+		The first request for a field builds its array, after which
+		it is kept up to date as bars arrive, so later requests cost
+		nothing. The returned array is a read-only view.
+		"""
+		if val_type not in self.snapshots:
+			self.snapshots[val_type] = DataHandler.get_latest_snapshot(self, val_type)
+		view = self.snapshots[val_type].view()
+		view.flags.writeable = False
+		return view
+
+	def _append_bar(self, symbol, bar, aggregate=True):
+		"""
+		Appends a (datetime, bar) tuple to the latest bars of
+		a symbol, folds it into each aggregated timeframe (unless
+		aggregate is False e.g. for padded bars, which would count
+		the volume and range of the padded bar twice) and updates
+		the snapshot arrays.
+		"""
+		self.latest_symbol_data[symbol].append(bar)
+		self.latest_datetime = bar[0]
+		if aggregate:
+			for aggregator in self.timeframe_data[symbol].values():
+				aggregator.update(bar[0], bar[1])
+		if self.snapshots:
+			i = self.symbol_index[symbol]
+			for val_type, values in self.snapshots.items():
+				values[i] = getattr(bar[1], val_type)
+
+
+class CSVChunkStream(object):
+	"""
+	Streams the bars of a single CSV file in fixed-size chunks.
+	A background thread reads ahead up to 'prefetch' chunks into
+	a bounded queue, so parsing overlaps with the backtest and
+	at most prefetch + 1 chunks are ever resident.
+	"""
+
+	_END = object()
+
+	def __init__(self, path, names, chunk_size=100000, prefetch=2):
+		"""
+		Parameters:
+			path - Path to the CSV file.
+			names - Column names, the first being the datetime index.
+			chunk_size - Number of rows parsed per chunk.
+			prefetch - Maximum number of chunks read ahead.
+		"""
+		self.path = path
+		self.names = names
+		self.chunk_size = chunk_size
+
+		self._chunks = queue.Queue(maxsize=prefetch)
+		self._rows = iter(())
+		self._next_bar = None
+		self.exhausted = False
+
+		self._reader = threading.Thread(target=self._read_chunks)
+		self._reader.daemon = True
+		self._reader.start()
+		self._advance()
+
+	def _read_chunks(self):
+		"""
+		Reader thread: parses the file chunk by chunk onto the queue,
+		followed by an end marker (or the exception that stopped it).
+		"""
+		try:
+			import pandas as pd
+			reader = pd.read_csv(self.path, header=None, index_col=0, parse_dates=True,
+								 names=self.names, chunksize=self.chunk_size)
+			for chunk in reader:
+				self._chunks.put(chunk)
+		except Exception as e:
+			self._chunks.put(e)
+		else:
+			self._chunks.put(self._END)
+
+	def _advance(self):
+		"""
+		Moves the stream on to its next (datetime, bar) tuple,
+		pulling the next chunk from the reader thread when the
+		current one runs out.
+		"""
+		while True:
+			try:
+				row = next(self._rows)
+			except StopIteration:
+				chunk = self._chunks.get()
+				if chunk is self._END:
+					self._next_bar = None
+					self.exhausted = True
+					return
+				if isinstance(chunk, Exception):
+					raise chunk
+				self._rows = chunk.itertuples()
+			else:
+				self._next_bar = (row.Index, row)
+				return
+
+	def peek_datetime(self):
+		"""
+		Returns the datetime of the next bar, or None if exhausted.
+		"""
+		if self.exhausted:
+			return None
+		return self._next_bar[0]
+
+	def next_bar(self):
+		"""
+		Returns the next (datetime, bar) tuple and advances the stream.
+		"""
+		bar = self._next_bar
+		self._advance()
+		return bar
+
+
+class ChunkedCSVDataHandler(HistoricCSVDataHandler):
+	"""
+	ChunkedCSVDataHandler reads the same 'symbol'.csv files as
+	HistoricCSVDataHandler, but lazily in fixed-size chunks with
+	read-ahead on a background thread per symbol. Only the chunks
+	in flight plus a bounded lookback window of bars are kept in
+	memory, so peak memory does not depend on the file sizes.
+
+	Symbols are synchronised on timestamp: each update releases
+	the earliest pending datetime across all symbols, and symbols
+	without a bar at that time are padded forward with their last
+	bar, as HistoricCSVDataHandler does via reindex.
+
+	With pad=False symbols without a bar are left untouched
+	instead, so each update only costs work for the symbols that
+	traded (listed in updated_symbols). This is the mode for
+	large, sparsely traded universes; get_latest_bar* then return
+	each symbol's last actual bar.
+
+	Bars are namedtuples (from itertuples) rather than Series, so
+	getattr(bar, val_type) works unchanged.
+	"""
+
+	def __init__(self, events_queue, csv_dir, symbol_list, timeframes=None,
+				 chunk_size=100000, lookback=1000, prefetch=2, pad=True):
+		"""
+		Parameters:
+			events_queue - The Event Queue
+			csv_dir - Absolute directory path to the CSV files.
+			symbol_list - A list of symbol strings.
+			timeframes - Optional list of timeframes to aggregate into.
+			chunk_size - Number of rows parsed per chunk.
+			lookback - Number of most recent bars kept per symbol (and
+				per timeframe), i.e. the largest N a strategy may request.
+			prefetch - Maximum number of chunks read ahead per symbol.
+			pad - Pad symbols without a bar forward on every update.
+		"""
+		self.chunk_size = chunk_size
+		self.lookback = lookback
+		self.prefetch = prefetch
+		self.pad = pad
+		super(ChunkedCSVDataHandler, self).__init__(events_queue, csv_dir, 
+													symbol_list, timeframes)
+
+		for aggregators in self.timeframe_data.values():
+			for aggregator in aggregators.values():
+				aggregator.max_bars = lookback
+
+	def open_csv_files(self):
+		"""
+		Opens a chunked stream on each symbol's CSV file. Nothing
+		beyond the first prefetched chunks is read at this point.
+		"""
+		names = ['datetime', 'open', 'high', 'low', 'close', 'volume', 'adj_close']
+		# Heap of (next datetime, symbol index) over the open streams
+		self._pending = []
+		for i, s in enumerate(self.symbol_list):
+			self.symbol_data[s] = CSVChunkStream(
+				os.path.join(self.csv_dir, "{}.csv".format(s)),
+				names, self.chunk_size, self.prefetch
+			)
+			self.latest_symbol_data[s] = []
+			if not self.symbol_data[s].exhausted:
+				self._pending.append((self.symbol_data[s].peek_datetime(), i))
+		heapq.heapify(self._pending)
+
+	def update_bars(self):
+		"""
+		Pushes the bars of the next timestamp to the latest_symbol_data
+		structure for the symbols that have one, padding the others
+		forward if pad is set.
+		"""
+		if not self._pending:
+			print("Not more bars to fetch.")
+			self.continue_backtest = False
+			return
+		bar_datetime = self._pending[0][0]
+
+		self.updated_symbols = []
+		while self._pending and self._pending[0][0] == bar_datetime:
+			i = heapq.heappop(self._pending)[1]
+			s = self.symbol_list[i]
+			stream = self.symbol_data[s]
+			self._append_bar(s, stream.next_bar())
+			self.updated_symbols.append(s)
+			if not stream.exhausted:
+				heapq.heappush(self._pending, (stream.peek_datetime(), i))
+
+		if self.pad:
+			updated = set(self.updated_symbols)
+			for s in self.symbol_list:
+				if s not in updated and self.latest_symbol_data[s]:
+					# Pad forward the last known bar, the aggregated
+					# timeframes already hold it
+					self._append_bar(s, (bar_datetime, self.latest_symbol_data[s][-1][1]), aggregate=False)
+		self.events_queue.put(MarketEvent())
+
+	def _append_bar(self, symbol, bar, aggregate=True):
+		"""
+		Appends the bar and trims the symbol's bars back to the
+		lookback window once they reach twice its size.
+		"""
+		super(ChunkedCSVDataHandler, self)._append_bar(symbol, bar, aggregate)
+		bars_list = self.latest_symbol_data[symbol]
+		if len(bars_list) > 2 * self.lookback:
+			del bars_list[:-self.lookback]
+
+
+class TickDataHandler(DataHandler):
+	"""
+	TickDataHandler replays trade ticks from 'symbol'.csv files of
+	(datetime, price, size) rows. All ticks are held in compact typed
+	arrays (int64 ns timestamps, float64 prices, int32 sizes, 24
+	bytes per tick with the merge order) grouped by symbol, so tens
+	of millions of ticks fit in memory and a symbol's tick history
+	is a contiguous slice.
+
+	Ticks are streamed in time order across symbols; each update
+	releases all ticks sharing the next timestamp. Time, volume and
+	dollar bars are built incrementally as ticks arrive.
+
+	get_latest_bar* without a timeframe return raw ticks as
+	(datetime, Tick) tuples, where 'price' (or open/high/low/close/
+	adj_close) and 'size' (or volume) can be queried. With a
+	timeframe they return the aggregated bars.
+	"""
+
+	PRICE_FIELDS = ('price', 'open', 'high', 'low', 'close', 'adj_close')
+	SIZE_FIELDS = ('size', 'volume')
+
+	def __init__(self, events_queue, csv_dir, symbol_list, timeframes=None, lookback=None):
+		"""
+		Parameters:
+			events_queue - The Event Queue
+			csv_dir - Absolute directory path to the tick CSV files.
+			symbol_list - A list of symbol strings.
+			timeframes - Optional list of bars to build: pandas offset
+				strings e.g. '1min' for time bars, ('volume', threshold)
+				or ('dollar', threshold) tuples.
+			lookback - Optional number of most recent bars kept per
+				timeframe.
+		"""
+		self.events_queue = events_queue
+		self.csv_dir = csv_dir
+		self.symbol_list = symbol_list
+		self.timeframes = timeframes or []
+		# Imported once here, update_bars and _tick run per tick
+		import pandas as pd
+		from timeframes import make_aggregator, Tick
+		self._Timestamp = pd.Timestamp
+		self._Tick = Tick
+
+		self.symbol_index = dict((s, i) for i, s in enumerate(self.symbol_list))
+		self.timeframe_data = dict(
+			(s, dict((tf, make_aggregator(tf, lookback)) for tf in self.timeframes))
+			for s in self.symbol_list
+		)
+		self.updated_symbols = []
+		self.latest_datetime = None
+		self.continue_backtest = True
+
+		self.open_csv_files()
+
+	def open_csv_files(self):
+		"""
+		Loads each symbol's ticks into typed arrays grouped by symbol
+		and builds the time ordered merge of all symbols.
+		"""
+		import pandas as pd
+		timestamps, prices, sizes = [], [], []
+		for s in self.symbol_list:
+			ticks = pd.read_csv(os.path.join(self.csv_dir, "{}.csv".format(s)),
+								header=None, index_col=0, parse_dates=True,
+								names=['datetime', 'price', 'size'])
+			timestamps.append(np.asarray(ticks.index, dtype='datetime64[ns]').view(np.int64))
+			prices.append(ticks['price'].to_numpy(dtype=np.float64))
+			sizes.append(ticks['size'].to_numpy(dtype=np.int32))
+			del ticks
+
+		counts = np.array([len(t) for t in timestamps], dtype=np.int64)
+		# Start of each symbol's ticks in the grouped arrays
+		self.offsets = np.concatenate(([0], np.cumsum(counts)))
+		self.timestamps = np.concatenate(timestamps)
+		self.prices = np.concatenate(prices)
+		self.sizes = np.concatenate(sizes)
+		del timestamps, prices, sizes
+
+		# Stable sort keeps each symbol's own tick order on equal timestamps
+		index_type = np.int32 if len(self.timestamps) < 2 ** 31 else np.int64
+		self.order = np.argsort(self.timestamps, kind='stable').astype(index_type)
+		self.cursor = 0
+		# Number of ticks of each symbol released so far
+		self.seen = np.zeros(len(self.symbol_list), dtype=np.int64)
+		self.last_price = np.full(len(self.symbol_list), np.nan)
+		self.last_size = np.zeros(len(self.symbol_list), dtype=np.int32)
+
+	def _tick_range(self, symbol, N=None):
+		"""
+		Returns the slice of the grouped arrays holding the last N
+		(default all) released ticks of a symbol.
+		"""
+		i = self.symbol_index[symbol]
+		stop = self.offsets[i] + self.seen[i]
+		start = self.offsets[i] if N is None else max(stop - N, self.offsets[i])
+		return slice(start, stop)
+
+	def _tick(self, k):
+		return (self._Timestamp(self.timestamps[k]), self._Tick(float(self.prices[k]), int(self.sizes[k])))
+
+	def _values(self, val_type):
+		if val_type in self.PRICE_FIELDS:
+			return self.prices
+		if val_type in self.SIZE_FIELDS:
+			return self.sizes
+		raise AttributeError("Ticks have no value '{}'".format(val_type))
+
+	def _get_bars_list(self, symbol, timeframe):
+		return self.timeframe_data[symbol][timeframe].bars
+
+	def get_latest_bar(self, symbol, timeframe=None):
+		"""
+		Returns the last tick, or the last bar of a timeframe.
+		"""
+		try:
+			if timeframe is not None:
+				return self._get_bars_list(symbol, timeframe)[-1]
+			ticks = self._tick_range(symbol)
+		except KeyError:
+			print("Symbol or timeframe not found in tick dataset.")
+			raise
+		if ticks.stop == ticks.start:
+			raise IndexError("No ticks for {} yet".format(symbol))
+		return self._tick(ticks.stop - 1)
+
+	def get_latest_bars(self, symbol, N=1, timeframe=None):
+		"""
+		Returns the last N ticks, or the last N bars of a timeframe.
+		"""
+		try:
+			if timeframe is not None:
+				return self._get_bars_list(symbol, timeframe)[-N:]
+			ticks = self._tick_range(symbol, N)
+		except KeyError:
+			print("Symbol or timeframe not found in tick dataset.")
+			raise
+		return [self._tick(k) for k in range(ticks.start, ticks.stop)]
+
+	def get_latest_bar_datetime(self, symbol, timeframe=None):
+		"""
+		Returns a python datetime object for the last tick or bar.
+		"""
+		return self.get_latest_bar(symbol, timeframe)[0]
+
+	def get_latest_bar_value(self, symbol, val_type, timeframe=None):
+		"""
+		Returns the price or size of the last tick, or one of the
+		Open, High, Low, Close, Volume values of the last bar.
+		"""
+		if timeframe is not None:
+			return getattr(self.get_latest_bar(symbol, timeframe)[1], val_type)
+		values = self._values(val_type)
+		try:
+			ticks = self._tick_range(symbol)
+		except KeyError:
+			print("That symbol is not available in the tick data set.")
+			raise
+		if ticks.stop == ticks.start:
+			raise IndexError("No ticks for {} yet".format(symbol))
+		return values[ticks.stop - 1]
+
+	def get_latest_bars_values(self, symbol, val_type, N=1, timeframe=None):
+		"""
+		Returns the last N tick or bar values. Tick values are a
+		read-only view into the tick arrays.
+		"""
+		if timeframe is not None:
+			bars_list = self.get_latest_bars(symbol, N, timeframe)
+			return np.array([getattr(b[1], val_type) for b in bars_list])
+		values = self._values(val_type)
+		try:
+			view = values[self._tick_range(symbol, N)]
+		except KeyError:
+			print("That symbol is not available in the tick data set.")
+			raise
+		view.flags.writeable = False
+		return view
+
+	def get_latest_snapshot(self, val_type):
+		"""
+		Returns the last price (or size) of every symbol as a
+		read-only array aligned with symbol_list.
+		"""
+		if val_type in self.PRICE_FIELDS:
+			view = self.last_price.view()
+		elif val_type in self.SIZE_FIELDS:
+			view = self.last_size.view()
+		else:
+			raise AttributeError("Ticks have no value '{}'".format(val_type))
+		view.flags.writeable = False
+		return view
+
+	def update_bars(self):
+		"""
+		Releases all ticks sharing the next timestamp, folds them
+		into the bars of each timeframe and puts a MarketEvent.
+		"""
+		Tick = self._Tick
+		if self.cursor >= len(self.order):
+			print("Not more ticks to fetch.")
+			self.continue_backtest = False
+			return
+
+		ts = self.timestamps[self.order[self.cursor]]
+		end = self.cursor + 1
+		while end < len(self.order) and self.timestamps[self.order[end]] == ts:
+			end += 1
+		batch = self.order[self.cursor:end]
+		self.cursor = end
+
+		symbols = np.searchsorted(self.offsets, batch, side='right') - 1
+		self.latest_datetime = self._Timestamp(ts)
+		self.updated_symbols = []
+		for k, i in zip(batch.tolist(), symbols.tolist()):
+			s = self.symbol_list[i]
+			self.seen[i] += 1
+			self.last_price[i] = self.prices[k]
+			self.last_size[i] = self.sizes[k]
+			if self.timeframes:
+				tick = Tick(float(self.prices[k]), int(self.sizes[k]))
+				for aggregator in self.timeframe_data[s].values():
+					aggregator.update(self.latest_datetime, tick)
+			if not self.updated_symbols or self.updated_symbols[-1] != s:
+				self.updated_symbols.append(s)
 		self.events_queue.put(MarketEvent())
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from abc import ABCMeta, abstractmethod
+
+import collections
+import heapq
+import itertools
+import threading
+
+
+class EventBus(object):
+	"""
+	EventBus is an abstract base class providing the interface
+	through which DataHandler, Strategy, Portfolio and
+	ExecutionHandler objects exchange events. Producers call
+	put(event) exactly as they would on a queue.Queue; the
+	consumer calls get(), which returns None instead of raising
+	queue.Empty when there is nothing to process.
+	"""
+
+	__metaclass__ = ABCMeta
+
+	@abstractmethod
+	def put(self, event):
+		"""
+		Adds an event to the bus.
+		"""
+		raise NotImplementedError("Should implement put()")
+
+	@abstractmethod
+	def get(self, block=False, timeout=None):
+		"""
+		Removes and returns the next event, or None if the bus
+		is empty (after waiting up to timeout if block is True).
+		"""
+		raise NotImplementedError("Should implement get()")
+
+	@abstractmethod
+	def __len__(self):
+		raise NotImplementedError("Should implement __len__()")
+
+	def empty(self):
+		"""
+		Returns True if there are no events waiting.
+		"""
+		return len(self) == 0
+
+
+class DequeEventBus(EventBus):
+	"""
+	FIFO event bus for the single-threaded backtester. A plain
+	deque without locks, and an empty bus is signalled by a None
+	return rather than an exception.
+	"""
+
+	def __init__(self):
+		self._events = collections.deque()
+
+	def put(self, event):
+		self._events.append(event)
+
+	def get(self, block=False, timeout=None):
+		"""
+		Returns the oldest event or None. block and timeout are
+		accepted for interface compatibility; nothing else can put
+		events while a single-threaded backtest waits.
+		"""
+		if self._events:
+			return self._events.popleft()
+		return None
+
+	def __len__(self):
+		return len(self._events)
+
+
+class PriorityEventBus(EventBus):
+	"""
+	Timestamp-ordered event bus for live trading, where market
+	data, execution replies and timers put events from several
+	threads. Events are returned in timestamp order, ties (and
+	events without a timestamp) in arrival order, so they are
+	processed in causal order regardless of which source
+	delivered them first.
+
+	An event's timestamp is taken from the timestamp argument of
+	put(), else from its 'datetime' or 'timeindex' attribute, else
+	it inherits the latest timestamp seen so far.
+	"""
+
+	def __init__(self):
+		self._heap = []
+		self._seq = itertools.count()
+		self._last_ts = float('-inf')
+		self._not_empty = threading.Condition(threading.Lock())
+
+	def _timestamp(self, event, timestamp):
+		if timestamp is None:
+			timestamp = getattr(event, 'datetime', None)
+		if timestamp is None:
+			timestamp = getattr(event, 'timeindex', None)
+		if timestamp is None:
+			return self._last_ts
+		if hasattr(timestamp, 'timestamp'):
+			timestamp = timestamp.timestamp()
+		return float(timestamp)
+
+	def put(self, event, timestamp=None):
+		"""
+		Adds an event. Safe to call from any thread.
+
+		Parameters:
+			event - The Event object.
+			timestamp - Optional datetime or POSIX seconds to order by.
+		"""
+		with self._not_empty:
+			ts = self._timestamp(event, timestamp)
+			if ts > self._last_ts:
+				self._last_ts = ts
+			heapq.heappush(self._heap, (ts, next(self._seq), event))
+			self._not_empty.notify()
+
+	def get(self, block=False, timeout=None):
+		"""
+		Returns the earliest event or None. With block=True waits
+		up to timeout seconds (forever if None) for an event.
+		"""
+		with self._not_empty:
+			if block and not self._heap:
+				self._not_empty.wait_for(lambda: self._heap, timeout)
+			if self._heap:
+				return heapq.heappop(self._heap)[2]
+			return None
+
+	def __len__(self):
+		return len(self._heap)
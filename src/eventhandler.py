@@ -1,6 +1,11 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import itertools
+
+# Order IDs assigned to OrderEvents created without one
+_order_ids = itertools.count(1)
+
 
 class Event(object):
 	"""
@@ -54,21 +59,37 @@ class SignalEvent(Event):
 class OrderEvent(Event):
 	"""
 	Handles the event of sending an Order to an execution system.
-	The order contains a symbol (e.g. GOOG), a type (market or limit),
-	quantity and direction.
+	The order contains a symbol (e.g. GOOG), a type (market, limit,
+	stop or trailing stop), quantity and direction.
+
+	Orders sharing an oco_group are one-cancels-other: a fill of one
+	cancels the rest. An order with a parent_id only becomes active
+	once its parent has filled, see bracket_order().
 	"""
 
-	def __init__(self, symbol, order_type, quantity, direction):
+	def __init__(self, symbol, order_type, quantity, direction, price=None, stop_price=None,
+				 trail_amount=None, trail_percent=None, oco_group=None, parent_id=None, order_id=None):
 		"""
 		Initialises the order type, setting whether it is a MArket order
-		('MKT') or limit order ('LMT'), has a quantity and it direction
-		('BUY' or 'SELL').
+		('MKT'), limit order ('LMT'), stop order ('STP') or trailing
+		stop ('TRAIL'), has a quantity and it direction ('BUY' or 'SELL').
+		'CXL' cancels the resting orders of the symbol (of oco_group
+		only if given).
 
 		Parameters:
 			symbol - The instrument to trade.
-			order_type - 'MKT' or 'LMT' for Market or Limit
+			order_type - 'MKT', 'LMT', 'STP', 'TRAIL' or 'CXL'
 			quantity - Non-negative integer for quantity
 			direction - 'BUY' or 'SELL' for long or short
+			price - Limit price of a 'LMT' order.
+			stop_price - Trigger price of a 'STP' order, optional
+				initial level of a 'TRAIL' order.
+			trail_amount - Distance of a trailing stop from the best
+				price since it was placed, in price units.
+			trail_percent - The same as a fraction e.g. 0.02 for 2%.
+			oco_group - Optional one-cancels-other group name.
+			parent_id - Optional order_id of the order this one waits on.
+			order_id - Unique ID, assigned if not given.
 		"""
 
 		self.type = 'ORDER'
@@ -76,6 +97,13 @@ class OrderEvent(Event):
 		self.order_type = order_type
 		self.quantity = quantity
 		self.direction = direction
+		self.price = price
+		self.stop_price = stop_price
+		self.trail_amount = trail_amount
+		self.trail_percent = trail_percent
+		self.oco_group = oco_group
+		self.parent_id = parent_id
+		self.order_id = next(_order_ids) if order_id is None else order_id
 
 	def print_order(self):
 		"""
@@ -90,6 +118,43 @@ class OrderEvent(Event):
 			 )
 
 
+def bracket_order(symbol, quantity, direction, take_profit=None, stop_loss=None,
+				  trail_amount=None, trail_percent=None, entry_type='MKT', entry_price=None):
+	"""
+	Returns the orders of a bracket: the entry order followed by
+	its exits, a take-profit limit and a stop (or trailing stop)
+	loss. The exits only become active once the entry has filled
+	and are one-cancels-other.
+
+	Parameters:
+		symbol - The instrument to trade.
+		quantity - Quantity of the entry and of each exit.
+		direction - Direction of the entry, 'BUY' or 'SELL'.
+		take_profit - Limit price of the take-profit exit (None: none).
+		stop_loss - Stop price of the stop loss (None: none).
+		trail_amount, trail_percent - Make the stop loss a trailing stop.
+		entry_type - 'MKT', 'LMT' or 'STP' entry.
+		entry_price - Limit / stop price of the entry.
+	"""
+	entry = OrderEvent(symbol, entry_type, quantity, direction,
+					   price=entry_price if entry_type == 'LMT' else None,
+					   stop_price=entry_price if entry_type == 'STP' else None)
+	exit_direction = 'SELL' if direction == 'BUY' else 'BUY'
+	group = "bracket-{}".format(entry.order_id)
+	orders = [entry]
+	if take_profit is not None:
+		orders.append(OrderEvent(symbol, 'LMT', quantity, exit_direction, price=take_profit,
+								 oco_group=group, parent_id=entry.order_id))
+	if trail_amount is not None or trail_percent is not None:
+		orders.append(OrderEvent(symbol, 'TRAIL', quantity, exit_direction, stop_price=stop_loss,
+								 trail_amount=trail_amount, trail_percent=trail_percent,
+								 oco_group=group, parent_id=entry.order_id))
+	elif stop_loss is not None:
+		orders.append(OrderEvent(symbol, 'STP', quantity, exit_direction, stop_price=stop_loss,
+								 oco_group=group, parent_id=entry.order_id))
+	return orders
+
+
 class FillEvent(Event):
 	"""
 	Encapsulates the notion of a Filled Order, as returned
@@ -99,7 +164,7 @@ class FillEvent(Event):
 	"""
 
 	def __init__(self, timeindex, symbol, exchange, quantity, direction, 
-				 fill_cost, commission=None):
+				 fill_cost, commission=None, order_id=None):
 
 		"""
 		Initialises the FillEvent object. Sets the symbol, exchange,
@@ -116,6 +181,7 @@ class FillEvent(Event):
 			direction - The direction of fill (’BUY’ or ’SELL’)
 			fill_cost - The holdings value in dollars.
 			commission - An optional commission sent from IB.
+			order_id - Optional order_id of the OrderEvent filled.
 		"""
 
 		self.type = 'FILL'
@@ -125,6 +191,7 @@ class FillEvent(Event):
 		self.quantity = quantity
 		self.direction = direction
 		self.fill_cost = fill_cost
+		self.order_id = order_id
 
 		self.share_threshold = 500
 		self.max_commission = 1.3 # Fix! Now == 0.5% of trade value i.e. Cost = max(min(0.005*qty,0.005*qty*px),1.00)
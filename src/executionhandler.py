@@ -4,7 +4,9 @@
 from abc import ABCMeta, abstractmethod
 from eventhandler import FillEvent, OrderEvent
 
+import datetime
 import queue
+import numpy as np
 
 
 class ExecutionHandler(object):
@@ -33,6 +35,20 @@ class ExecutionHandler(object):
 		"""
 		raise NotImplementedError("Must implement execute_order()")
 
+	def attach(self, bars):
+		"""
+		Binds the handler to the DataHandler, for handlers that
+		fill orders against the market data.
+		"""
+		self.bars = bars
+
+	def on_market(self, event):
+		"""
+		Called with every MarketEvent before the strategy sees it,
+		e.g. to evaluate resting orders against the new bars.
+		"""
+		pass
+
 
 class SimulatedExecutionHandler(ExecutionHandler):
 	"""
@@ -43,21 +59,93 @@ class SimulatedExecutionHandler(ExecutionHandler):
 	This allows a straightforward "first go" test of any strategy,
 	before implementation with a more sophisticated execution
 	handler.
+
+	Market orders (and limit orders without a price) fill at once.
+	Stop, trailing stop and priced limit orders rest in a book of
+	parallel arrays (one slot per order) and are evaluated against
+	the high / low of each new bar in one vectorized comparison:
+
+		buy stop, sell limit - trigger when high >= level
+		sell stop, buy limit - trigger when low <= level
+
+	A triggered order fills at its level, or at the open if the bar
+	gapped through it. Stops are filled before limits when both
+	sides of an OCO group trigger on the same bar. Trailing stop
+	levels are then ratcheted in place from the bar's high (sell) or
+	low (buy), so they only act from the next bar on.
+
+	Orders with a parent_id wait until their parent fills, a fill
+	of an order cancels the rest of its oco_group. cancel_callbacks
+	are called with every cancelled order and activate_callbacks
+	with every child order released by its parent's fill, e.g. a
+	risk gate's on_cancel and on_activate. A child an activate
+	callback returns False for is cancelled instead.
+
+	Filled and cancelled orders are forgotten at the next bar, so
+	the order state stays bounded over long runs: child orders must
+	be submitted by the end of the bar their parent fills or is
+	cancelled on (bracket_order submits them with the parent).
 	"""
-	def __init__(self, events_queue):
+
+	RESTING_TYPES = ('STP', 'TRAIL')
+
+	def __init__(self, events_queue, capacity=64):
 		"""
 		Initialises the handler, setting the event queues
 		up internally.
 
 		Parameters:
 			events_queue - The Queue of Event objects.
+			capacity - Initial number of resting order slots.
 		"""
 		self.events_queue = events_queue
+		self.bars = None
+		self.cancel_callbacks = []
+		self.activate_callbacks = []
+
+		# Resting order book, one slot per order
+		self.size = 0
+		self.resting = 0
+		self.free_slots = []
+		self.orders = []
+		self._allocate(capacity)
+
+		self.status = {}
+		self.slot_of = {}
+		self.children = {}
+		self.groups = {}
+		# Orders filled or cancelled since the last bar
+		self.done = []
+
+	def _allocate(self, capacity):
+		"""
+		(Re)allocates the book arrays with room for capacity slots.
+		"""
+		fields = (('symbol', np.intp, 0), ('side', np.int8, 0), ('level', np.float64, np.nan),
+				  ('trail_amount', np.float64, np.nan), ('trail_percent', np.float64, np.nan),
+				  ('above', bool, False), ('stop', bool, False), ('trailing', bool, False),
+				  ('active', bool, False))
+		for name, dtype, fill in fields:
+			grown = np.full(capacity, fill, dtype=dtype)
+			if self.size:
+				grown[:self.size] = getattr(self, name)[:self.size]
+			setattr(self, name, grown)
+		self.orders.extend([None] * (capacity - len(self.orders)))
+
+	def attach(self, bars):
+		"""
+		Binds the handler to the DataHandler providing the bars
+		resting orders are evaluated against.
+		"""
+		self.bars = bars
+		self.symbol_index = dict((s, i) for i, s in enumerate(bars.symbol_list))
 
 	def execute_order(self, event):
 		"""
 		Simply converts Order objects into Fill objects naively,
 		i.e. without any latency, slippage or fill ratio problems.
+		Stops, trailing stops and priced limits are put in the
+		book, orders of an unfilled parent are held back.
 
 		## TO DO: implement basic slippage rules and/or fill ratio 
 		problems i.e. limits not filled (if limits)
@@ -65,13 +153,229 @@ class SimulatedExecutionHandler(ExecutionHandler):
 		Parameters:
 			event - Contains an Event object with order information
 		"""
-		if event.type is 'ORDER':
-			fill_event = FillEvent(
-									datetime.datetime.utcnow(),
-									event.symbol,
-									'ARCA', #random exchange assumption
-									event.quantity,
-									event.direction,
-									None)
-			self.events_queue.put(fill_event)
-	
\ No newline at end of file
+		if event.type != 'ORDER':
+			return
+		if event.order_type == 'CXL':
+			self.cancel(event.symbol, event.oco_group)
+			return
+		if event.oco_group is not None:
+			self.groups.setdefault(event.oco_group, []).append(event)
+
+		if event.parent_id is not None:
+			parent_status = self.status.get(event.parent_id)
+			if parent_status == 'CANCELLED':
+				self._cancelled(event)
+				return
+			if parent_status != 'FILLED':
+				self.status[event.order_id] = 'WAITING'
+				self.children.setdefault(event.parent_id, []).append(event)
+				return
+			if not self._activate(event):
+				return
+		self._submit(event)
+
+	def _activate(self, event):
+		"""
+		Calls the activate_callbacks with a released child order,
+		cancelling it if one of them rejects it.
+		"""
+		for callback in self.activate_callbacks:
+			if callback(event) is False:
+				self._cancelled(event)
+				return False
+		return True
+
+	def _submit(self, event):
+		if event.order_type in self.RESTING_TYPES or (event.order_type == 'LMT' and event.price is not None):
+			self._rest(event)
+		else:
+			self._fill(event, event.price)
+
+	def _fill(self, event, price):
+		"""
+		Puts the FillEvent of an order, then cancels the rest of its
+		OCO group and releases its child orders.
+		"""
+		# Stamped with the bar time, a wall clock stamp would be
+		# ordered away from the bar's events on a PriorityEventBus
+		fill_event = FillEvent(
+								self._fill_time(),
+								event.symbol,
+								'ARCA', #random exchange assumption
+								event.quantity,
+								event.direction,
+								price,
+								order_id=event.order_id)
+		self.events_queue.put(fill_event)
+		self.status[event.order_id] = 'FILLED'
+		self.done.append(event.order_id)
+
+		for other in self.groups.pop(event.oco_group, ()) if event.oco_group is not None else ():
+			if other is not event:
+				self._cancel_order(other)
+		for child in self.children.pop(event.order_id, ()):
+			if self.status.get(child.order_id) == 'WAITING' and self._activate(child):
+				self._submit(child)
+
+	def _fill_time(self):
+		"""
+		Returns the latest bar datetime, the wall clock time when
+		there are no bars yet.
+		"""
+		latest = getattr(self.bars, 'latest_datetime', None)
+		return datetime.datetime.utcnow() if latest is None else latest
+
+	def _rest(self, event):
+		"""
+		Adds a stop, trailing stop or limit order to the book.
+		"""
+		if self.bars is None:
+			print("Resting {} orders need the handler to be attached to the bars.".format(event.order_type))
+			raise ValueError("SimulatedExecutionHandler is not attached")
+		side = 1 if event.direction == 'BUY' else -1
+		if event.order_type == 'LMT':
+			level, above, stop = event.price, side < 0, False
+		else:
+			level, above, stop = event.stop_price, side > 0, True
+		trailing = event.order_type == 'TRAIL'
+		if trailing:
+			if event.trail_amount is None and event.trail_percent is None:
+				print("TRAIL order {} has no trail_amount or trail_percent.".format(event.order_id))
+				raise ValueError("Missing trailing distance")
+			reference = self.bars.get_latest_bar_value(event.symbol, "adj_close")
+			offset = event.trail_amount if event.trail_amount is not None else reference * event.trail_percent
+			initial = reference + side * offset
+			if level is None:
+				level = initial
+			else:
+				level = max(level, initial) if side < 0 else min(level, initial)
+		if level is None:
+			print("{} order {} has no price.".format(event.order_type, event.order_id))
+			raise ValueError("Missing order price")
+
+		if self.free_slots:
+			slot = self.free_slots.pop()
+		else:
+			if self.size == len(self.active):
+				self._allocate(2 * len(self.active))
+			slot = self.size
+			self.size += 1
+		self.symbol[slot] = self.symbol_index[event.symbol]
+		self.side[slot] = side
+		self.level[slot] = level
+		self.trail_amount[slot] = np.nan if event.trail_amount is None else event.trail_amount
+		self.trail_percent[slot] = np.nan if event.trail_percent is None else event.trail_percent
+		self.above[slot] = above
+		self.stop[slot] = stop
+		self.trailing[slot] = trailing
+		self.active[slot] = True
+		self.orders[slot] = event
+		self.slot_of[event.order_id] = slot
+		self.status[event.order_id] = 'RESTING'
+		self.resting += 1
+
+	def _release(self, slot):
+		event = self.orders[slot]
+		self.active[slot] = False
+		self.orders[slot] = None
+		self.free_slots.append(slot)
+		self.resting -= 1
+		del self.slot_of[event.order_id]
+		return event
+
+	def _cancelled(self, event):
+		self.status[event.order_id] = 'CANCELLED'
+		self.done.append(event.order_id)
+		members = self.groups.get(event.oco_group) if event.oco_group is not None else None
+		if members is not None:
+			members[:] = [e for e in members if e is not event]
+			if not members:
+				del self.groups[event.oco_group]
+		for callback in self.cancel_callbacks:
+			callback(event)
+		for child in self.children.pop(event.order_id, ()):
+			self._cancel_order(child)
+
+	def _cancel_order(self, event):
+		status = self.status.get(event.order_id)
+		if status == 'RESTING':
+			self._release(self.slot_of[event.order_id])
+		elif status != 'WAITING':
+			return
+		self._cancelled(event)
+
+	def cancel(self, symbol=None, oco_group=None):
+		"""
+		Cancels the resting and waiting orders of symbol and/or
+		oco_group (all of them if both are None).
+		"""
+		pending = [e for e in self.orders if e is not None]
+		pending += [e for children in self.children.values() for e in children]
+		for event in pending:
+			if (symbol is None or event.symbol == symbol) and \
+				(oco_group is None or event.oco_group == oco_group):
+				self._cancel_order(event)
+
+	def _prune(self):
+		"""
+		Drops the status of the orders filled or cancelled before
+		this bar, their children have all been submitted.
+		"""
+		for order_id in self.done:
+			self.status.pop(order_id, None)
+		self.done = []
+
+	def _fresh_symbols(self):
+		"""
+		Returns a boolean array of the symbols with a new bar.
+		"""
+		updated = getattr(self.bars, 'updated_symbols', None)
+		fresh = np.zeros(len(self.bars.symbol_list), dtype=bool)
+		if updated is None or updated is self.bars.symbol_list:
+			fresh[:] = True
+		else:
+			fresh[[self.symbol_index[s] for s in updated]] = True
+		return fresh
+
+	def on_market(self, event):
+		"""
+		Fills the resting orders triggered by the new bars and
+		ratchets the trailing stops.
+		"""
+		self._prune()
+		if not self.resting:
+			return
+		n = self.size
+		symbol = self.symbol[:n]
+		level = self.level[:n]
+		above = self.above[:n]
+		fresh = self._fresh_symbols()[symbol]
+		high = self.bars.get_latest_snapshot("high")[symbol]
+		low = self.bars.get_latest_snapshot("low")[symbol]
+
+		# One comparison for every resting order
+		live = self.active[:n] & fresh
+		hit = live & np.where(above, high >= level, low <= level)
+		if hit.any():
+			opens = self.bars.get_latest_snapshot("open")[symbol]
+			prices = np.where(above, np.fmax(opens, level), np.fmin(opens, level))
+			slots = np.flatnonzero(hit)
+			slots = slots[np.argsort(~self.stop[slots], kind='stable')].tolist()
+			triggered = [self.orders[slot] for slot in slots]
+			for slot, order in zip(slots, triggered):
+				# An OCO sibling may have cancelled the order already and
+				# its slot may hold an order released by an earlier fill
+				if self.orders[slot] is order:
+					price = float(prices[slot])
+					self._fill(self._release(slot), price)
+
+		# Trailing stops follow the best price of the bar
+		trailing = self.active[:n] & self.trailing[:n] & fresh
+		if trailing.any():
+			side = self.side[:n]
+			reference = np.where(side < 0, high, low)
+			offset = np.where(np.isnan(self.trail_amount[:n]), reference * self.trail_percent[:n],
+							  self.trail_amount[:n])
+			candidate = reference + side * offset
+			candidate = np.where(side < 0, np.fmax(level, candidate), np.fmin(level, candidate))
+			np.copyto(level, candidate, where=trailing)
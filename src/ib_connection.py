@@ -0,0 +1,408 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import itertools
+import queue
+import threading
+import time
+
+
+"""
+Connection management for Interactive Brokers. Execution and market
+data use separate TWS sessions (client IDs), so quote traffic never
+delays order acknowledgements and fills.
+
+IbPy invokes callbacks on its socket reader thread. Each session's
+callback only puts the raw message on a SimpleQueue; a dispatch thread
+per session decodes the messages and calls the registered handlers,
+which hand results to the engine (e.g. FillEvents on the event bus).
+"""
+
+# TWS error codes signalling a lost / restored connection
+CONNECTION_LOST = (1100, 2110)
+CONNECTION_RESTORED = (1101, 1102)
+NOT_CONNECTED = 504
+
+
+class IBMessage(object):
+	"""
+	Decoded server message: typeName plus the message fields
+	copied as attributes, detached from the IbPy message object.
+	"""
+
+	def __init__(self, typeName, **fields):
+		self.typeName = typeName
+		self.__dict__.update(fields)
+
+	def items(self):
+		return [(k, v) for k, v in vars(self).items() if k != 'typeName']
+
+	def __repr__(self):
+		return "<{} {}>".format(self.typeName, ", ".join("{}={}".format(k, v) for k, v in self.items()))
+
+
+def decode_message(msg):
+	"""
+	Converts an IbPy message (or a mock message) to an IBMessage.
+	"""
+	if hasattr(msg, 'items'):
+		fields = dict(msg.items())
+	else:
+		fields = dict((k, v) for k, v in vars(msg).items() if not k.startswith('_'))
+	fields.pop('typeName', None)
+	return IBMessage(msg.typeName, **fields)
+
+
+def ibpy_connection(host, port, client_id):
+	"""
+	Default connection factory, IbPy is only imported when a real
+	TWS session is opened.
+	"""
+	from ib.opt import ibConnection
+	return ibConnection(host=host, port=port, clientId=client_id)
+
+
+class IBSession(object):
+	"""
+	One TWS client connection with its own dispatch thread and
+	automatic reconnection.
+
+	Handlers are registered per message typeName (or for all
+	messages) and run on the dispatch thread. Callbacks added with
+	on_reconnect run there as well after a lost connection has been
+	re-established, e.g. to resync order state.
+	"""
+
+	_STOP = object()
+
+	def __init__(self, name, client_id, host='127.0.0.1', port=7496,
+				 connection_factory=None, reconnect_interval=5.0, max_reconnect_attempts=None):
+		"""
+		Parameters:
+			name - Label used in log messages e.g. 'execution'.
+			client_id - TWS client ID, unique per session.
+			host - TWS / gateway host.
+			port - TWS / gateway port.
+			connection_factory - Callable (host, port, client_id) returning
+				an ibConnection-like object, ibpy_connection by default.
+			reconnect_interval - Seconds between reconnection attempts.
+			max_reconnect_attempts - Give up after this many (None: never).
+		"""
+		self.name = name
+		self.client_id = client_id
+		self.host = host
+		self.port = port
+		self.connection_factory = connection_factory or ibpy_connection
+		self.reconnect_interval = reconnect_interval
+		self.max_reconnect_attempts = max_reconnect_attempts
+
+		self.handlers = {}
+		self.all_handlers = []
+		self.reconnect_callbacks = []
+		self.inbox = queue.SimpleQueue()
+		self.connected = False
+		self.reconnects = 0
+
+		self.conn = None
+		self._running = False
+		self._dispatcher = None
+
+	def register(self, type_name, handler):
+		"""
+		Calls handler(msg) for every message of the given typeName.
+		"""
+		self.handlers.setdefault(type_name, []).append(handler)
+
+	def register_all(self, handler):
+		"""
+		Calls handler(msg) for every message.
+		"""
+		self.all_handlers.append(handler)
+
+	def on_reconnect(self, callback):
+		"""
+		Calls callback(session) after each successful reconnection.
+		"""
+		self.reconnect_callbacks.append(callback)
+
+	def _receive(self, msg):
+		"""
+		IbPy callback, runs on the socket reader thread: only queues
+		the message so the reader is never held up by handlers.
+		"""
+		self.inbox.put(msg)
+
+	def _connect(self):
+		self.conn = self.connection_factory(self.host, self.port, self.client_id)
+		self.conn.registerAll(self._receive)
+		self.connected = bool(self.conn.connect())
+		return self.connected
+
+	def start(self):
+		"""
+		Connects and starts the dispatch thread.
+		"""
+		if not self._connect():
+			print("{} session: could not connect to {}:{}".format(self.name, self.host, self.port))
+		self._running = True
+		self._dispatcher = threading.Thread(target=self._dispatch_loop, name="ib-{}".format(self.name))
+		self._dispatcher.daemon = True
+		self._dispatcher.start()
+
+	def stop(self):
+		"""
+		Stops the dispatch thread and disconnects.
+		"""
+		self._running = False
+		self.inbox.put(self._STOP)
+		if self._dispatcher is not None and self._dispatcher is not threading.current_thread():
+			self._dispatcher.join()
+		if self.conn is not None:
+			self.conn.disconnect()
+		self.connected = False
+
+	def _dispatch(self, msg):
+		for handler in self.handlers.get(msg.typeName, ()):
+			handler(msg)
+		for handler in self.all_handlers:
+			handler(msg)
+
+	def _is_disconnect(self, msg):
+		if msg.typeName == 'connectionClosed':
+			return True
+		return msg.typeName == 'error' and getattr(msg, 'errorCode', None) in CONNECTION_LOST + (NOT_CONNECTED,)
+
+	def _dispatch_loop(self):
+		"""
+		Dispatch thread: decodes queued messages, runs the handlers
+		and reconnects when the connection is lost.
+		"""
+		while self._running:
+			try:
+				raw = self.inbox.get(timeout=self.reconnect_interval)
+			except queue.Empty:
+				raw = None
+			if raw is self._STOP:
+				break
+			if raw is not None:
+				msg = decode_message(raw)
+				if self._is_disconnect(msg):
+					self.connected = False
+				elif msg.typeName == 'error' and getattr(msg, 'errorCode', None) in CONNECTION_RESTORED:
+					self.connected = True
+				try:
+					self._dispatch(msg)
+				except Exception as e:
+					print("{} session: handler failed on {}: {}".format(self.name, msg.typeName, e))
+			if not self.connected and self._running:
+				self._reconnect()
+
+	def _reconnect(self):
+		"""
+		Re-opens the connection, retrying every reconnect_interval
+		seconds, then runs the reconnect callbacks.
+		"""
+		for attempt in itertools.count(1):
+			if not self._running:
+				return
+			if self.max_reconnect_attempts is not None and attempt > self.max_reconnect_attempts:
+				print("{} session: giving up after {} reconnection attempts".format(self.name, attempt - 1))
+				self._running = False
+				return
+			try:
+				if self.conn is not None:
+					self.conn.disconnect()
+				if self._connect():
+					break
+			except Exception as e:
+				print("{} session: reconnection failed: {}".format(self.name, e))
+			time.sleep(self.reconnect_interval)
+
+		self.reconnects += 1
+		print("{} session: reconnected".format(self.name))
+		for callback in self.reconnect_callbacks:
+			callback(self)
+
+
+class IBConnectionManager(object):
+	"""
+	Owns the execution and market data sessions to TWS, each with
+	its own client ID and dispatch thread.
+	"""
+
+	def __init__(self, host='127.0.0.1', port=7496, execution_client_id=10,
+				 market_data_client_id=11, connection_factory=None, reconnect_interval=5.0,
+				 max_reconnect_attempts=None):
+		"""
+		Parameters:
+			host - TWS / gateway host.
+			port - TWS / gateway port.
+			execution_client_id - Client ID of the order session.
+			market_data_client_id - Client ID of the market data session.
+			connection_factory - See IBSession, e.g. a MockGateway's connect.
+			reconnect_interval - Seconds between reconnection attempts.
+			max_reconnect_attempts - Give up after this many (None: never).
+		"""
+		kwargs = dict(host=host, port=port, connection_factory=connection_factory,
+					  reconnect_interval=reconnect_interval,
+					  max_reconnect_attempts=max_reconnect_attempts)
+		self.execution = IBSession('execution', execution_client_id, **kwargs)
+		self.market_data = IBSession('market_data', market_data_client_id, **kwargs)
+
+	def start(self):
+		self.execution.start()
+		self.market_data.start()
+
+	def stop(self):
+		self.execution.stop()
+		self.market_data.stop()
+
+
+class MockGateway(object):
+	"""
+	In-process stand-in for TWS for tests. Connections created by
+	connect() behave like IbPy's ibConnection: market orders fill
+	immediately at the price set with set_price(), reqMktData
+	streams tickPrice messages on set_price(), and
+	drop_connections() simulates a lost TWS connection.
+
+	While hold_reports is set, orders still fill but their reports
+	are lost, as when a connection drops between a fill and its
+	report. As with TWS, filled orders are not reported again by
+	reqOpenOrders, only by reqExecutions (execDetails).
+	"""
+
+	def __init__(self, next_order_id=1):
+		self.next_order_id = next_order_id
+		self.prices = {}
+		self.orders = {}
+		self.connections = []
+		self.accept_connections = True
+		self.hold_reports = False
+		self._lock = threading.Lock()
+
+	def connect(self, host, port, client_id):
+		"""
+		Connection factory for IBSession / IBConnectionManager.
+		"""
+		conn = MockConnection(self, client_id)
+		self.connections.append(conn)
+		return conn
+
+	def set_price(self, symbol, price):
+		"""
+		Sets the price used for fills and sends it to subscribers.
+		"""
+		self.prices[symbol] = price
+		for conn in list(self.connections):
+			for ticker_id, contract in conn.subscriptions.items():
+				if contract.m_symbol == symbol:
+					conn.send('tickPrice', tickerId=ticker_id, field=4, price=price, canAutoExecute=0)
+
+	def drop_connections(self):
+		"""
+		Simulates TWS losing its connection to every client.
+		"""
+		for conn in list(self.connections):
+			if conn.connected:
+				conn.send('connectionClosed')
+				conn.connected = False
+
+	def place_order(self, conn, order_id, contract, order):
+		if not conn.connected:
+			return
+		with self._lock:
+			self.next_order_id = max(self.next_order_id, order_id + 1)
+			price = self.prices.get(contract.m_symbol, 0.0)
+			self.orders[order_id] = (conn.client_id, contract, order, price)
+		if not self.hold_reports:
+			self._report(conn, order_id)
+
+	def _execution(self, order_id):
+		client_id, contract, order, price = self.orders[order_id]
+		return MockExecution(m_orderId=order_id, m_clientId=client_id, m_execId="{}.1".format(order_id),
+							 m_side='BOT' if order.m_action == 'BUY' else 'SLD',
+							 m_shares=order.m_totalQuantity, m_price=price,
+							 m_exchange=contract.m_exchange, m_time='')
+
+	def _report(self, conn, order_id):
+		client_id, contract, order, price = self.orders[order_id]
+		conn.send('openOrder', orderId=order_id, contract=contract, order=order, orderState=None)
+		conn.send('orderStatus', orderId=order_id, status='Filled', filled=order.m_totalQuantity,
+				  remaining=0, avgFillPrice=price, permId=order_id, parentId=0,
+				  lastFillPrice=price, clientId=client_id, whyHeld=None)
+		conn.send('execDetails', reqId=-1, contract=contract, execution=self._execution(order_id))
+
+	def send_executions(self, conn, req_id, exec_filter):
+		"""
+		Sends the executions of the client ID in exec_filter
+		(the connection's by default).
+		"""
+		client_id = getattr(exec_filter, 'm_clientId', 0) or conn.client_id
+		for order_id, order in sorted(self.orders.items()):
+			if order[0] == client_id:
+				conn.send('execDetails', reqId=req_id, contract=order[1], execution=self._execution(order_id))
+		conn.send('execDetailsEnd', reqId=req_id)
+
+
+class MockExecution(object):
+	"""
+	Stand-in for IbPy's Execution, the m_ fields as attributes.
+	"""
+
+	def __init__(self, **fields):
+		self.__dict__.update(fields)
+
+
+class MockConnection(object):
+	"""
+	ibConnection-like client of a MockGateway. Messages are
+	delivered synchronously to the registered callbacks.
+	"""
+
+	def __init__(self, gateway, client_id):
+		self.gateway = gateway
+		self.client_id = client_id
+		self.connected = False
+		self.listeners = []
+		self.subscriptions = {}
+
+	def send(self, type_name, **fields):
+		msg = IBMessage(type_name, **fields)
+		for listener in list(self.listeners):
+			listener(msg)
+
+	def connect(self):
+		if not self.gateway.accept_connections:
+			return False
+		self.connected = True
+		self.send('nextValidId', orderId=self.gateway.next_order_id)
+		return True
+
+	def disconnect(self):
+		self.connected = False
+
+	def isConnected(self):
+		return self.connected
+
+	def register(self, listener, *types):
+		self.listeners.append(lambda msg: msg.typeName in types and listener(msg))
+
+	def registerAll(self, listener):
+		self.listeners.append(listener)
+
+	def placeOrder(self, order_id, contract, order):
+		self.gateway.place_order(self, order_id, contract, order)
+
+	def reqIds(self, num_ids):
+		self.send('nextValidId', orderId=self.gateway.next_order_id)
+
+	def reqOpenOrders(self):
+		# Every mock order fills at once, none is left open
+		self.send('openOrderEnd')
+
+	def reqExecutions(self, req_id, exec_filter):
+		self.gateway.send_executions(self, req_id, exec_filter)
+
+	def reqMktData(self, ticker_id, contract, generic_ticks='', snapshot=False):
+		self.subscriptions[ticker_id] = contract
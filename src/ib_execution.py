@@ -1,12 +1,13 @@
 import datetime
-import time
+import threading
 
 from ib.ext.Contract import Contract
+from ib.ext.ExecutionFilter import ExecutionFilter
 from ib.ext.Order import Order
-from ib.opt import ibConnection, message
 
 from eventhandler import FillEvent, OrderEvent
 from executionhandler import ExecutionHandler
+from ib_connection import IBConnectionManager
 
 
 
@@ -20,18 +21,32 @@ class IBExecutionHandler(ExecutionHandler):
 	TO DO: Need to validate syntax is same.
 			Assumption is that it's changed a bit
 	"""
-	def __init__(self, events_queue, order_routing="SMART", currency="USD"):
+	def __init__(self, events_queue, order_routing="SMART", currency="USD", connection_manager=None):
 		"""
 		Initialises the IBExecution instance.
+
+		Parameters:
+			events_queue - The Event Queue (thread-safe, e.g. PriorityEventBus)
+			order_routing - Exchange to route orders to.
+			currency - Currency of the contracts.
+			connection_manager - Optional IBConnectionManager, e.g. on a
+				MockGateway for tests. One on the default TWS port is
+				created otherwise.
 		"""
 		self.events_queue = events_queue
 		self.order_routing = order_routing 
 		self.currency = currency
 		self.fill_dict = {}
+		self.connection_manager = connection_manager
+		# Orders held back while the execution session is down, or
+		# until nextValidId has arrived on the current connection
+		self.unsent_orders = []
+		self._id_conn = None
+		self._order_lock = threading.Lock()
 
-		self.tws_conn = self.create_tws_connection()
 		self.order_id = self.create_initial_order_id()
 		self.register_handlers()
+		self.tws_conn = self.create_tws_connection()
 
 	def _error_handler(self, msg):
 		"""
@@ -43,52 +58,88 @@ class IBExecutionHandler(ExecutionHandler):
 		# Currently no error handling.
 		print("Server Error: {}".format(msg))
 
+	def _next_valid_id_handler(self, msg):
+		"""
+		TWS sends the next usable order ID on connecting, never
+		reuse an ID below it. Orders held back until then are sent.
+		"""
+		with self._order_lock:
+			self.order_id = max(self.order_id, msg.orderId)
+			self._id_conn = self.connection_manager.execution.conn
+			unsent, self.unsent_orders = self.unsent_orders, []
+		for contract, order in unsent:
+			self._place_order(contract, order)
+
 	def _reply_handler(self, msg):
 		"""
-		Handles of server replies
+		Handles of server replies. Runs on the execution session's
+		dispatch thread.
 		"""
 		# Handle open order orderID processing
-		if msg.typeName == "openOrder" and msg.orderID == self.order_id \
-			and not self.fill_dict.has_key(msg.orderID):
-
+		if msg.typeName == "openOrder" and msg.orderId not in self.fill_dict:
 			self.create_fill_dict_entry(msg)
 		# Handle Fills
 		if msg.typeName == "orderStatus" and msg.status == "Filled" \
-			and self.fill_dict[msg.orderID]["filled"] == False:
+			and msg.orderId in self.fill_dict and self.fill_dict[msg.orderId]["filled"] == False:
 
 			self.create_fill(msg)
 			print("Server Response: {}, {}\n".format(msg.typeName, msg))
+		# Executions, live or requested by _resync
+		if msg.typeName == "execDetails":
+			self.create_execution_fill(msg)
+
+	def _resync(self, session):
+		"""
+		Runs after the execution session reconnects. Orders filled
+		while disconnected are not reported again by TWS through
+		openOrder/orderStatus, so the session's executions are
+		requested and any not yet reported become fills (see
+		create_execution_fill). Held back orders are sent once the
+		new connection's nextValidId has arrived.
+		"""
+		exec_filter = ExecutionFilter()
+		exec_filter.m_clientId = session.client_id
+		session.conn.reqOpenOrders()
+		session.conn.reqExecutions(session.reconnects, exec_filter)
 
 	def create_tws_connection(self):
 		"""
 		Connect to the Trader Workstation (TWS) running on 
-		usual port of 7496, with clientID 10. The clientID
-		is chosen; two seperate IDs - one for execution 
-		connection and market data connection.
+		usual port of 7496. Execution and market data use
+		seperate sessions with their own client IDs (10 and
+		11 by default), see IBConnectionManager. Returns the
+		execution session.
 		"""
-		tws_conn = ibConnection() #ibConnection().connect()
-		return tws_conn.connect()
+		if self.connection_manager is None:
+			self.connection_manager = IBConnectionManager()
+		self.connection_manager.start()
+		return self.connection_manager.execution
 
 	def create_initial_order_id(self):
-	"""
-	Shittly written method which needs to improved.
-	Basically creates initial order ID to keep track
-	of submitted IB orders
-	"""
-	return 1
+		"""
+		Initial order ID to keep track of submitted IB orders,
+		raised to the nextValidId sent by TWS on connecting.
+		"""
+		return 1
 
 	def register_handlers(self):
 		"""
 		Register the error and server reply
 		message handling functions.
 		"""
+		if self.connection_manager is None:
+			self.connection_manager = IBConnectionManager()
+		session = self.connection_manager.execution
+
 		# Assign error handling function above 
 		# to TWS connection
-		self.tws_conn.register(self._error_handler, 'Error')
+		session.register('error', self._error_handler)
+		session.register('nextValidId', self._next_valid_id_handler)
 
 		# Assign all the server reply messages to the 
 		# reply_handler function
-		self.tws_conn.regsterAll(self._reply_handler)
+		session.register_all(self._reply_handler)
+		session.on_reconnect(self._resync)
 
 	def create_contract(self, symbol, sec_type, exchange, prime_exch, currency):
 		"""
@@ -107,7 +158,7 @@ class IBExecutionHandler(ExecutionHandler):
 		contract.m_secType = sec_type
 		contract.m_exchange = exchange
 		contract.m_primaryExch = prime_exch
-		contract.m_currency = curr
+		contract.m_currency = currency
 		return contract
 
 	def create_order(self, order_type, quantity, action):
@@ -131,38 +182,62 @@ class IBExecutionHandler(ExecutionHandler):
 		to properly handle event-driven behavior of IB client-
 		server responses
 		"""
-		self.fill_dict[msg.orderID] = {
+		self.fill_dict[msg.orderId] = {
 										"symbol": msg.contract.m_symbol,
 										"exchange": msg.contract.m_exchange,
 										"direction": msg.order.m_action,
-										"filled": False
+										"filled": False,
+										"executed": 0,
+										"exec_ids": set()
 									}
 
 	def create_fill(self, msg):
 		"""
 		Handles the creation of the FillEvent that will be
 		placed onto the events queue after an order is filled.
+		Quantities already reported by execDetails are left out.
 		"""
-		fd = self.fill_dict[msg.orderID]
-
-		# Parse the fill data from fill_dict
-		symbol = fd["symbol"]
-		exchange = fd["exchange"]
-		filled = msg.filled
-		direction = fd["direction"]
-		fill_cost = msg.avgFillPrice
-
-		# Create a FillEvent object
-		fill_event = FillEvent(
-			datetime.datetime.utcnow(), symbol,
-			exchange, filled, direction, fill_cost
-		)
+		fd = self.fill_dict[msg.orderId]
 
 		# Ensure that multiple messages don't create
 		# additional fills by setting "filled" to True
-		self.fill_dict[msg.orderID]["filled"] = True
+		fd["filled"] = True
+		filled = msg.filled - fd["executed"]
+		if filled > 0:
+			self._put_fill(fd, filled, msg.avgFillPrice)
 
-		# Place FillEvent onto the events queue
+	def create_execution_fill(self, msg):
+		"""
+		Creates the FillEvent of an execution (execDetails), unless
+		its order was reported Filled or the execution was seen
+		before. Orders whose openOrder was lost get their fill_dict
+		entry from the execution.
+		"""
+		execution = msg.execution
+		fd = self.fill_dict.get(execution.m_orderId)
+		if fd is None:
+			fd = self.fill_dict[execution.m_orderId] = {
+										"symbol": msg.contract.m_symbol,
+										"exchange": execution.m_exchange,
+										"direction": "BUY" if execution.m_side == "BOT" else "SELL",
+										"filled": False,
+										"executed": 0,
+										"exec_ids": set()
+									}
+		if fd["filled"] or execution.m_execId in fd["exec_ids"]:
+			return
+		fd["exec_ids"].add(execution.m_execId)
+		fd["executed"] += execution.m_shares
+		self._put_fill(fd, execution.m_shares, execution.m_price)
+
+	def _put_fill(self, fd, quantity, price):
+		"""
+		Places the FillEvent of quantity at price onto the events queue.
+		"""
+		fill_event = FillEvent(
+			datetime.datetime.utcnow(), fd["symbol"],
+			fd["exchange"], quantity, fd["direction"], price
+		)
 		self.events_queue.put(fill_event)
 
 	def execute_order(self, event):
@@ -194,20 +269,21 @@ class IBExecutionHandler(ExecutionHandler):
 				order_type, quantity, direction
 			)
 
-			# Now send the order to IB via tws_conn
-			self.tws_conn.placeOrder(
-				self.order_id, ib_contract, ib_order
-			)
-
-			# NOTE: Appears following line is needed!
-			# Seems like sleeping ensure order is recieved
-			# by IB server. 
-			# TO DO: Why? Check latency or Bithub error logs
-			time.sleep(1)
+			# Now send the order to IB via the execution session
+			self._place_order(ib_contract, ib_order)
 
+	def _place_order(self, contract, order):
+		"""
+		Sends an order with the next order ID, or holds it back
+		until the execution session has reconnected and sent its
+		nextValidId.
+		"""
+		with self._order_lock:
+			conn = self.tws_conn.conn
+			if not self.tws_conn.connected or self._id_conn is not conn or not conn.isConnected():
+				self.unsent_orders.append((contract, order))
+				return
+			order_id = self.order_id
 			# Increment order ID for session to ensure no dup order
 			self.order_id += 1
-
-
-
-
+		conn.placeOrder(order_id, contract, order)
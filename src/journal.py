@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from eventhandler import MarketEvent, SignalEvent, OrderEvent, FillEvent
+
+import argparse
+import struct
+import numpy as np
+import pandas as pd
+
+
+"""
+Append-only binary journal of the events flowing through a backtest.
+
+Each event is one fixed-width little-endian record, so a journal can be
+memory-mapped as a NumPy structured array for replay and diffing without
+parsing. Records hold:
+	type, code, order_type - event type and enum codes (direction, signal
+		or order type) as bytes
+	strategy_id - uint32
+	seq - position of the event in the journal
+	timestamp - int64 ns (NaT if unknown)
+	symbol - 16 bytes, utf-8, zero padded
+	quantity - int64
+	value - float64, strength of a signal, fill cost of a fill or limit
+		price of an order (NaN if unset)
+	commission - float64, commission of a fill or stop price of an order
+	exchange - 8 bytes, utf-8, zero padded
+	trail_amount, trail_percent - float64, trailing distance of an order
+	order_id - int64, id of an order or of the order a fill is for (-1 if unset)
+	parent_id - int64, parent order of a bracket exit (-1 if unset)
+	oco_group - 24 bytes, utf-8, zero padded
+"""
+
+MAGIC = b'EVJRNL03'
+RECORD = struct.Struct('<BBBxIqq16sqdd8sddqq24s')
+RECORD_DTYPE = np.dtype([
+	('type', 'u1'), ('code', 'u1'), ('order_type', 'u1'), ('pad', 'u1'),
+	('strategy_id', '<u4'), ('seq', '<i8'), ('timestamp', '<i8'), ('symbol', 'S16'),
+	('quantity', '<i8'), ('value', '<f8'), ('commission', '<f8'), ('exchange', 'S8'),
+	('trail_amount', '<f8'), ('trail_percent', '<f8'), ('order_id', '<i8'), ('parent_id', '<i8'),
+	('oco_group', 'S24')
+])
+# Compared by first appearance in diff_journals, as ids depend on the process
+ID_FIELDS = ('order_id', 'parent_id', 'oco_group')
+
+EVENT_TYPES = {'MARKET': 1, 'SIGNAL': 2, 'ORDER': 3, 'FILL': 4}
+EVENT_NAMES = dict((v, k) for k, v in EVENT_TYPES.items())
+CODES = {'LONG': 1, 'SHORT': 2, 'EXIT': 3, 'BUY': 1, 'SELL': 2}
+SIGNAL_NAMES = {1: 'LONG', 2: 'SHORT', 3: 'EXIT'}
+DIRECTION_NAMES = {1: 'BUY', 2: 'SELL'}
+ORDER_TYPES = {'MKT': 1, 'LMT': 2, 'STP': 3, 'TRAIL': 4, 'CXL': 5}
+ORDER_TYPE_NAMES = dict((v, k) for k, v in ORDER_TYPES.items())
+NAT = np.iinfo(np.int64).min
+
+
+def _to_ns(dt):
+	if dt is None:
+		return NAT
+	ts = pd.Timestamp(dt)
+	return NAT if ts is pd.NaT else ts.value
+
+
+def _to_float(value):
+	return np.nan if value is None else float(value)
+
+
+def _to_id(value):
+	return -1 if value is None else int(value)
+
+
+def _to_bytes(text, size):
+	return ('' if text is None else str(text)).encode('utf-8')[:size]
+
+
+class EventJournal(object):
+	"""
+	Writes events to an append-only journal file as fixed-width
+	records. MarketEvents and OrderEvents carry no timestamp of
+	their own and are stamped with clock(), e.g. the data
+	handler's latest bar datetime. FillEvents are stamped with
+	clock() as well when it is given, as fills of live handlers
+	carry the wall clock time, which differs between runs.
+	"""
+
+	def __init__(self, path, clock=None, buffer_size=1 << 20):
+		"""
+		Parameters:
+			path - Journal file, created (or truncated) on open.
+			clock - Optional callable returning the current datetime.
+			buffer_size - Write buffer size in bytes.
+		"""
+		self.path = path
+		self.clock = clock
+		self._file = open(path, 'wb', buffering=buffer_size)
+		self._file.write(MAGIC)
+		self.seq = 0
+
+	def record(self, event):
+		"""
+		Appends one event to the journal.
+		"""
+		code = order_type = strategy_id = quantity = 0
+		value = commission = 0.0
+		trail_amount = trail_percent = np.nan
+		exchange = oco_group = None
+		order_id = parent_id = None
+		timestamp = None
+
+		if event.type == 'SIGNAL':
+			code = CODES.get(event.signal_type, 0)
+			try:
+				strategy_id = int(event.strategy_id)
+			except (TypeError, ValueError):
+				strategy_id = 0
+			value = _to_float(event.strength)
+			timestamp = event.datetime
+		elif event.type == 'ORDER':
+			code = CODES.get(event.direction, 0)
+			order_type = ORDER_TYPES.get(event.order_type, 0)
+			quantity = event.quantity
+			value = _to_float(getattr(event, 'price', None))
+			commission = _to_float(getattr(event, 'stop_price', None))
+			trail_amount = _to_float(getattr(event, 'trail_amount', None))
+			trail_percent = _to_float(getattr(event, 'trail_percent', None))
+			order_id = getattr(event, 'order_id', None)
+			parent_id = getattr(event, 'parent_id', None)
+			oco_group = getattr(event, 'oco_group', None)
+		elif event.type == 'FILL':
+			code = CODES.get(event.direction, 0)
+			quantity = event.quantity
+			value = _to_float(event.fill_cost)
+			commission = event.commission
+			exchange = event.exchange
+			order_id = getattr(event, 'order_id', None)
+			timestamp = event.timeindex if self.clock is None else self.clock()
+		if timestamp is None and self.clock is not None:
+			timestamp = self.clock()
+
+		self._file.write(RECORD.pack(
+			EVENT_TYPES[event.type], code, order_type, strategy_id, self.seq, _to_ns(timestamp),
+			_to_bytes(getattr(event, 'symbol', None), 16), int(quantity), float(value),
+			float(commission), _to_bytes(exchange, 8), trail_amount, trail_percent,
+			_to_id(order_id), _to_id(parent_id), _to_bytes(oco_group, 24)
+		))
+		self.seq += 1
+
+	def flush(self):
+		self._file.flush()
+
+	def close(self):
+		self._file.close()
+
+
+def read_journal(path):
+	"""
+	Returns the records of a journal as a read-only NumPy
+	structured array mapped onto the file.
+	"""
+	with open(path, 'rb') as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError("{} is not an event journal".format(path))
+		if not f.read(1):
+			return np.empty(0, dtype=RECORD_DTYPE)
+	return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=len(MAGIC))
+
+
+def _from_float(value):
+	return None if np.isnan(value) else float(value)
+
+
+def _from_id(value):
+	return None if value < 0 else int(value)
+
+
+def decode_event(record):
+	"""
+	Rebuilds the Event object of one journal record.
+	"""
+	event_type = EVENT_NAMES[int(record['type'])]
+	if event_type == 'MARKET':
+		return MarketEvent()
+
+	symbol = record['symbol'].decode('utf-8')
+	timestamp = None if record['timestamp'] == NAT else pd.Timestamp(int(record['timestamp']))
+	if event_type == 'SIGNAL':
+		return SignalEvent(int(record['strategy_id']), symbol, timestamp,
+						   SIGNAL_NAMES.get(int(record['code'])), _from_float(record['value']))
+	if event_type == 'ORDER':
+		return OrderEvent(symbol, ORDER_TYPE_NAMES.get(int(record['order_type'])),
+						  int(record['quantity']), DIRECTION_NAMES.get(int(record['code'])),
+						  price=_from_float(record['value']), stop_price=_from_float(record['commission']),
+						  trail_amount=_from_float(record['trail_amount']),
+						  trail_percent=_from_float(record['trail_percent']),
+						  oco_group=record['oco_group'].decode('utf-8') or None,
+						  parent_id=_from_id(record['parent_id']), order_id=_from_id(record['order_id']))
+	return FillEvent(timestamp, symbol, record['exchange'].decode('utf-8'), int(record['quantity']),
+					 DIRECTION_NAMES.get(int(record['code'])), _from_float(record['value']),
+					 float(record['commission']), order_id=_from_id(record['order_id']))
+
+
+def iter_events(path):
+	"""
+	Yields the Event objects of a journal in order.
+	"""
+	for record in read_journal(path):
+		yield decode_event(record)
+
+
+def replay(path, data_handler, strategy=None, portfolio=None, output=None):
+	"""
+	Feeds a journal back into a Strategy and/or Portfolio without
+	the execution handler, event bus round trips or heartbeat of a
+	full backtest. Each recorded MarketEvent advances the data
+	handler; recorded signals and fills go to the portfolio.
+
+	Events the replayed components put on the data handler's
+	events_queue are drained after every record and, if output is
+	an EventJournal, recorded there so they can be diffed against
+	the original journal.
+
+	Parameters:
+		path - The journal to replay.
+		data_handler - DataHandler over the same data as the original run.
+		strategy - Optional Strategy receiving the MarketEvents.
+		portfolio - Optional Portfolio receiving MarketEvents, signals and fills.
+		output - Optional EventJournal for the events the components emit.
+
+	Returns the number of events replayed.
+	"""
+	bus = data_handler.events_queue
+	count = 0
+	for event in iter_events(path):
+		count += 1
+		if event.type == 'MARKET':
+			data_handler.update_bars()
+			if strategy is not None:
+				strategy.calculate_signals(event)
+			if portfolio is not None:
+				portfolio.update_timeindex(event)
+		elif portfolio is not None:
+			if event.type == 'SIGNAL':
+				portfolio.update_signal(event)
+			elif event.type == 'FILL':
+				portfolio.update_fill(event)
+
+		while len(bus):
+			emitted = bus.get()
+			if emitted is not None and emitted.type != 'MARKET' and output is not None:
+				output.record(emitted)
+	if output is not None:
+		output.flush()
+	return count
+
+
+def diff_journals(path_a, path_b, types=None):
+	"""
+	Finds the first event at which two journals diverge, comparing
+	every field except the sequence number. Order ids and OCO groups
+	are compared by order of first appearance, so journals of runs
+	whose ids start at different values still match.
+
+	Parameters:
+		path_a, path_b - The journals to compare.
+		types - Optional event type names (e.g. ['SIGNAL', 'ORDER'])
+			to restrict the comparison to.
+
+	Returns None if the journals match, otherwise (i, event_a, event_b)
+	where i is the position among the compared events and an event
+	is None if that journal ended first.
+	"""
+	a, b = read_journal(path_a), read_journal(path_b)
+	if types is not None:
+		codes = [EVENT_TYPES[t] for t in types]
+		a, b = a[np.isin(a['type'], codes)], b[np.isin(b['type'], codes)]
+
+	n = min(len(a), len(b))
+	fields = [f for f in RECORD_DTYPE.names if f != 'seq']
+	differs = np.zeros(n, dtype=bool)
+	for f in fields:
+		x, y = a[f][:n], b[f][:n]
+		if f in ID_FIELDS:
+			x, y = _first_seen_codes(a, f)[:n], _first_seen_codes(b, f)[:n]
+		if x.dtype.kind == 'f':
+			differs |= (x != y) & ~(np.isnan(x) & np.isnan(y))
+		else:
+			differs |= x != y
+
+	diverged = np.flatnonzero(differs)
+	if len(diverged):
+		i = int(diverged[0])
+		return i, decode_event(a[i]), decode_event(b[i])
+	if len(a) != len(b):
+		return (n, decode_event(a[n]) if n < len(a) else None,
+				decode_event(b[n]) if n < len(b) else None)
+	return None
+
+
+def _first_seen_codes(records, field):
+	"""
+	Replaces the ids (or OCO groups) of a journal field by their
+	order of first appearance among the order and parent ids (or
+	groups), unset values by -1.
+	"""
+	if field == 'oco_group':
+		values, unset = records['oco_group'], records['oco_group'] == b''
+		pool = values
+	else:
+		values, unset = records[field], records[field] < 0
+		pool = np.concatenate([records['order_id'], records['parent_id']])
+	ids, first = np.unique(pool, return_index=True)
+	# Record position of each id's first appearance
+	position = first % max(len(records), 1)
+	rank = np.empty(len(ids), dtype=np.int64)
+	rank[np.argsort(position, kind='stable')] = np.arange(len(ids))
+	codes = rank[np.searchsorted(ids, values)]
+	codes[unset] = -1
+	return codes
+
+
+def _describe(event):
+	if event is None:
+		return "<end of journal>"
+	return "{} {}".format(event.type, dict((k, v) for k, v in vars(event).items() if k != 'type'))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Report the first diverging event of two journals.")
+	parser.add_argument('journal_a')
+	parser.add_argument('journal_b')
+	parser.add_argument('--types', nargs='*', help="Event types to compare e.g. SIGNAL ORDER")
+	args = parser.parse_args()
+
+	result = diff_journals(args.journal_a, args.journal_b, args.types)
+	if result is None:
+		print("Journals match.")
+	else:
+		i, event_a, event_b = result
+		print("First divergence at event {}:".format(i))
+		print("  a: {}".format(_describe(event_a)))
+		print("  b: {}".format(_describe(event_b)))
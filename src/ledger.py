@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+"""
+Trade ledger kept in preallocated typed arrays. Fills are matched FIFO
+per symbol against the open lots as they arrive: each match closes a
+round trip (trade) with its realized PnL, holding period and maximum
+adverse / favourable excursion (MAE / MFE) computed there and then, so
+trade statistics are a vectorized pass over the trade arrays.
+
+The arrays double in size when full, so recording stays amortised O(1)
+per fill with millions of fills.
+"""
+
+NAT = np.iinfo(np.int64).min
+
+FILL_FIELDS = (('time', np.int64), ('bar', np.int64), ('symbol', np.int32),
+			   ('quantity', np.int64), ('price', np.float64), ('commission', np.float64))
+
+# Open lots form a linked list per symbol (next = -1 at the tail), the
+# open mask indexes them across symbols
+LOT_FIELDS = (('time', np.int64), ('bar', np.int64), ('symbol', np.int32),
+			  ('quantity', np.int64), ('price', np.float64), ('unit_commission', np.float64),
+			  ('low', np.float64), ('high', np.float64), ('next', np.int64), ('open', np.bool_))
+
+TRADE_FIELDS = (('symbol', np.int32), ('entry_time', np.int64), ('exit_time', np.int64),
+				('entry_bar', np.int64), ('exit_bar', np.int64), ('quantity', np.int64),
+				('entry_price', np.float64), ('exit_price', np.float64), ('pnl', np.float64),
+				('commission', np.float64), ('mae', np.float64), ('mfe', np.float64))
+
+
+def _to_ns(dt):
+	"""
+	Converts a datetime (or pandas Timestamp) to int64 ns.
+	"""
+	if dt is None:
+		return NAT
+	return int(np.datetime64(dt, 'ns').astype(np.int64))
+
+
+class _Table(object):
+	"""
+	Growable set of equal-length typed column arrays.
+	"""
+
+	def __init__(self, fields, capacity):
+		self.fields = fields
+		self.size = 0
+		self.columns = dict((name, np.empty(capacity, dtype=dtype)) for name, dtype in fields)
+
+	def append(self):
+		"""
+		Reserves the next row, doubling the arrays when full,
+		and returns its index.
+		"""
+		i = self.size
+		if i == len(self.columns[self.fields[0][0]]):
+			for name, dtype in self.fields:
+				grown = np.empty(max(2 * i, 16), dtype=dtype)
+				grown[:i] = self.columns[name]
+				self.columns[name] = grown
+		self.size = i + 1
+		return i
+
+	def view(self):
+		"""
+		Returns {field: array} of the filled rows.
+		"""
+		return dict((name, column[:self.size]) for name, column in self.columns.items())
+
+
+class TradeLedger(object):
+	"""
+	Records fills and matches opening and closing fills FIFO per
+	symbol into round-trip trades.
+
+	A fill reducing a position closes the oldest open lots first, a
+	lot partly closed stays open with the remaining quantity and a
+	fill reversing a position opens a new lot with the remainder.
+	Commissions are apportioned per unit to the trades a fill takes
+	part in, the trade pnl is before commission.
+
+	Holding periods are kept both in time (ns) and in bars, MAE and
+	MFE are the worst and best unrealized PnL of the lot over its
+	life, tracked from the bar highs and lows by update_prices().
+	"""
+
+	def __init__(self, symbol_list, capacity=1024):
+		"""
+		Parameters:
+			symbol_list - The symbols, fills are stored by index into it.
+			capacity - Initial number of fills / lots / trades allocated.
+		"""
+		self.symbol_list = symbol_list
+		self.symbol_index = dict((s, i) for i, s in enumerate(symbol_list))
+		n = len(symbol_list)
+
+		self.fills = _Table(FILL_FIELDS, capacity)
+		self.lots = _Table(LOT_FIELDS, capacity)
+		self.trades = _Table(TRADE_FIELDS, capacity)
+
+		self.head = np.full(n, -1, dtype=np.int64)
+		self.tail = np.full(n, -1, dtype=np.int64)
+		self.position = np.zeros(n, dtype=np.int64)
+		self.realized_pnl = np.zeros(n)
+		self.total_realized_pnl = 0.0
+		self.bar = 0
+		self._open_lots = None
+		# Lots before this index are all closed
+		self._first_open = 0
+
+	def record_fill(self, symbol, quantity, price, commission=0.0, timestamp=None):
+		"""
+		Records a fill and closes / opens lots for it.
+
+		Parameters:
+			symbol - The instrument filled.
+			quantity - Signed quantity, positive for a buy.
+			price - The fill price.
+			commission - The commission of the whole fill.
+			timestamp - Datetime of the fill.
+
+		Returns the realized PnL of the trades the fill closed.
+		"""
+		if quantity == 0:
+			return 0.0
+		i = self.symbol_index[symbol]
+		time = _to_ns(timestamp)
+		price = float(price)
+		unit_commission = float(commission) / abs(quantity)
+
+		f = self.fills.append()
+		fills = self.fills.columns
+		fills['time'][f] = time
+		fills['bar'][f] = self.bar
+		fills['symbol'][f] = i
+		fills['quantity'][f] = quantity
+		fills['price'][f] = price
+		fills['commission'][f] = commission
+
+		realized = 0.0
+		remaining = quantity
+		position = int(self.position[i])
+		while remaining and position and (position > 0) != (remaining > 0):
+			pnl, matched = self._close_head(i, remaining, price, unit_commission, time)
+			realized += pnl
+			step = matched if remaining > 0 else -matched
+			remaining -= step
+			position += step
+		self.position[i] = position + remaining
+		if remaining:
+			self._open_lot(i, remaining, price, unit_commission, time)
+
+		self.realized_pnl[i] += realized
+		self.total_realized_pnl += realized
+		return realized
+
+	def _open_lot(self, i, quantity, price, unit_commission, time):
+		k = self.lots.append()
+		lots = self.lots.columns
+		lots['time'][k] = time
+		lots['bar'][k] = self.bar
+		lots['symbol'][k] = i
+		lots['quantity'][k] = quantity
+		lots['price'][k] = price
+		lots['unit_commission'][k] = unit_commission
+		lots['low'][k] = price
+		lots['high'][k] = price
+		lots['next'][k] = -1
+		lots['open'][k] = True
+		if self.tail[i] < 0:
+			self.head[i] = k
+		else:
+			lots['next'][self.tail[i]] = k
+		self.tail[i] = k
+		self._open_lots = None
+
+	def _close_head(self, i, quantity, price, unit_commission, time):
+		"""
+		Closes up to |quantity| of the oldest open lot of symbol i
+		as one trade, returns its PnL and the quantity closed.
+		"""
+		lots = self.lots.columns
+		k = int(self.head[i])
+		lot_quantity = int(lots['quantity'][k])
+		matched = min(abs(quantity), abs(lot_quantity))
+		signed = matched if lot_quantity > 0 else -matched
+		entry_price = float(lots['price'][k])
+		pnl = signed * (price - entry_price)
+		# Excursions in the direction of the lot, including the exit price
+		low = min(float(lots['low'][k]), price)
+		high = max(float(lots['high'][k]), price)
+		adverse, favourable = (low, high) if signed > 0 else (high, low)
+
+		t = self.trades.append()
+		trades = self.trades.columns
+		trades['symbol'][t] = i
+		trades['entry_time'][t] = lots['time'][k]
+		trades['exit_time'][t] = time
+		trades['entry_bar'][t] = lots['bar'][k]
+		trades['exit_bar'][t] = self.bar
+		trades['quantity'][t] = signed
+		trades['entry_price'][t] = entry_price
+		trades['exit_price'][t] = price
+		trades['pnl'][t] = pnl
+		trades['commission'][t] = matched * (float(lots['unit_commission'][k]) + unit_commission)
+		trades['mae'][t] = min(signed * (adverse - entry_price), 0.0) + 0.0
+		trades['mfe'][t] = max(signed * (favourable - entry_price), 0.0)
+
+		if matched == abs(lot_quantity):
+			lots['open'][k] = False
+			self.head[i] = lots['next'][k]
+			if self.head[i] < 0:
+				self.tail[i] = -1
+			self._open_lots = None
+		else:
+			lots['quantity'][k] = lot_quantity - signed
+		return pnl, matched
+
+	def open_lot_index(self):
+		"""
+		Returns the indices of the open lots, rebuilt from the open
+		mask only after a lot has been opened or closed. Lots close
+		oldest first, so the scan starts at the first open lot.
+		"""
+		if self._open_lots is None:
+			is_open = self.lots.columns['open']
+			first, size = self._first_open, self.lots.size
+			while first < size and not is_open[first]:
+				first += 1
+			self._first_open = first
+			self._open_lots = np.flatnonzero(is_open[first:size]) + first
+		return self._open_lots
+
+	def advance_bar(self):
+		"""
+		Advances the bar count the holding periods are measured in,
+		without touching the open lots.
+		"""
+		self.bar += 1
+
+	def update_prices(self, high, low):
+		"""
+		Advances the bar count and widens the price range of every
+		open lot with the latest bar highs and lows (arrays aligned
+		with symbol_list), one vector operation for all lots.
+		"""
+		self.advance_bar()
+		idx = self.open_lot_index()
+		if not len(idx):
+			return
+		lots = self.lots.columns
+		symbols = lots['symbol'][idx]
+		lot_high, lot_low = high[symbols], low[symbols]
+		lots['high'][idx] = np.fmax(lots['high'][idx], lot_high)
+		lots['low'][idx] = np.fmin(lots['low'][idx], lot_low)
+
+	def get_trades(self):
+		"""
+		Returns the closed trades as {field: array}, with
+		holding_time (ns), holding_bars and net_pnl added.
+		"""
+		trades = self.trades.view()
+		trades['holding_time'] = trades['exit_time'] - trades['entry_time']
+		trades['holding_bars'] = trades['exit_bar'] - trades['entry_bar']
+		trades['net_pnl'] = trades['pnl'] - trades['commission']
+		return trades
+
+	def trades_frame(self):
+		"""
+		Returns the closed trades as a pandas DataFrame.
+		"""
+		import pandas as pd
+		trades = self.get_trades()
+		frame = pd.DataFrame(trades)
+		frame['symbol'] = np.asarray(self.symbol_list, dtype=object)[trades['symbol']]
+		for column in ('entry_time', 'exit_time'):
+			frame[column] = pd.to_datetime(trades[column])
+		frame['holding_time'] = pd.to_timedelta(trades['holding_time'])
+		return frame
+
+	def trade_stats(self):
+		"""
+		Returns a list of (name, value) tuples of trade statistics,
+		computed over all closed trades at once.
+		"""
+		trades = self.get_trades()
+		n = len(trades['pnl'])
+		if n == 0:
+			return [("Trades", "0")]
+		net = trades['net_pnl']
+		wins, losses = net[net > 0], net[net <= 0]
+		gross_loss = -losses.sum()
+		holding_time = trades['holding_time']
+		holding_time = holding_time[trades['entry_time'] != NAT]
+		mean_hours = holding_time.mean() / 3.6e12 if len(holding_time) else np.nan
+
+		return [("Trades", "%d" % n),
+				("Win Rate", "%0.2f%%" % (len(wins) / n * 100.0)),
+				("Average Win", "%0.2f" % (wins.mean() if len(wins) else 0.0)),
+				("Average Loss", "%0.2f" % (losses.mean() if len(losses) else 0.0)),
+				("Profit Factor", ("%0.2f" % (wins.sum() / gross_loss)) if gross_loss > 0 else "inf"),
+				("Expectancy", "%0.2f" % net.mean()),
+				("Realized PnL", "%0.2f" % net.sum()),
+				("Average Holding Bars", "%0.1f" % trades['holding_bars'].mean()),
+				("Average Holding Hours", "%0.2f" % mean_hours),
+				("Average MAE", "%0.2f" % trades['mae'].mean()),
+				("Average MFE", "%0.2f" % trades['mfe'].mean())]
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import numpy as np
+
+
+"""
+Memory accounting for backtests. A MemoryMonitor samples the size of the
+major engine structures (bar data, portfolio records, event bus, trade
+ledger) and the process RSS while a backtest runs, and reports the peak
+and growth rate of each so the structure behind a large footprint can be
+found and machine sizes planned.
+
+Sizes are estimates: containers larger than the sample size are measured
+on evenly spaced elements and scaled up, so a sample stays cheap on
+records of millions of bars. NumPy arrays and pandas objects report
+their buffer sizes.
+"""
+
+
+def _attr(*names):
+	"""
+	Returns a getter of a nested attribute of the backtest
+	(None if any part is missing).
+	"""
+	def get(backtest):
+		obj = backtest
+		for name in names:
+			obj = getattr(obj, name, None)
+			if obj is None:
+				return None
+		return obj
+	return get
+
+
+def _symbol_data(backtest):
+	"""
+	Returns the bar data behind symbol_data: the frames of
+	handlers whose symbol_data are generators over them (which
+	estimate_size cannot see through), else symbol_data.
+	"""
+	frames = _attr('data_handler', 'symbol_frames')(backtest)
+	return frames if frames else _attr('data_handler', 'symbol_data')(backtest)
+
+
+def _buffer_size(buf):
+	try:
+		return memoryview(buf).nbytes
+	except TypeError:
+		return 0
+
+
+# Engine structures sampled by default, name -> getter(backtest)
+DEFAULT_STRUCTURES = (
+	('symbol_data', _symbol_data),
+	('latest_symbol_data', _attr('data_handler', 'latest_symbol_data')),
+	('timeframe_data', _attr('data_handler', 'timeframe_data')),
+	('snapshots', _attr('data_handler', 'snapshots')),
+	('all_positions', _attr('portfolio', 'all_positions')),
+	('all_holdings', _attr('portfolio', 'all_holdings')),
+	('ledger', _attr('portfolio', 'ledger')),
+	('event_queue', _attr('events_queue')),
+	('fill_log', _attr('fill_log')),
+)
+
+
+def process_rss():
+	"""
+	Returns the resident set size of the process in bytes, the
+	peak RSS where the current value is not available.
+	"""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (IOError, OSError, ValueError):
+		import resource
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		# kilobytes on Linux, bytes on macOS
+		return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def estimate_size(obj, sample=64, max_depth=8, _seen=None, _depth=0):
+	"""
+	Estimates the memory held by obj and the objects it references.
+
+	Parameters:
+		obj - The object to measure.
+		sample - Containers longer than this are measured on sample
+			evenly spaced elements, scaled to their length.
+		max_depth - Nesting depth followed.
+	"""
+	if _seen is None:
+		_seen = set()
+	if obj is None or id(obj) in _seen:
+		return 0
+	_seen.add(id(obj))
+
+	if isinstance(obj, np.ndarray):
+		# Views count their header, the buffer they share once
+		owner = obj
+		while isinstance(owner, np.ndarray) and owner.base is not None:
+			owner = owner.base
+		while isinstance(owner, memoryview) and owner.obj is not None:
+			owner = owner.obj
+		if owner is obj:
+			return sys.getsizeof(obj)
+		size = sys.getsizeof(obj)
+		if id(owner) in _seen:
+			return size
+		_seen.add(id(owner))
+		return size + (sys.getsizeof(owner) if isinstance(owner, np.ndarray) else _buffer_size(owner))
+	if hasattr(obj, 'memory_usage') and hasattr(obj, 'dtypes'):
+		usage = obj.memory_usage(deep=False)
+		return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+
+	size = sys.getsizeof(obj)
+	if _depth >= max_depth or isinstance(obj, (str, bytes, int, float, bool)):
+		return size
+
+	recurse = lambda o: estimate_size(o, sample, max_depth, _seen, _depth + 1)
+	if isinstance(obj, dict):
+		items = list(obj.items()) if len(obj) <= sample else None
+		if items is None:
+			keys = list(obj)
+			step = len(keys) / float(sample)
+			items = [(k, obj[k]) for k in (keys[int(j * step)] for j in range(sample))]
+		measured = sum(recurse(k) + recurse(v) for k, v in items)
+		return size + int(measured * len(obj) / max(len(items), 1))
+	if isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == 'deque':
+		n = len(obj)
+		if n == 0:
+			return size
+		if n <= sample:
+			elements = list(obj)
+		elif isinstance(obj, (list, tuple)):
+			elements = [obj[int(j * n / float(sample))] for j in range(sample)]
+		else:
+			elements = [e for j, e in enumerate(obj) if j % (n // sample) == 0][:sample]
+		measured = sum(recurse(e) for e in elements)
+		return size + int(measured * n / float(len(elements)))
+	if hasattr(obj, '__dict__'):
+		size += recurse(vars(obj))
+	for name in getattr(type(obj), '__slots__', ()):
+		size += recurse(getattr(obj, name, None))
+	return size
+
+
+class MemoryMonitor(object):
+	"""
+	Samples the engine structure sizes and the process RSS during
+	simulate_trading, every interval_bars bars and/or every
+	interval_seconds seconds, and reports peak and growth per
+	structure with report().
+	"""
+
+	def __init__(self, interval_bars=100, interval_seconds=None, structures=None,
+				 sample=64, log_peaks=False):
+		"""
+		Parameters:
+			interval_bars - Sample every this many bars (None: off).
+			interval_seconds - Sample every this many seconds (None: off).
+			structures - Optional extra (name, getter(backtest)) pairs
+				sampled besides DEFAULT_STRUCTURES.
+			sample - Elements measured per container, see estimate_size.
+			log_peaks - Print each new RSS peak as it is reached.
+		"""
+		self.interval_bars = interval_bars
+		self.interval_seconds = interval_seconds
+		self.structures = list(DEFAULT_STRUCTURES) + list(structures or [])
+		self.names = [name for name, _ in self.structures] + ['rss']
+		self.sample = sample
+		self.log_peaks = log_peaks
+
+		self.bars = []
+		self.times = []
+		self.sizes = []
+		self.sample_seconds = 0.0
+		self._start = None
+		self._last_time = None
+		self._last_bar = None
+		self._peak_rss = 0
+
+	def sample_backtest(self, backtest, bar, force=False):
+		"""
+		Takes a sample if an interval has elapsed since the last
+		one (or force is set).
+
+		Parameters:
+			backtest - The running Backtest.
+			bar - Number of bars processed so far.
+			force - Sample regardless of the intervals.
+		"""
+		now = time.perf_counter()
+		if self._start is None:
+			self._start = now
+			force = True
+		if not force:
+			due_bars = self.interval_bars is not None and bar - self._last_bar >= self.interval_bars
+			due_time = self.interval_seconds is not None and now - self._last_time >= self.interval_seconds
+			if not (due_bars or due_time):
+				return
+		self._last_bar, self._last_time = bar, now
+
+		row = []
+		for name, getter in self.structures:
+			obj = getter(backtest)
+			row.append(0 if obj is None else estimate_size(obj, self.sample))
+		rss = process_rss()
+		row.append(rss)
+		if self.log_peaks and rss > self._peak_rss and self.sizes:
+			print("Memory: new RSS peak {:.1f} MB at bar {}".format(rss / 1e6, bar))
+		self._peak_rss = max(self._peak_rss, rss)
+
+		self.bars.append(bar)
+		self.times.append(now - self._start)
+		self.sizes.append(row)
+		self.sample_seconds += time.perf_counter() - now
+
+	def samples(self):
+		"""
+		Returns (bars, seconds, sizes) arrays, sizes with one column
+		per name in names.
+		"""
+		return (np.array(self.bars), np.array(self.times),
+				np.array(self.sizes, dtype=np.float64).reshape(len(self.sizes), len(self.names)))
+
+	def samples_frame(self):
+		"""
+		Returns the samples as a pandas DataFrame indexed by bar.
+		"""
+		import pandas as pd
+		bars, seconds, sizes = self.samples()
+		frame = pd.DataFrame(sizes, index=pd.Index(bars, name='bar'), columns=self.names)
+		frame.insert(0, 'seconds', seconds)
+		return frame
+
+	def growth(self):
+		"""
+		Returns {name: (last bytes, peak bytes, bytes per bar)}, the
+		growth rate being the least squares slope over the samples.
+		"""
+		bars, seconds, sizes = self.samples()
+		result = {}
+		for j, name in enumerate(self.names):
+			column = sizes[:, j]
+			slope = np.polyfit(bars, column, 1)[0] if len(np.unique(bars)) > 1 else 0.0
+			result[name] = (column[-1], column.max(), slope)
+		return result
+
+	def report(self):
+		"""
+		Returns the footprint report as a list of (name, value)
+		tuples, largest structures first.
+		"""
+		if not self.sizes:
+			return [("Memory Samples", "0")]
+		growth = self.growth()
+		rss = growth.pop('rss')
+		stats = [("Memory Samples", "%d over %d bars (%0.3fs sampling)" %
+					(len(self.sizes), self.bars[-1], self.sample_seconds)),
+				 ("RSS", "last %0.1f MB, peak %0.1f MB, %0.1f KB/bar" %
+					(rss[0] / 1e6, rss[1] / 1e6, rss[2] / 1e3))]
+		for name, (last, peak, slope) in sorted(growth.items(), key=lambda kv: -kv[1][1]):
+			if peak > 0:
+				stats.append((name, "last %0.2f MB, peak %0.2f MB, %0.2f KB/bar" %
+							  (last / 1e6, peak / 1e6, slope / 1e3)))
+		return stats
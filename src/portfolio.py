@@ -2,14 +2,13 @@
 # -*- coding: utf-8 -*-
 
 from eventhandler import FillEvent, OrderEvent
-from risk_metrics import calc_sharpe_ratio, calc_drawdowns
+from ledger import TradeLedger
 
 from math import floor
 
 import datetime
 import queue
 import numpy as np 
-import pandas as pd
 
 
 class Portfolio(object):
@@ -22,9 +21,17 @@ class Portfolio(object):
 
 	Holdings DataFrame - Total mrkt value for each symbol and
 	percentage changing in portfolio value per bar
+
+	Per-bar work only touches the symbols currently held: the
+	all_positions and all_holdings records are sparse (symbols
+	without a position are omitted) and are expanded to the full
+	symbol_list once, when the equity curve is created.
+
+	Every fill is also recorded in a TradeLedger (ledger), which
+	matches the fills into round-trip trades for trade statistics.
 	"""
 
-	def __init__(self, bars, events, start_data, initial_capital=10000.0):
+	def __init__(self, bars, events, start_date, initial_capital=10000.0, sizer=None):
 		"""
 		Initialises the portfolio with data bars and event queue.
 
@@ -33,24 +40,58 @@ class Portfolio(object):
 			events - eventhandler queue object
 			start_date - start date (bar) of portfolio
 			initial_capital
+			sizer - Optional PositionSizer. If given, the signals of a bar
+				are sized together by generate_sized_orders instead of
+				one at a time by generate_naive_order.
 		"""
 		self.bars = bars
 		self.events_queue = events
 		self.symbol_list = self.bars.symbol_list
 		self.start_date = start_date
 		self.initial_capital = initial_capital
+		self.sizer = sizer
+		self.pending_signals = {}
 
 		self.all_positions = self.construct_all_positions()
 		self.current_positions = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list] )
+		# Positions as a vector aligned with symbol_list for valuation
+		self.position_vector = np.zeros(len(self.symbol_list))
+		self.symbol_index = dict((s, i) for i, s in enumerate(self.symbol_list))
+		# Symbols with a non-zero position and their indices
+		self.held_symbols = set()
+		self._held_index = None
 		self.all_holdings = self.construct_all_holdings()
 		self.current_holdings = self.construct_current_holdings()
+		self.ledger = TradeLedger(self.symbol_list)
+
+		# Close prices of the sizer's lookback, written from the snapshot
+		# each bar into a buffer twice the window long so the window is a view
+		self._close_window = 0 if sizer is None else sizer.vol_lookback + 1
+		self._closes = np.full((len(self.symbol_list), 2 * self._close_window), np.nan)
+		self._close_pos = 0
+
+	def _update_closes(self):
+		"""
+		Writes the latest close snapshot into the sizer's price
+		buffer and returns the (symbols x lookback) window.
+		"""
+		pos, L = self._close_pos, self._close_window
+		latest = self.bars.get_latest_snapshot("adj_close")
+		self._closes[:, pos] = latest
+		self._closes[:, pos + L] = latest
+		self._close_pos = (pos + 1) % L
+		return self._close_history()
+
+	def _close_history(self):
+		pos, L = self._close_pos, self._close_window
+		return self._closes[:, pos:pos + L]
 
 	def construct_all_positions(self):
 		"""
 		Builds positions list using the start_date to
 		determine when the time index begins
 		"""
-		d = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list] )
+		d = {}
 		d['datetime'] = self.start_date
 		return [d]
 
@@ -58,7 +99,7 @@ class Portfolio(object):
 		"""
 		Builds the holdings list using the start_date
 		"""
-		d = dict( (k,v) for k,v in [(s,0.0) for s in self.symbol_list] )
+		d = {}
 		d['datetime'] = self.start_date
 		d['cash'] = self.initial_capital
 		d['commission'] = 0.0
@@ -84,33 +125,45 @@ class Portfolio(object):
 
 		Uses MarketEvent from events queue
 		"""
-		latest_datetime = self.bars.get_latest_bar_datetime(self.symbol_list[0])
-		# Update positions
-		dp = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list] )
+		# Signals of the previous bar not sized by end_of_bar (drivers
+		# that do not call it, e.g. journal replay)
+		if self.pending_signals:
+			self.generate_sized_orders()
+		if self.sizer is not None:
+			self._update_closes()
+
+		latest_datetime = getattr(self.bars, 'latest_datetime', None)
+		if latest_datetime is None:
+			latest_datetime = self.bars.get_latest_bar_datetime(self.symbol_list[0])
+		held_symbols, held_index = self.get_held_index()
+
+		# Update positions, held symbols only
+		dp = dict((s, self.current_positions[s]) for s in held_symbols)
 		dp['datetime'] = latest_datetime
-
-		for s in self.symbol_list:
-			dp[s] = self.current_positions[s]
 		# Append the current positions
 		self.all_positions.append(dp)
 
+		# Approximate real value of the held symbols at once
+		prices = self.bars.get_latest_snapshot("adj_close")
+		market_values = self.position_vector[held_index] * prices[held_index]
+
 		# Update holdings
-		dh = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list] )
+		dh = dict(zip(held_symbols, market_values.tolist()))
 		dh['datetime'] = latest_datetime
 		dh['cash'] = self.current_holdings['cash']
 		dh['commission'] = self.current_holdings['commission']
-		dh['total'] = self.current_holdings['cash']
-
-		for s in self.symbol_list:
-			# Approximate real value
-			market_value = self.current_positions[s] * \
-					self.bars.get_latest_bar_value(s, "adj_close")
-			dh[s] = market_value
-			dh['total'] += market_value
+		dh['total'] = self.current_holdings['cash'] + float(market_values.sum())
 
 		# Append the current holdings
 		self.all_holdings.append(dh)
 
+		# Track the price range of the open trades
+		if len(self.ledger.open_lot_index()):
+			self.ledger.update_prices(self.bars.get_latest_snapshot("high"),
+									  self.bars.get_latest_snapshot("low"))
+		else:
+			self.ledger.advance_bar()
+
 	def update_positions_from_fill(self, fill):
 		"""
 		Takes a Fill object and updates the position matrix to
@@ -128,6 +181,33 @@ class Portfolio(object):
 
 		# Update positions list with new quantities
 		self.current_positions[fill.symbol] += fill_dir*fill.quantity
+		self.position_vector[self.symbol_index[fill.symbol]] += fill_dir*fill.quantity
+
+		# Keep track of the held symbols
+		if self.current_positions[fill.symbol] != 0:
+			self.held_symbols.add(fill.symbol)
+		else:
+			self.held_symbols.discard(fill.symbol)
+		self._held_index = None
+
+	def get_held_index(self):
+		"""
+		Returns the held symbols (in symbol_list order) and their
+		indices into position_vector, rebuilt only after a fill
+		has changed the set of held symbols.
+		"""
+		if self._held_index is None:
+			held = sorted(self.held_symbols, key=self.symbol_index.get)
+			self._held_index = (held, np.array([self.symbol_index[s] for s in held], dtype=np.intp))
+		return self._held_index
+
+	def get_positions_snapshot(self):
+		"""
+		Returns the current position of every symbol as a NumPy
+		array aligned with symbol_list. The dense array is only
+		copied when requested, e.g. by a strategy.
+		"""
+		return self.position_vector.copy()
 
 	def update_holdings_from_fill(self, fill):
 		"""
@@ -143,14 +223,21 @@ class Portfolio(object):
 		if fill.direction == 'SELL':
 			fill_dir = -1
 
-		# Update holdings list with new quantities
-		fill_cost = self.bars.get_latest_bar_value(fill.symbol_list, "adj_close")
+		# Update holdings list with new quantities, fills without
+		# a price (simulated market orders) are booked at the bar price
+		fill_cost = fill.fill_cost
+		if fill_cost is None:
+			fill_cost = self.bars.get_latest_bar_value(fill.symbol, "adj_close")
 		cost = fill_dir * fill_cost * fill.quantity
 		self.current_holdings[fill.symbol] += cost
 		self.current_holdings['commission'] += fill.commission
 		self.current_holdings['cash'] -= (cost + fill.commission)
 		self.current_holdings['total'] -= (cost + fill.commission)
 
+		timestamp = getattr(self.bars, 'latest_datetime', None) or fill.timeindex
+		self.ledger.record_fill(fill.symbol, fill_dir * fill.quantity, fill_cost,
+								fill.commission, timestamp)
+
 	def update_fill(self, event):
 		"""
 		Update the current portfolio positions and holdings
@@ -192,30 +279,103 @@ class Portfolio(object):
 
 		return order
 
+	def generate_sized_orders(self):
+		"""
+		Sizes all pending signals at once with the PositionSizer and
+		places an order for the difference between each target and
+		current position. Positions in symbols without a new signal
+		are left alone but count towards the gross exposure cap.
+		The return statistics come from the close window kept by
+		update_timeindex. With no positive equity only exits are
+		placed.
+		"""
+		signals = self.pending_signals
+		self.pending_signals = {}
+		symbols = list(signals)
+
+		snapshot = self.bars.get_latest_snapshot("adj_close")
+		idx = [self.symbol_index[s] for s in symbols]
+		prices = snapshot[idx]
+		mean_returns, volatility = self.sizer.return_stats(self._close_history()[idx])
+
+		direction = np.array([{'LONG': 1.0, 'SHORT': -1.0}.get(signals[s].signal_type, 0.0) for s in symbols])
+		strength = np.array([1.0 if signals[s].strength is None else abs(signals[s].strength) for s in symbols])
+
+		equity = self.all_holdings[-1]['total']
+		if equity > 0:
+			others = self.position_vector.copy()
+			others[idx] = 0.0
+			held = others != 0
+			fixed_gross = np.dot(np.abs(others[held]), snapshot[held]) / equity
+			targets = self.sizer.target_quantities(equity, prices, volatility, direction * strength,
+												   mean_returns, fixed_gross)
+		else:
+			# Nothing to size new exposure on, exits only
+			targets = np.where(direction == 0, 0.0, self.position_vector[idx])
+		order_type = 'MKT'
+		for s, target in zip(symbols, targets):
+			delta = int(target) - self.current_positions[s]
+			if delta > 0:
+				self.events_queue.put(OrderEvent(s, order_type, delta, 'BUY'))
+			elif delta < 0:
+				self.events_queue.put(OrderEvent(s, order_type, -delta, 'SELL'))
+
+	def end_of_bar(self):
+		"""
+		Called by the Backtest once the events of a bar have been
+		handled: sizes the signals held back by update_signal, so
+		their orders are filled on the bar the signals came from.
+		Returns True if orders were generated.
+		"""
+		if not self.pending_signals:
+			return False
+		self.generate_sized_orders()
+		return True
+
 	def update_signal(self, event):
 		"""
-		Uses SignalEvent to generate new order based on portfolio rules
+		Uses SignalEvent to generate new order based on portfolio rules.
+		With a sizer the signal is held until the end of the bar (see
+		end_of_bar) so that all signals of a bar are sized together.
 		"""
 		if event.type == 'SIGNAL':
+			if self.sizer is not None:
+				self.pending_signals[event.symbol] = event
+				return
 			order_event = self.generate_naive_order(event)
-			self.events_queue.put(order_event)
+			if order_event is not None:
+				self.events_queue.put(order_event)
 
 	def create_equity_curve(self):
 		"""
 		Creates a pandas DataFrame from the all_holdings
-		list of dictionaries.
+		list of dictionaries, filling in zero holdings for the
+		symbols omitted from the sparse records.
 		"""
-		curve = pd.DataFrame(self.all_holdings)
+		# pandas is only needed once results are built
+		import pandas as pd
+		columns = list(self.symbol_list) + ['datetime', 'cash', 'commission', 'total']
+		curve = pd.DataFrame(self.all_holdings).reindex(columns=columns)
+		curve[self.symbol_list] = curve[self.symbol_list].fillna(0.0)
 		curve.set_index('datetime', inplace=True)
 		curve['returns'] = curve['total'].pct_change()
 		curve['equity_curve'] = (1.0 + curve['returns']).cumprod()
 		self.equity_curve = curve
 
-	def output_summary_stats(self, period='minute'):
+	def output_summary_stats(self, period='minute', bootstrap_samples=0, alpha=0.05):
 		"""
 		Creates a list of summary statistics for the portfolio
+
+		Parameters:
+			period - Bar period used to annualise the Sharpe ratio.
+			bootstrap_samples - If > 0, number of stationary bootstrap
+				paths used to add confidence intervals to the stats.
+			alpha - Significance level of the confidence intervals.
 		"""
-		total_return = self.equity_curve['equity_curve'][-1]
+		from risk_metrics import calc_sharpe_ratio, calc_drawdowns
+		from resampling import bootstrap_confidence_intervals
+
+		total_return = self.equity_curve['equity_curve'].iloc[-1]
 		returns = self.equity_curve['returns']
 		pnl = self.equity_curve['equity_curve']
 
@@ -228,6 +388,17 @@ class Portfolio(object):
 				 ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
 				 ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)),
 				 ("Drawdown Duration", "%d" % dd_duration)]
+
+		if bootstrap_samples > 0:
+			ci = bootstrap_confidence_intervals(returns, num_samples=bootstrap_samples,
+												period=period, alpha=alpha)
+			level = (1.0 - alpha) * 100.0
+			stats += [("Total Return %0.0f%% CI" % level, "(%0.2f%%, %0.2f%%)" % 
+						(ci['total_return'][1] * 100.0, ci['total_return'][2] * 100.0)),
+					  ("Sharpe Ratio %0.0f%% CI" % level, "(%0.2f, %0.2f)" % 
+						(ci['sharpe_ratio'][1], ci['sharpe_ratio'][2])),
+					  ("Max Drawdown %0.0f%% CI" % level, "(%0.2f%%, %0.2f%%)" % 
+						(ci['max_drawdown'][1] * 100.0, ci['max_drawdown'][2] * 100.0))]
 				 
 		self.equity_curve.to_csv('equity.csv')
 		return stats
@@ -0,0 +1,347 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import collections
+import math
+import time
+import numpy as np
+
+
+class PreTradeRiskGate(object):
+	"""
+	Pre-trade risk checks in the ORDER path, between the Portfolio
+	and the ExecutionHandler. Every check works off counters that
+	are updated incrementally as orders are approved and filled, so
+	each one is O(1) regardless of the number of symbols or orders:
+
+		order_size - quantity and notional of a single order
+		position - absolute position per symbol after the order
+		exposure - gross and net notional exposure after the order
+		rate - token bucket throttle on the order rate
+		price_band - fat-finger band around the reference price
+			for orders carrying a price (e.g. limits)
+
+	Positions count both filled and approved but unfilled (pending)
+	quantities. Exposure marks each symbol at its latest price when
+	it is ordered and on update_prices(), which revalues the whole
+	book in one vector operation per bar.
+
+	Orders with a parent_id (bracket exits) are held while their
+	parent is unfilled, they are checked and booked as pending when
+	the execution handler activates them (on_activate), which cancels
+	them if they fail. The orders of an oco_group are booked once,
+	with the quantity of the first, as at most one of them fills;
+	fills carrying an order_id hand the booking over to the filled
+	order.
+
+	Rejected orders are kept in rejections and the time spent in each
+	check is accumulated, see latency_report().
+	"""
+
+	CHECKS = ('order_size', 'position', 'exposure', 'rate', 'price_band')
+
+	def __init__(self, max_order_qty=None, max_order_notional=None, max_position=None,
+				 max_gross=None, max_net=None, max_orders_per_sec=None, burst=None,
+				 price_band=None, clock=None, measure_latency=True):
+		"""
+		Parameters:
+			max_order_qty - Maximum quantity of one order.
+			max_order_notional - Maximum price * quantity of one order.
+			max_position - Maximum absolute position per symbol.
+			max_gross - Maximum sum of absolute notional exposures.
+			max_net - Maximum absolute net notional exposure.
+			max_orders_per_sec - Sustained order rate allowed.
+			burst - Orders allowed back to back (default: one second's worth).
+			price_band - Maximum relative distance of an order price from
+				the reference price e.g. 0.05 for 5%.
+			clock - Callable returning seconds for the throttle, by
+				default the clock given to attach() (the bar time in
+				a backtest) or else time.monotonic.
+			measure_latency - Time each check with perf_counter_ns.
+
+		A limit of None disables the corresponding check.
+		"""
+		self.max_order_qty = max_order_qty
+		self.max_order_notional = max_order_notional
+		self.max_position = max_position
+		self.max_gross = max_gross
+		self.max_net = max_net
+		self.max_orders_per_sec = max_orders_per_sec
+		self.burst = burst if burst is not None else max(max_orders_per_sec or 1, 1)
+		self.price_band = price_band
+		self.clock = clock or time.monotonic
+		self._clock_given = clock is not None
+		self.measure_latency = measure_latency
+
+		self._tokens = float(self.burst)
+		self._last_refill = None
+
+		self.bars = None
+		self.symbol_index = {}
+		self.rejections = []
+		self.waiting = {}
+		# oco_group -> [booked signed quantity, live order ids]
+		self.oco = {}
+		self.oco_of = {}
+		self.approved = 0
+		self.reject_counts = collections.Counter()
+		self.check_ns = dict((c, 0) for c in self.CHECKS)
+		self.check_max_ns = dict((c, 0) for c in self.CHECKS)
+		self.check_calls = dict((c, 0) for c in self.CHECKS)
+
+		self._checks = [
+			('order_size', self._check_order_size),
+			('position', self._check_position),
+			('exposure', self._check_exposure),
+			('rate', self._check_rate),
+			('price_band', self._check_price_band),
+		]
+
+	def attach(self, bars, clock=None):
+		"""
+		Binds the gate to a DataHandler for reference prices and
+		sizes the per-symbol counters to its symbol_list.
+
+		Parameters:
+			bars - The DataHandler.
+			clock - Optional clock for the throttle, e.g. returning the
+				bar time in seconds so a backtest's rejections do not
+				depend on the machine's speed. A clock given to the
+				constructor takes precedence.
+		"""
+		self.bars = bars
+		if clock is not None and not self._clock_given:
+			self.clock = clock
+			self._last_refill = None
+		self.symbol_index = dict((s, i) for i, s in enumerate(bars.symbol_list))
+		n = len(bars.symbol_list)
+		self.filled = np.zeros(n)
+		self.pending = np.zeros(n)
+		self.notional = np.zeros(n)
+		self.gross = 0.0
+		self.net = 0.0
+
+	def _reference_price(self, i):
+		return float(self.bars.get_latest_snapshot("adj_close")[i])
+
+	def _set_notional(self, i, value):
+		old = self.notional[i]
+		self.gross += abs(value) - abs(old)
+		self.net += value - old
+		self.notional[i] = value
+
+	def _check_order_size(self, order, ctx):
+		if self.max_order_qty is not None and order.quantity > self.max_order_qty:
+			return "quantity {} > {}".format(order.quantity, self.max_order_qty)
+		if self.max_order_notional is not None:
+			notional = abs(ctx['price'] * order.quantity)
+			if not notional <= self.max_order_notional:
+				return "notional {:.2f} > {:.2f}".format(notional, self.max_order_notional)
+		return None
+
+	def _check_position(self, order, ctx):
+		if self.max_position is not None and abs(ctx['new_position']) > self.max_position:
+			return "position {} > {}".format(ctx['new_position'], self.max_position)
+		return None
+
+	def _check_exposure(self, order, ctx):
+		if self.max_gross is None and self.max_net is None:
+			return None
+		i, price = ctx['index'], ctx['price']
+		new_notional = ctx['new_position'] * price
+		old = self.notional[i]
+		gross = self.gross + abs(new_notional) - abs(old)
+		net = self.net + new_notional - old
+		if self.max_gross is not None and not gross <= self.max_gross:
+			return "gross exposure {:.2f} > {:.2f}".format(gross, self.max_gross)
+		if self.max_net is not None and not abs(net) <= self.max_net:
+			return "net exposure {:.2f} > {:.2f}".format(net, self.max_net)
+		return None
+
+	def _check_rate(self, order, ctx):
+		if self.max_orders_per_sec is None:
+			return None
+		now = self.clock()
+		if self._last_refill is not None:
+			self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.max_orders_per_sec)
+		self._last_refill = now
+		if self._tokens < 1.0:
+			return "order rate above {}/s".format(self.max_orders_per_sec)
+		return None
+
+	def _check_price_band(self, order, ctx):
+		price = getattr(order, 'price', None)
+		if price is None:
+			price = getattr(order, 'stop_price', None)
+		if self.price_band is None or price is None:
+			return None
+		reference = ctx['price']
+		if not abs(price / reference - 1.0) <= self.price_band:
+			return "price {} outside {:.1%} of {}".format(price, self.price_band, reference)
+		return None
+
+	def check(self, order):
+		"""
+		Runs the checks on an OrderEvent. Returns True and books the
+		order as pending if it passes, otherwise records the
+		rejection and returns False. Orders with a parent_id are
+		held and checked by on_activate.
+		"""
+		i = self.symbol_index.get(order.symbol)
+		if i is None:
+			return self._reject(order, 'symbol', "unknown symbol")
+		if getattr(order, 'parent_id', None) is not None:
+			# Checked and booked once the parent has filled, see on_activate
+			self.waiting[order.order_id] = order
+			return True
+		return self._check_and_book(order, i)
+
+	def _check_and_book(self, order, i):
+		"""
+		Runs the checks on an order of symbol index i and books it
+		if it passes.
+		"""
+		price = self._reference_price(i)
+		if math.isnan(price):
+			return self._reject(order, 'price_band', "no reference price")
+
+		signed = order.quantity if order.direction == 'BUY' else -order.quantity
+		# An oco_group is booked once, its orders replace that booking
+		entry = self.oco.get(getattr(order, 'oco_group', None))
+		booked = entry[0] if entry is not None else 0
+		ctx = {'index': i, 'price': price, 'signed': signed,
+			   'new_position': self.filled[i] + self.pending[i] - booked + signed}
+
+		measure = self.measure_latency
+		for name, check in self._checks:
+			if measure:
+				start = time.perf_counter_ns()
+				reason = check(order, ctx)
+				elapsed = time.perf_counter_ns() - start
+				self.check_ns[name] += elapsed
+				self.check_calls[name] += 1
+				if elapsed > self.check_max_ns[name]:
+					self.check_max_ns[name] = elapsed
+			else:
+				reason = check(order, ctx)
+			if reason is not None:
+				return self._reject(order, name, reason)
+
+		# Book the approved order
+		if self.max_orders_per_sec is not None:
+			self._tokens -= 1.0
+		self._book(order, i, signed, price)
+		self.approved += 1
+		return True
+
+	def _book(self, order, i, signed, price):
+		"""
+		Books an order as pending, once per oco_group.
+		"""
+		group = getattr(order, 'oco_group', None)
+		if group is not None:
+			self.oco_of[order.order_id] = group
+			entry = self.oco.get(group)
+			if entry is not None:
+				entry[1].add(order.order_id)
+				return
+			self.oco[group] = [signed, set([order.order_id])]
+		self.pending[i] += signed
+		self._set_notional(i, (self.filled[i] + self.pending[i]) * price)
+
+	def on_activate(self, order):
+		"""
+		Checks a child order once its parent has filled and books it
+		as pending if it passes. Returns False if it is rejected, the
+		execution handler then cancels it.
+		"""
+		if order.order_id not in self.waiting:
+			return True
+		if not self._check_and_book(order, self.symbol_index[order.symbol]):
+			# Left waiting, so its cancellation releases nothing
+			return False
+		del self.waiting[order.order_id]
+		return True
+
+	def _reject(self, order, check, reason):
+		self.rejections.append((check, order.symbol, order.direction, order.quantity, reason))
+		self.reject_counts[check] += 1
+		return False
+
+	def on_fill(self, fill):
+		"""
+		Moves a filled quantity from pending to filled.
+		"""
+		group = self.oco_of.pop(getattr(fill, 'order_id', None), None)
+		if group is not None:
+			# The group's booking is now this fill's, the other
+			# orders of the group release nothing when cancelled
+			entry = self.oco[group]
+			entry[0] = 0
+			entry[1].discard(fill.order_id)
+			if not entry[1]:
+				del self.oco[group]
+		i = self.symbol_index[fill.symbol]
+		signed = fill.quantity if fill.direction == 'BUY' else -fill.quantity
+		self.pending[i] -= signed
+		self.filled[i] += signed
+
+	def on_cancel(self, order, quantity=None):
+		"""
+		Releases the unfilled quantity of a cancelled or rejected order.
+		"""
+		order_id = getattr(order, 'order_id', None)
+		if self.waiting.pop(order_id, None) is not None:
+			# Never booked
+			return
+		i = self.symbol_index[order.symbol]
+		quantity = order.quantity if quantity is None else quantity
+		signed = quantity if order.direction == 'BUY' else -quantity
+		group = self.oco_of.pop(order_id, None)
+		if group is not None:
+			# The group's booking is released with its last order
+			entry = self.oco[group]
+			entry[1].discard(order_id)
+			if entry[1]:
+				return
+			del self.oco[group]
+			signed = entry[0]
+		self.pending[i] -= signed
+		self._set_notional(i, (self.filled[i] + self.pending[i]) * self._reference_price(i))
+
+	def update_prices(self):
+		"""
+		Revalues the exposure counters at the latest prices.
+		"""
+		prices = self.bars.get_latest_snapshot("adj_close")
+		positions = self.filled + self.pending
+		held = positions != 0
+		self.notional[:] = 0.0
+		self.notional[held] = positions[held] * prices[held]
+		self.notional[np.isnan(self.notional)] = 0.0
+		self.gross = float(np.abs(self.notional).sum())
+		self.net = float(self.notional.sum())
+
+	def latency_report(self):
+		"""
+		Returns {check: (calls, mean microseconds, max microseconds)}.
+		"""
+		report = {}
+		for name in self.CHECKS:
+			calls = self.check_calls[name]
+			if calls:
+				report[name] = (calls, self.check_ns[name] / calls / 1e3, self.check_max_ns[name] / 1e3)
+		return report
+
+	def summary(self):
+		"""
+		Returns a list of (name, value) tuples for printing
+		alongside the performance stats.
+		"""
+		stats = [("Orders Approved", "%d" % self.approved),
+				 ("Orders Rejected", "%d" % len(self.rejections))]
+		for check, count in sorted(self.reject_counts.items()):
+			stats.append(("Rejected (%s)" % check, "%d" % count))
+		for name, (calls, mean_us, max_us) in self.latency_report().items():
+			stats.append(("Check %s" % name, "mean %0.2fus, max %0.2fus over %d" % (mean_us, max_us, calls)))
+		return stats
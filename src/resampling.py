@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from risk_metrics import PERIODS
+
+import multiprocessing
+import numpy as np
+
+
+"""
+Resampling of strategy returns to put confidence intervals
+around the point estimates reported by Portfolio.output_summary_stats.
+
+Every resampler returns an index matrix of shape (num_samples, n) so
+that a whole batch of resampled return paths is a single fancy-index
+of the original returns, and every statistic below is computed along
+axis 1 of that matrix in one pass.
+"""
+
+
+def stationary_bootstrap_indices(n, num_samples, block_size, rng):
+	"""
+	Politis & Romano stationary bootstrap. Blocks start at a random
+	bar and have geometrically distributed length with mean block_size,
+	wrapping around the end of the series.
+
+	Parameters:
+		n - Length of the original returns series.
+		num_samples - Number of resampled paths.
+		block_size - Expected block length in bars.
+		rng - numpy Generator used for all draws.
+	"""
+	starts = rng.integers(0, n, size=(num_samples, n))
+	new_block = rng.random((num_samples, n)) < (1.0 / block_size)
+	new_block[:, 0] = True
+
+	# Position at which the block covering each bar was started
+	steps = np.arange(n)
+	block_pos = np.maximum.accumulate(np.where(new_block, steps, 0), axis=1)
+	block_start = np.take_along_axis(starts, block_pos, axis=1)
+	return (block_start + (steps - block_pos)) % n
+
+def block_bootstrap_indices(n, num_samples, block_size, rng):
+	"""
+	Moving block bootstrap with fixed length blocks drawn
+	uniformly from the original series.
+
+	Parameters:
+		n - Length of the original returns series.
+		num_samples - Number of resampled paths.
+		block_size - Length of each block in bars.
+		rng - numpy Generator used for all draws.
+	"""
+	block_size = int(min(max(block_size, 1), n))
+	num_blocks = -(-n // block_size)
+	starts = rng.integers(0, n - block_size + 1, size=(num_samples, num_blocks))
+	idx = starts[:, :, None] + np.arange(block_size)
+	return idx.reshape(num_samples, -1)[:, :n]
+
+def shuffle_indices(n, num_samples, block_size, rng):
+	"""
+	Return-order shuffling i.e. a permutation of the original bar
+	returns without replacement. block_size is unused and only
+	kept so all resamplers share one signature.
+
+	A permutation leaves the total return and Sharpe ratio of a
+	path unchanged, so only the path dependent statistics (max
+	drawdown) get an interval, see SHUFFLE_INVARIANT.
+
+	Parameters:
+		n - Length of the original returns series.
+		num_samples - Number of resampled paths.
+		block_size - Ignored.
+		rng - numpy Generator used for all draws.
+	"""
+	return np.argsort(rng.random((num_samples, n)), axis=1)
+
+# Statistics every permutation of the returns leaves unchanged
+SHUFFLE_INVARIANT = ('total_return', 'sharpe_ratio')
+
+RESAMPLERS = {
+	'stationary': stationary_bootstrap_indices,
+	'block': block_bootstrap_indices,
+	'shuffle': shuffle_indices
+}
+
+def resample_returns(returns, num_samples=1000, method='stationary', block_size=20, seed=None):
+	"""
+	Generates num_samples resampled return paths as one
+	(num_samples, n) numpy array.
+
+	Parameters:
+		returns - Series or array of period percentage returns (NaNs dropped).
+		num_samples - Number of resampled paths.
+		method - 'stationary', 'block' or 'shuffle'
+		block_size - (Expected) block length in bars for the bootstraps.
+		seed - Seed or SeedSequence for reproducible draws.
+	"""
+	rets = _clean_returns(returns)
+	rng = np.random.default_rng(seed)
+	idx = RESAMPLERS[method](len(rets), num_samples, block_size, rng)
+	return rets[idx]
+
+def calc_total_returns(paths):
+	"""
+	Total compounded return of every path (row).
+	"""
+	return np.prod(1.0 + paths, axis=1) - 1.0
+
+def calc_sharpe_ratios(paths, period='day'):
+	"""
+	Sharpe ratio of every path (row), using the same
+	annualisation and zero risk-free rate as calc_sharpe_ratio.
+	"""
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.sqrt(PERIODS[period]) * paths.mean(axis=1) / paths.std(axis=1)
+
+def calc_max_drawdowns(paths):
+	"""
+	Largest peak-to-trough drawdown of the equity curve of every
+	path (row), measured as in calc_drawdowns i.e. high water mark
+	minus equity with the curve starting at 1.0.
+	"""
+	equity = np.cumprod(1.0 + paths, axis=1)
+	hwm = np.maximum(np.maximum.accumulate(equity, axis=1), 1.0)
+	return (hwm - equity).max(axis=1)
+
+def calc_path_stats(paths, period='day'):
+	"""
+	Returns a dict of per-path statistic arrays.
+	"""
+	return {
+		'total_return': calc_total_returns(paths),
+		'sharpe_ratio': calc_sharpe_ratios(paths, period),
+		'max_drawdown': calc_max_drawdowns(paths)
+	}
+
+def _clean_returns(returns):
+	"""
+	Converts returns to a float array and drops the NaNs
+	e.g. the first bar of a pct_change() series.
+	"""
+	rets = np.asarray(returns, dtype=np.float64)
+	return rets[~np.isnan(rets)]
+
+def _resample_chunk(args):
+	"""
+	Pool worker: resamples one chunk of paths and reduces it to
+	its statistics, so only small arrays are sent back.
+	"""
+	rets, num_samples, method, block_size, seed_seq, period = args
+	rng = np.random.default_rng(seed_seq)
+	idx = RESAMPLERS[method](len(rets), num_samples, block_size, rng)
+	return calc_path_stats(rets[idx], period)
+
+def bootstrap_confidence_intervals(returns, num_samples=5000, method='stationary',
+									block_size=20, period='day', alpha=0.05,
+									seed=None, processes=1, chunk_size=1000):
+	"""
+	Computes (lower, upper) percentile confidence intervals for the
+	total return, Sharpe ratio and max drawdown of a strategy by
+	resampling its returns.
+
+	The paths are generated in chunks of chunk_size so that memory
+	stays bounded; with processes > 1 the chunks are spread over a
+	multiprocessing Pool, each with an independent child seed.
+
+	Parameters:
+		returns - Series or array of period percentage returns.
+		num_samples - Total number of resampled paths.
+		method - 'stationary', 'block' or 'shuffle'
+		block_size - (Expected) block length in bars for the bootstraps.
+		period - Bar period used to annualise the Sharpe ratio.
+		alpha - Two-sided significance level e.g. 0.05 for a 95% interval.
+		seed - Seed for reproducible draws.
+		processes - Number of worker processes (None for all cores).
+		chunk_size - Paths resampled per chunk.
+
+	Returns:
+		dict of statistic name -> (point estimate, lower, upper),
+		without the SHUFFLE_INVARIANT statistics for 'shuffle'
+	"""
+	rets = _clean_returns(returns)
+	sizes = [chunk_size] * (num_samples // chunk_size)
+	if num_samples % chunk_size:
+		sizes.append(num_samples % chunk_size)
+
+	seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+	jobs = [(rets, size, method, block_size, s, period) for size, s in zip(sizes, seeds)]
+
+	if processes == 1 or len(jobs) == 1:
+		results = [_resample_chunk(job) for job in jobs]
+	else:
+		with multiprocessing.Pool(processes) as pool:
+			results = pool.map(_resample_chunk, jobs)
+
+	point = calc_path_stats(rets[None, :], period)
+	intervals = {}
+	for stat in point:
+		if method == 'shuffle' and stat in SHUFFLE_INVARIANT:
+			# Zero width interval, not a measure of uncertainty
+			continue
+		values = np.concatenate([r[stat] for r in results])
+		lower, upper = np.nanpercentile(values, [100.0 * alpha / 2, 100.0 * (1 - alpha / 2)])
+		intervals[stat] = (point[stat][0], lower, upper)
+	return intervals
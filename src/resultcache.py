@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import functools
+import gzip
+import hashlib
+import json
+import os, os.path
+import pickle
+import sys
+import time
+
+
+"""
+Content-addressed cache of backtest results. A result is keyed by the
+hashes of the input data files, the data handler, strategy, portfolio,
+execution handler and event bus classes (their module source) and
+parameters, the portfolio settings and the engine version, so any change
+to an input misses while reruns of an identical configuration are loaded
+from disk.
+"""
+
+# Bump when the engine changes results in a way the source hashes miss
+ENGINE_VERSION = '1'
+
+# Modules whose source makes up the engine
+ENGINE_MODULES = ('backtest', 'portfolio', 'eventhandler', 'executionhandler',
+				  'datahandler', 'timeframes', 'sizing', 'pretrade', 'risk_metrics', 'ledger')
+
+
+def _sha1_file(path):
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			h.update(block)
+	return h.hexdigest()
+
+
+def _module_hash(module_name):
+	"""
+	Hash of a module's source file, '' if it has none.
+	"""
+	module = sys.modules.get(module_name)
+	if module is None:
+		try:
+			module = __import__(module_name)
+		except ImportError:
+			return ''
+	path = getattr(module, '__file__', None)
+	return _sha1_file(path) if path and path.endswith('.py') else ''
+
+
+def component_signature(component):
+	"""
+	Describes a component class, or a functools.partial of one with
+	bound parameters, by its name, module source hash and parameters.
+	"""
+	params = {}
+	while isinstance(component, functools.partial):
+		params.update(component.keywords)
+		component = component.func
+	name = "{}.{}".format(getattr(component, '__module__', ''), getattr(component, '__qualname__', repr(component)))
+	return [name, _module_hash(getattr(component, '__module__', '')), repr(sorted(params.items()))]
+
+
+class ResultCache(object):
+	"""
+	On-disk store of backtest results (equity curve, fills, summary
+	stats and event counts), one gzipped pickle per key, bounded to
+	max_bytes by evicting the least recently used results.
+	"""
+
+	def __init__(self, cache_dir='.backtest_cache', max_bytes=512 * 1024 ** 2):
+		"""
+		Parameters:
+			cache_dir - Directory holding the results and the index.
+			max_bytes - Total size of the stored results kept.
+		"""
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+		self._index_path = os.path.join(cache_dir, 'index.json')
+		if os.path.exists(self._index_path):
+			with open(self._index_path) as f:
+				self.index = json.load(f)
+		else:
+			self.index = {'entries': {}, 'files': {}}
+
+	def _save_index(self):
+		tmp = self._index_path + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(self.index, f)
+		os.replace(tmp, self._index_path)
+
+	def file_hash(self, path):
+		"""
+		Content hash of a data file, memoised on (mtime, size) so
+		unchanged files are not read again.
+		"""
+		stat = os.stat(path)
+		memo = self.index['files'].get(path)
+		if memo is not None and memo[0] == stat.st_mtime and memo[1] == stat.st_size:
+			return memo[2]
+		digest = _sha1_file(path)
+		self.index['files'][path] = [stat.st_mtime, stat.st_size, digest]
+		return digest
+
+	def make_key(self, backtest):
+		"""
+		Returns the cache key of a (not yet run) Backtest.
+		"""
+		data_files = [os.path.join(backtest.csv_dir, "{}.csv".format(s)) for s in backtest.symbol_list]
+		parts = [
+			ENGINE_VERSION,
+			[_module_hash(m) for m in ENGINE_MODULES],
+			[self.file_hash(p) if os.path.exists(p) else p for p in data_files],
+			list(backtest.symbol_list),
+			repr(backtest.initial_capital),
+			repr(backtest.start_date),
+		]
+		for component in (backtest.dataHandler_class, backtest.strategy_class,
+						  backtest.portfolio_class, backtest.executionHandler_class,
+						  backtest.eventBus_class):
+			parts.append(component_signature(component))
+		if backtest.risk_gate is not None:
+			parts.append(repr(sorted((k, v) for k, v in vars(backtest.risk_gate).items()
+									 if k.startswith('max_') or k in ('burst', 'price_band'))))
+		return hashlib.sha1(json.dumps(parts, default=repr).encode('utf-8')).hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self.cache_dir, "{}.pkl.gz".format(key))
+
+	def get(self, key):
+		"""
+		Returns the stored results of key or None.
+		"""
+		entry = self.index['entries'].get(key)
+		if entry is None or not os.path.exists(self._path(key)):
+			return None
+		with gzip.open(self._path(key), 'rb') as f:
+			results = pickle.load(f)
+		entry['last_access'] = time.time()
+		self._save_index()
+		return results
+
+	def put(self, key, results):
+		"""
+		Stores results under key and evicts the least recently
+		used results beyond max_bytes.
+		"""
+		path = self._path(key)
+		with gzip.open(path, 'wb', compresslevel=6) as f:
+			pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+		self.index['entries'][key] = {'size': os.path.getsize(path), 'last_access': time.time()}
+		self._evict()
+		self._save_index()
+
+	def _evict(self):
+		entries = self.index['entries']
+		total = sum(e['size'] for e in entries.values())
+		for key in sorted(entries, key=lambda k: entries[k]['last_access']):
+			if total <= self.max_bytes:
+				break
+			total -= entries[key]['size']
+			del entries[key]
+			if os.path.exists(self._path(key)):
+				os.remove(self._path(key))
+
+	def size(self):
+		"""
+		Returns the total size in bytes of the stored results.
+		"""
+		return sum(e['size'] for e in self.index['entries'].values())
@@ -4,6 +4,10 @@ import numpy as np
 import pandas as pd 
 
 
+# Number of bars per year for each supported bar period
+PERIODS = { 'day' : 252, 'hour': 252*6.5, 'minute': 252*60*6.5}
+
+
 def calc_sharpe_ratio(returns, period='day', benchmark=None):
 	"""
 	Create the Sharpe ratio for the strategy.
@@ -13,7 +17,7 @@ def calc_sharpe_ratio(returns, period='day', benchmark=None):
 		returns - Pandas series representing period percentage returns
 		periods - Daily(252), Hourly(252*6.5), Minutely(252*6.5*60)
 	"""
-	per = { 'day' : 252, 'hour': 252*6.5, 'minute': 252*60*6.5}
+	per = PERIODS
 	
 	if benchmark: # To Do: implement
 		print("Calculating Sharpe Ratio using benchmark")
@@ -41,11 +45,11 @@ def calc_drawdowns(pnl):
 	hwm = [0] # High Water Mark
 	# Create drawdown & duration series
 	idx = pnl.index
-	drawdown = pd.Series(index = idx)
-	duration = pd.Series(index = idx)
+	drawdown = pd.Series(0.0, index = idx)
+	duration = pd.Series(0.0, index = idx)
 	# Loop over the index range
 	for t in range(1, len(idx)):
-		hwm.append(max(hwm[t-1], pnl[t]))
-		drawdown[t] = (hwm[t]-pnl[t])
-		duration[t] = (0 if drawdown[t] == 0 else duration[t-1]+1)
+		hwm.append(max(hwm[t-1], pnl.iloc[t]))
+		drawdown.iloc[t] = (hwm[t]-pnl.iloc[t])
+		duration.iloc[t] = (0 if drawdown.iloc[t] == 0 else duration.iloc[t-1]+1)
 	return drawdown, drawdown.max(), duration.max()
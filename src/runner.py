@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Command line entry point for backtests:
+
+	cd src && python -m runner config.json
+
+The JSON config names the components as "module.Class" strings, which
+are imported on demand, so a run only loads the modules it uses (pandas
+is not imported until the results are built). Example:
+
+	{
+		"csv_dir": "/data/csv",
+		"symbol_list": ["AAPL", "MSFT"],
+		"start_date": "2017-01-03",
+		"initial_capital": 100000.0,
+		"heartbeat": 0.0,
+		"strategy": "my_strategies.MovingAverageCross",
+		"strategy_params": {"short_window": 10},
+		"data_cache": "/data/bars.store",
+		"risk_gate": {"max_order_qty": 1000}
+	}
+
+Optional keys: data_handler, portfolio, execution_handler, event_bus
+(defaults below) and <component>_params for each, journal (path),
+paths (extra import directories, relative to the config file) and
+result_cache ({"cache_dir": ..., "max_bytes": ...}) to reuse the
+results of identical earlier runs and memory_monitor (MemoryMonitor
+parameters e.g. {"interval_bars": 500}) for a memory footprint report.
+With data_cache the bars are read from a SharedBarStore file, parsed
+from the CSV files only when it is missing or stale.
+"""
+
+import time
+_START = time.perf_counter()
+
+import argparse
+import datetime
+import functools
+import importlib
+import json
+import os, os.path
+import sys
+
+
+DEFAULTS = {
+	'data_handler': 'datahandler.HistoricCSVDataHandler',
+	'portfolio': 'portfolio.Portfolio',
+	'execution_handler': 'executionhandler.SimulatedExecutionHandler',
+	'event_bus': 'eventbus.DequeEventBus',
+	'initial_capital': 100000.0,
+	'heartbeat': 0.0,
+}
+
+
+def load_class(path):
+	"""
+	Imports 'module.Class' and returns the class.
+	"""
+	module_name, class_name = path.rsplit('.', 1)
+	return getattr(importlib.import_module(module_name), class_name)
+
+
+def component(config, key):
+	"""
+	Returns the class named by config[key] (or its default) with
+	config[key + '_params'] bound as keyword arguments.
+	"""
+	cls = load_class(config.get(key, DEFAULTS.get(key)))
+	params = config.get(key + '_params')
+	return functools.partial(cls, **params) if params else cls
+
+
+def shared_data_handler(config):
+	"""
+	Data handler factory reading the bars from the SharedBarStore
+	cache file, (re)built from the CSV files if needed.
+	"""
+	from sharedbars import SharedBarStore
+
+	store = SharedBarStore.load_or_publish(config['data_cache'], config['csv_dir'],
+										   config['symbol_list'])
+	# The params are bound as keywords so the result cache key sees them,
+	# the store is derived from the CSV files the key already hashes
+	return functools.partial(_shared_handler, store, **config.get('data_handler_params', {}))
+
+
+def _shared_handler(store, events_queue, csv_dir, symbol_list, **params):
+	"""
+	Creates a SharedMemoryDataHandler on store with the
+	Backtest's data handler arguments.
+	"""
+	from sharedbars import SharedMemoryDataHandler
+	return SharedMemoryDataHandler(events_queue, store, symbol_list, **params)
+
+
+def build_backtest(config, timings):
+	"""
+	Imports the configured components and creates the Backtest,
+	recording the time spent in each phase in timings.
+	"""
+	t = time.perf_counter()
+	from backtest import Backtest
+	strategy = component(config, 'strategy')
+	portfolio = component(config, 'portfolio')
+	execution_handler = component(config, 'execution_handler')
+	event_bus = component(config, 'event_bus')
+	risk_gate = None
+	if config.get('risk_gate') is not None:
+		from pretrade import PreTradeRiskGate
+		risk_gate = PreTradeRiskGate(**config['risk_gate'])
+	result_cache = None
+	if config.get('result_cache') is not None:
+		from resultcache import ResultCache
+		result_cache = ResultCache(**config['result_cache'])
+	memory_monitor = None
+	if config.get('memory_monitor') is not None:
+		from memprofile import MemoryMonitor
+		memory_monitor = MemoryMonitor(**config['memory_monitor'])
+	timings['imports'] = time.perf_counter() - t
+
+	t = time.perf_counter()
+	if config.get('data_cache'):
+		data_handler = shared_data_handler(config)
+	else:
+		data_handler = component(config, 'data_handler')
+	timings['data cache'] = time.perf_counter() - t
+
+	t = time.perf_counter()
+	start_date = datetime.datetime.fromisoformat(config['start_date'])
+	backtest = Backtest(config['csv_dir'], config['symbol_list'],
+						config.get('initial_capital', DEFAULTS['initial_capital']),
+						config.get('heartbeat', DEFAULTS['heartbeat']), start_date,
+						data_handler, execution_handler, portfolio, strategy,
+						event_bus=event_bus, journal=config.get('journal'), risk_gate=risk_gate,
+						result_cache=result_cache, memory_monitor=memory_monitor)
+	timings['setup'] = time.perf_counter() - t
+	return backtest
+
+
+def report_startup(timings):
+	"""
+	Prints the time from interpreter start to a ready backtest.
+	"""
+	total = time.perf_counter() - _START
+	phases = ", ".join("{} {:.0f}ms".format(k, v * 1e3) for k, v in timings.items())
+	print("Startup: {:.0f}ms ({}; pandas {})".format(
+		total * 1e3, phases, "loaded" if 'pandas' in sys.modules else "not loaded"))
+	return total
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Run a backtest described by a JSON config file.")
+	parser.add_argument('config', help="Path to the JSON config file.")
+	parser.add_argument('--startup-only', action='store_true',
+						help="Build the backtest, report the startup time and exit.")
+	args = parser.parse_args(argv)
+
+	with open(args.config) as f:
+		config = json.load(f)
+	config_dir = os.path.dirname(os.path.abspath(args.config))
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	for path in config.get('paths', []):
+		sys.path.insert(0, os.path.join(config_dir, path))
+
+	timings = {}
+	backtest = build_backtest(config, timings)
+	report_startup(timings)
+	if args.startup_only:
+		return backtest
+
+	t = time.perf_counter()
+	backtest.simulate_trading()
+	print("Run: {:.2f}s".format(time.perf_counter() - t))
+	return backtest
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,352 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from eventhandler import MarketEvent
+from datahandler import DataHandler
+
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import datetime
+import json
+import mmap
+import os, os.path
+import struct
+import numpy as np
+
+
+"""
+Bar store published once into shared memory (or an mmap'd file)
+so that the DataHandlers of many worker processes read the same
+physical copy of the data.
+
+Layout of the block:
+	header - magic, version, number of symbols, fields and bars,
+		length of the JSON metadata (symbols and field names)
+	metadata - JSON, padded to 8 bytes
+	timestamps - int64 ns, one per bar
+	values - float64 array of shape (fields, symbols, bars), so a
+		symbol's history of one field is contiguous
+"""
+
+MAGIC = b'BARSTORE'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIqI')
+FIELDS = ['open', 'high', 'low', 'close', 'volume', 'adj_close']
+
+Bar = namedtuple('Bar', FIELDS)
+
+
+def _to_datetime(ns):
+	"""
+	int64 ns timestamp to a datetime, without importing pandas.
+	"""
+	return np.datetime64(int(ns), 'ns').astype('datetime64[us]').item()
+
+
+def _align(n):
+	return (n + 7) // 8 * 8
+
+
+def _layout(num_symbols, num_fields, num_bars, meta_len):
+	"""
+	Returns the byte offsets of the timestamps and values arrays
+	and the total size of a block.
+	"""
+	ts_offset = _align(HEADER.size + meta_len)
+	values_offset = ts_offset + 8 * num_bars
+	total = values_offset + 8 * num_fields * num_symbols * num_bars
+	return ts_offset, values_offset, total
+
+
+class SharedBarStore(object):
+	"""
+	Read-only view of a published bar store. Created in the parent
+	process by publish() and in the workers by attach(); in both
+	cases timestamps and values are NumPy arrays over the shared
+	buffer, nothing is copied.
+	"""
+
+	def __init__(self, buf, handle, owner, path=None):
+		"""
+		Parameters:
+			buf - Buffer (memoryview or mmap) holding the block.
+			handle - The SharedMemory or mmap object kept alive.
+			owner - True in the process that published the store.
+			path - File path of an mmap'd store.
+		"""
+		magic, version, num_symbols, num_fields, num_bars, meta_len = HEADER.unpack_from(buf, 0)
+		if magic != MAGIC or version != VERSION:
+			raise ValueError("Not a version {} bar store".format(VERSION))
+		meta = json.loads(bytes(buf[HEADER.size:HEADER.size + meta_len]).decode('utf-8'))
+		ts_offset, values_offset, _ = _layout(num_symbols, num_fields, num_bars, meta_len)
+
+		self._buf = buf
+		self._handle = handle
+		self._path = path
+		self.owner = owner
+		self.symbol_list = meta['symbols']
+		self.fields = meta['fields']
+		self.timestamps = np.ndarray((num_bars,), dtype=np.int64, buffer=buf, offset=ts_offset)
+		self.values = np.ndarray((num_fields, num_symbols, num_bars), dtype=np.float64,
+								 buffer=buf, offset=values_offset)
+		self.timestamps.flags.writeable = False
+		self.values.flags.writeable = False
+
+	@property
+	def name(self):
+		"""
+		The shared memory name (or file path) workers attach to.
+		"""
+		if self._path is not None:
+			return self._path
+		return self._handle.name
+
+	@staticmethod
+	def _frames_from_csv(csv_dir, symbol_list):
+		"""
+		Loads 'symbol'.csv files and pads them forward onto the
+		union of their datetime indices.
+		"""
+		import pandas as pd
+		frames = {}
+		comb_idx = None
+		for s in symbol_list:
+			frames[s] = pd.read_csv(os.path.join(csv_dir, "{}.csv".format(s)),
+									header=None, index_col=0, parse_dates=True,
+									names=['datetime'] + FIELDS)
+			if comb_idx is None:
+				comb_idx = frames[s].index
+			else:
+				comb_idx = comb_idx.union(frames[s].index)
+		return comb_idx, dict((s, f.reindex(index=comb_idx, method='pad')) for s, f in frames.items())
+
+	@classmethod
+	def publish(cls, csv_dir, symbol_list, name=None, path=None):
+		"""
+		Parses the CSV files once and writes them into a new shared
+		memory block (or into the file at path, which is then mapped).
+
+		Parameters:
+			csv_dir - Absolute directory path to the CSV files.
+			symbol_list - A list of symbol strings.
+			name - Optional shared memory name, generated if None.
+			path - If given, the store is written to this file instead.
+		"""
+		index, frames = cls._frames_from_csv(csv_dir, symbol_list)
+		meta = json.dumps({'symbols': list(symbol_list), 'fields': FIELDS}).encode('utf-8')
+		num_bars = len(index)
+		ts_offset, values_offset, total = _layout(len(symbol_list), len(FIELDS), num_bars, len(meta))
+
+		if path is None:
+			shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+			buf, handle = shm.buf, shm
+		else:
+			with open(path, 'wb') as f:
+				f.truncate(total)
+			with open(path, 'r+b') as f:
+				handle = mmap.mmap(f.fileno(), total)
+			buf = handle
+
+		HEADER.pack_into(buf, 0, MAGIC, VERSION, len(symbol_list), len(FIELDS), num_bars, len(meta))
+		buf[HEADER.size:HEADER.size + len(meta)] = meta
+		timestamps = np.ndarray((num_bars,), dtype=np.int64, buffer=buf, offset=ts_offset)
+		timestamps[:] = np.asarray(index, dtype='datetime64[ns]').view(np.int64)
+		values = np.ndarray((len(FIELDS), len(symbol_list), num_bars), dtype=np.float64,
+							buffer=buf, offset=values_offset)
+		for i, s in enumerate(symbol_list):
+			values[:, i, :] = frames[s][FIELDS].to_numpy(dtype=np.float64).T
+		del timestamps, values, frames
+
+		if path is not None:
+			handle.flush()
+		return cls(buf, handle, owner=True, path=path)
+
+	@classmethod
+	def load_or_publish(cls, path, csv_dir, symbol_list):
+		"""
+		Parsed-data cache: attaches to the store file at path if it
+		holds symbol_list and is newer than all of the CSV files,
+		otherwise (re)publishes it there from the CSV files.
+		"""
+		csv_paths = [os.path.join(csv_dir, "{}.csv".format(s)) for s in symbol_list]
+		if os.path.exists(path) and \
+			os.path.getmtime(path) >= max(os.path.getmtime(p) for p in csv_paths):
+			store = cls.attach(path)
+			if store.symbol_list == list(symbol_list):
+				return store
+			store.close()
+		return cls.publish(csv_dir, symbol_list, path=path)
+
+	@classmethod
+	def attach(cls, name):
+		"""
+		Attaches to a store published under a shared memory name or
+		to a file path written by publish(path=...).
+		"""
+		if os.path.exists(name):
+			with open(name, 'rb') as f:
+				handle = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			return cls(handle, handle, owner=False, path=name)
+
+		try:
+			# Only the publisher may unlink the block (Python 3.13+)
+			shm = shared_memory.SharedMemory(name=name, track=False)
+		except TypeError:
+			# Earlier versions register the block with the resource
+			# tracker shared with the publisher, which unlinks it once
+			shm = shared_memory.SharedMemory(name=name)
+		return cls(shm.buf, shm, owner=False)
+
+	def close(self, unlink=None):
+		"""
+		Releases this process's mapping. By default the publisher
+		also unlinks the shared memory block.
+		"""
+		self.timestamps = self.values = None
+		self._buf = None
+		if isinstance(self._handle, shared_memory.SharedMemory):
+			self._handle.close()
+			if unlink if unlink is not None else self.owner:
+				self._handle.unlink()
+		else:
+			self._handle.close()
+
+
+class SharedMemoryDataHandler(DataHandler):
+	"""
+	DataHandler reading bars straight out of a SharedBarStore, so
+	any number of worker processes can backtest over one copy of
+	the data. History queries are views into the shared arrays and
+	the snapshot of a field is a single strided read.
+	"""
+
+	def __init__(self, events_queue, store, symbol_list=None, timeframes=None):
+		"""
+		Parameters:
+			events_queue - The Event Queue
+			store - A SharedBarStore, or the name/path to attach to.
+			symbol_list - Optional subset of the store's symbols.
+			timeframes - Optional list of timeframes to aggregate into.
+		"""
+		if not isinstance(store, SharedBarStore):
+			store = SharedBarStore.attach(store)
+		self.events_queue = events_queue
+		self.store = store
+		self.symbol_list = list(symbol_list or store.symbol_list)
+		self.timeframes = timeframes or []
+		if self.timeframes:
+			from timeframes import make_aggregator
+
+		store_index = dict((s, i) for i, s in enumerate(store.symbol_list))
+		self.symbol_index = dict((s, i) for i, s in enumerate(self.symbol_list))
+		self.store_index = dict((s, store_index[s]) for s in self.symbol_list)
+		self._rows = np.array([store_index[s] for s in self.symbol_list], dtype=np.intp)
+		self._all_rows = self.symbol_list == store.symbol_list
+		self.field_index = dict((f, k) for k, f in enumerate(store.fields))
+		self.timeframe_data = dict(
+			(s, dict((tf, make_aggregator(tf)) for tf in self.timeframes))
+			for s in self.symbol_list
+		)
+
+		# Number of bars released so far
+		self.bar_count = 0
+		self.updated_symbols = []
+		self.latest_datetime = None
+		self.continue_backtest = True
+
+	def _bar(self, row, t):
+		return (_to_datetime(self.store.timestamps[t]), Bar(*self.store.values[:, row, t].tolist()))
+
+	def _lookup(self, symbol, val_type=None):
+		try:
+			row = self.store_index[symbol]
+			field = None if val_type is None else self.field_index[val_type]
+		except KeyError:
+			print("That symbol or value is not available in the shared data set.")
+			raise
+		return row, field
+
+	def get_latest_bar(self, symbol, timeframe=None):
+		"""
+		Returns the last bar released.
+		"""
+		if timeframe is not None:
+			return self.timeframe_data[symbol][timeframe].bars[-1]
+		row, _ = self._lookup(symbol)
+		if self.bar_count == 0:
+			raise IndexError("No bars released yet")
+		return self._bar(row, self.bar_count - 1)
+
+	def get_latest_bars(self, symbol, N=1, timeframe=None):
+		"""
+		Returns the last N bars released.
+		"""
+		if timeframe is not None:
+			return self.timeframe_data[symbol][timeframe].bars[-N:]
+		row, _ = self._lookup(symbol)
+		return [self._bar(row, t) for t in range(max(self.bar_count - N, 0), self.bar_count)]
+
+	def get_latest_bar_datetime(self, symbol, timeframe=None):
+		"""
+		Returns a python datetime object for the last bar.
+		"""
+		return self.get_latest_bar(symbol, timeframe)[0]
+
+	def get_latest_bar_value(self, symbol, val_type, timeframe=None):
+		"""
+		Returns one of the Open, High, Low, Close, Volume or Adj
+		Close values of the last bar.
+		"""
+		if timeframe is not None:
+			return getattr(self.get_latest_bar(symbol, timeframe)[1], val_type)
+		row, field = self._lookup(symbol, val_type)
+		if self.bar_count == 0:
+			raise IndexError("No bars released yet")
+		return self.store.values[field, row, self.bar_count - 1]
+
+	def get_latest_bars_values(self, symbol, val_type, N=1, timeframe=None):
+		"""
+		Returns the last N bar values as a read-only view into
+		the shared store.
+		"""
+		if timeframe is not None:
+			bars_list = self.get_latest_bars(symbol, N, timeframe)
+			return np.array([getattr(b[1], val_type) for b in bars_list])
+		row, field = self._lookup(symbol, val_type)
+		return self.store.values[field, row, max(self.bar_count - N, 0):self.bar_count]
+
+	def get_latest_snapshot(self, val_type):
+		"""
+		Returns the latest val_type value of every symbol aligned
+		with symbol_list (NaN before the first bar).
+		"""
+		try:
+			field = self.field_index[val_type]
+		except KeyError:
+			print("That value is not available in the shared data set.")
+			raise
+		if self.bar_count == 0:
+			return np.full(len(self.symbol_list), np.nan)
+		if self._all_rows:
+			return self.store.values[field, :, self.bar_count - 1]
+		return self.store.values[field, self._rows, self.bar_count - 1]
+
+	def update_bars(self):
+		"""
+		Releases the next bar of every symbol.
+		"""
+		if self.bar_count >= len(self.store.timestamps):
+			print("Not more bars to fetch.")
+			self.continue_backtest = False
+			return
+		t = self.bar_count
+		self.bar_count += 1
+		self.latest_datetime = _to_datetime(self.store.timestamps[t])
+		self.updated_symbols = self.symbol_list
+		if self.timeframes:
+			for s in self.symbol_list:
+				bar = self._bar(self.store_index[s], t)
+				for aggregator in self.timeframe_data[s].values():
+					aggregator.update(bar[0], bar[1])
+		self.events_queue.put(MarketEvent())
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import warnings
+import numpy as np
+
+
+class PositionSizer(object):
+	"""
+	Computes target position sizes for a whole set of symbols at
+	once from the portfolio equity, latest prices, rolling
+	volatility and signal strength. Everything is done on NumPy
+	arrays aligned by symbol, so sizing thousands of names per
+	bar is a handful of vector operations.
+
+	Methods:
+		'volatility' - each position is sized to an annualised
+			volatility of target_vol, scaled by the signal strength.
+		'kelly' - fractional Kelly, kelly_fraction * edge / variance,
+			where the signal gives direction and conviction and the
+			magnitude of the historical mean return gives the edge.
+
+	Weights are then capped per symbol (max_weight) and scaled down
+	so the gross exposure stays within max_gross.
+	"""
+
+	def __init__(self, method='volatility', target_vol=0.10, kelly_fraction=0.5,
+				 max_weight=0.10, max_gross=1.0, periods_per_year=252,
+				 vol_lookback=20, lot_size=1):
+		"""
+		Parameters:
+			method - 'volatility' or 'kelly'
+			target_vol - Annualised volatility targeted per position.
+			kelly_fraction - Fraction of the full Kelly weight to take.
+			max_weight - Maximum absolute weight (notional / equity) per symbol.
+			max_gross - Maximum gross exposure (sum of absolute weights).
+			periods_per_year - Bars per year, used to annualise volatility.
+			vol_lookback - Number of returns used for rolling volatility.
+			lot_size - Quantities are rounded toward zero to this lot size.
+		"""
+		if method not in ('volatility', 'kelly'):
+			raise ValueError("Unknown sizing method: {}".format(method))
+		self.method = method
+		self.target_vol = target_vol
+		self.kelly_fraction = kelly_fraction
+		self.max_weight = max_weight
+		self.max_gross = max_gross
+		self.periods_per_year = periods_per_year
+		self.vol_lookback = vol_lookback
+		self.lot_size = lot_size
+
+	def return_stats(self, price_history):
+		"""
+		Returns the per-bar mean and standard deviation of log
+		returns for each row of a (symbols x lookback) price matrix.
+		Rows may be left-padded with NaN when history is short.
+		"""
+		with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+			# All-NaN rows (no history yet) give NaN rather than a warning
+			warnings.simplefilter('ignore', RuntimeWarning)
+			rets = np.diff(np.log(price_history), axis=1)
+			mean = np.nanmean(rets, axis=1)
+			std = np.nanstd(rets, axis=1, ddof=1)
+		return mean, std
+
+	def weights(self, strength, volatility, mean_returns=None):
+		"""
+		Returns the signed target weight of each symbol.
+
+		Parameters:
+			strength - Signed signal strength (+ long, - short, 0 flat).
+			volatility - Per-bar volatility of returns.
+			mean_returns - Per-bar mean returns, required for 'kelly'.
+		"""
+		strength = np.asarray(strength, dtype=np.float64)
+		vol = np.asarray(volatility, dtype=np.float64)
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			if self.method == 'volatility':
+				ann_vol = vol * np.sqrt(self.periods_per_year)
+				w = strength * self.target_vol / ann_vol
+			else:
+				if mean_returns is None:
+					raise ValueError("Kelly sizing requires mean_returns")
+				w = self.kelly_fraction * strength * np.abs(mean_returns) / vol ** 2
+
+		w = np.where(np.isfinite(w), w, 0.0)
+		return np.clip(w, -self.max_weight, self.max_weight)
+
+	def apply_gross_cap(self, w, fixed_gross=0.0):
+		"""
+		Scales the weights down proportionally so that together with
+		fixed_gross (exposure held in symbols not being resized) the
+		gross exposure does not exceed max_gross.
+		"""
+		budget = max(self.max_gross - fixed_gross, 0.0)
+		gross = np.abs(w).sum()
+		if gross > budget:
+			w = w * (budget / gross)
+		return w
+
+	def target_quantities(self, equity, prices, volatility, strength,
+						  mean_returns=None, fixed_gross=0.0):
+		"""
+		Returns signed integer target quantities for each symbol.
+
+		Parameters:
+			equity - Current portfolio equity.
+			prices - Latest price of each symbol.
+			volatility - Per-bar volatility of each symbol's returns.
+			strength - Signed signal strength of each symbol.
+			mean_returns - Per-bar mean returns (for 'kelly').
+			fixed_gross - Gross weight already held in other symbols.
+		"""
+		w = self.weights(strength, volatility, mean_returns)
+		w = self.apply_gross_cap(w, fixed_gross)
+		prices = np.asarray(prices, dtype=np.float64)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			lots = np.trunc(w * equity / (prices * self.lot_size))
+		lots = np.where(np.isfinite(lots), lots, 0.0)
+		return (lots * self.lot_size).astype(np.int64)
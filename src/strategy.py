@@ -5,7 +5,6 @@ from eventhandler import SignalEvent
 
 import datetime
 import numpy as np 
-import pandas as pandas
 import queue
 
 
@@ -32,3 +31,149 @@ class Strategy(object):
 		raise NotImplementedError("Should implement calculate_signals()")
 
 	
+
+
+class VectorizedStrategy(Strategy):
+	"""
+	Base class for strategies computed on all symbols at once.
+
+	On every bar compute_signals() receives, for each requested
+	field, a (symbols x lookback) NumPy array aligned with
+	symbol_list (oldest bar first, NaN before a symbol has history)
+	and returns the desired state of every symbol as a vector:
+	1 long, -1 short, 0 flat (NaN keeps the previous state),
+	optionally with a strength vector as (signals, strength).
+
+	Only changes of state are turned into SignalEvents ('LONG',
+	'SHORT', or 'EXIT' when going flat), found with one vector
+	comparison, so a bar without changes costs no per-symbol work.
+	A flip from long to short (or back) is signalled as an 'EXIT'
+	and the state kept flat, the new direction follows on the next
+	bar once the exit has filled, as portfolios only open positions
+	from flat.
+
+	The windows are kept up to date from the data handler's
+	snapshot arrays, in a buffer twice the lookback long so that
+	each window is a view and a bar costs one column write.
+	"""
+
+	SIGNAL_TYPES = {1: 'LONG', -1: 'SHORT', 0: 'EXIT'}
+
+	def __init__(self, bars, events_queue, fields=('adj_close',), lookback=20,
+				 min_history=None, strategy_id=1):
+		"""
+		Parameters:
+			bars - The DataHandler object that provides bar information.
+			events_queue - The Event Queue object.
+			fields - Bar values passed to compute_signals.
+			lookback - Number of bars in each window.
+			min_history - Bars required before compute_signals is
+				called, lookback by default.
+			strategy_id - Identifier put on the SignalEvents.
+		"""
+		self.bars = bars
+		self.events_queue = events_queue
+		self.symbol_list = self.bars.symbol_list
+		self.fields = tuple(fields)
+		self.lookback = lookback
+		self.min_history = lookback if min_history is None else min_history
+		self.strategy_id = strategy_id
+
+		n = len(self.symbol_list)
+		self._buffers = dict((f, np.full((n, 2 * lookback), np.nan)) for f in self.fields)
+		self._pos = 0
+		self.bars_seen = 0
+		self.state = np.zeros(n)
+
+	def _update_windows(self):
+		"""
+		Writes the latest snapshot of each field into its buffer
+		and returns the (symbols x lookback) window views.
+		"""
+		pos, L = self._pos, self.lookback
+		windows = {}
+		for f, buf in self._buffers.items():
+			latest = self.bars.get_latest_snapshot(f)
+			buf[:, pos] = latest
+			buf[:, pos + L] = latest
+			windows[f] = buf[:, pos + 1:pos + 1 + L]
+		self._pos = (pos + 1) % L
+		self.bars_seen += 1
+		return windows
+
+	@abstractmethod
+	def compute_signals(self, windows):
+		"""
+		Returns the desired state vector (or (state, strength))
+		from {field: (symbols x lookback) array}.
+		"""
+		raise NotImplementedError("Should implement compute_signals()")
+
+	def calculate_signals(self, event):
+		"""
+		Updates the windows and puts a SignalEvent for every symbol
+		whose desired state changed.
+		"""
+		if event.type != 'MARKET':
+			return
+		windows = self._update_windows()
+		if self.bars_seen < self.min_history:
+			return
+
+		result = self.compute_signals(windows)
+		if isinstance(result, tuple):
+			signals, strength = result
+		else:
+			signals, strength = result, None
+		signals = np.asarray(signals, dtype=np.float64)
+		signals = np.where(np.isnan(signals), self.state, np.sign(signals))
+		# Flips go flat first, state is what was actually signalled
+		signals[signals == -self.state] = 0.0
+
+		changed = np.flatnonzero(signals != self.state)
+		if len(changed) == 0:
+			return
+		self.state = signals
+		dt = getattr(self.bars, 'latest_datetime', None)
+		strengths = [1.0] * len(changed) if strength is None else np.asarray(strength)[changed].tolist()
+		for i, s, st in zip(changed.tolist(), signals[changed].tolist(), strengths):
+			self.events_queue.put(SignalEvent(self.strategy_id, self.symbol_list[i], dt,
+											  self.SIGNAL_TYPES[int(s)], st))
+
+
+class MomentumRankStrategy(VectorizedStrategy):
+	"""
+	Cross-sectional momentum: ranks symbols by their return over
+	the lookback window, goes long the top quantile and short the
+	bottom quantile (if shorts are allowed).
+	"""
+
+	def __init__(self, bars, events_queue, lookback=20, quantile=0.1, allow_short=True):
+		"""
+		Parameters:
+			bars - The DataHandler object that provides bar information.
+			events_queue - The Event Queue object.
+			lookback - Bars over which momentum is measured.
+			quantile - Fraction of the ranked symbols held on each side.
+			allow_short - Short the bottom quantile as well.
+		"""
+		super(MomentumRankStrategy, self).__init__(bars, events_queue, ('adj_close',), lookback)
+		self.quantile = quantile
+		self.allow_short = allow_short
+
+	def compute_signals(self, windows):
+		prices = windows['adj_close']
+		with np.errstate(divide='ignore', invalid='ignore'):
+			momentum = prices[:, -1] / prices[:, 0] - 1.0
+		valid = np.isfinite(momentum)
+		k = int(valid.sum() * self.quantile)
+		signals = np.zeros(len(momentum))
+		if k == 0:
+			return signals
+		# NaN momentum is sorted last, so it is never in either tail
+		order = np.argsort(np.where(valid, -momentum, np.inf))
+		signals[order[:k]] = 1.0
+		if self.allow_short:
+			n_valid = valid.sum()
+			signals[order[n_valid - k:n_valid]] = -1.0
+		return signals
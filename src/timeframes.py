@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+
+
+class AggregatedBar(object):
+	"""
+	A higher timeframe OHLCV bar built up from base bars. Exposes
+	the same attribute names as the pandas bar Series so that
+	getattr(bar, val_type) works identically for both.
+	"""
+
+	__slots__ = ('open', 'high', 'low', 'close', 'volume', 'adj_close')
+
+	def __init__(self, bar):
+		"""
+		Starts a new bar from the first base bar of the period.
+
+		Parameters:
+			bar - Base bar exposing open/high/low/close/volume/adj_close.
+		"""
+		self.open = bar.open
+		self.high = bar.high
+		self.low = bar.low
+		self.close = bar.close
+		self.volume = bar.volume
+		self.adj_close = bar.adj_close
+
+	def merge(self, bar):
+		"""
+		Folds one more base bar into the period:
+		open (first), high (max), low (min), close (last),
+		volume (sum).
+		"""
+		if bar.high > self.high:
+			self.high = bar.high
+		if bar.low < self.low:
+			self.low = bar.low
+		self.close = bar.close
+		self.adj_close = bar.adj_close
+		self.volume += bar.volume
+
+	def __repr__(self):
+		return "AggregatedBar(open={}, high={}, low={}, close={}, volume={}, adj_close={})".format(
+			self.open, self.high, self.low, self.close, self.volume, self.adj_close)
+
+
+class BarAggregator(object):
+	"""
+	Incrementally resamples a stream of base bars (e.g. minute bars)
+	into bars of a fixed, longer timeframe (e.g. '1h' or '1D').
+
+	Bars are stored in the same (datetime, bar) tuple format as
+	DataHandler.latest_symbol_data. The last entry is the bar of
+	the period currently being formed and is updated in place until
+	a base bar from the next period arrives. Each base bar costs O(1).
+	"""
+
+	def __init__(self, timeframe, max_bars=None):
+		"""
+		Parameters:
+			timeframe - A fixed pandas offset string e.g. '5min', '1h', '1D'.
+			max_bars - Optional number of most recent bars to keep. Older
+				bars are dropped in batches so trimming is amortised O(1).
+		"""
+		self.timeframe = timeframe
+		self.period_ns = pd.Timedelta(timeframe).value
+		self.max_bars = max_bars
+		self.bars = []
+		self._bucket = None
+
+	def update(self, bar_datetime, bar):
+		"""
+		Adds one base bar to the aggregated series.
+
+		Parameters:
+			bar_datetime - Timestamp of the base bar.
+			bar - Base bar exposing open/high/low/close/volume/adj_close.
+		"""
+		bucket = pd.Timestamp(bar_datetime).value // self.period_ns
+		if bucket != self._bucket:
+			self._bucket = bucket
+			self.bars.append((pd.Timestamp(bucket * self.period_ns), AggregatedBar(bar)))
+			if self.max_bars and len(self.bars) > 2 * self.max_bars:
+				del self.bars[:-self.max_bars]
+		else:
+			self.bars[-1][1].merge(bar)
+
+
+class Tick(object):
+	"""
+	A single trade, exposing the bar attribute names as well
+	(open/high/low/close/adj_close are the price, volume is the
+	size) so a tick can be used wherever a bar is expected.
+	"""
+
+	__slots__ = ('price', 'size')
+
+	def __init__(self, price, size):
+		self.price = price
+		self.size = size
+
+	@property
+	def open(self):
+		return self.price
+
+	@property
+	def high(self):
+		return self.price
+
+	@property
+	def low(self):
+		return self.price
+
+	@property
+	def close(self):
+		return self.price
+
+	@property
+	def adj_close(self):
+		return self.price
+
+	@property
+	def volume(self):
+		return self.size
+
+	def __repr__(self):
+		return "Tick(price={}, size={})".format(self.price, self.size)
+
+
+class ThresholdBarAggregator(object):
+	"""
+	Incrementally builds volume or dollar bars: a bar is closed
+	once the volume (or price * volume) folded into it reaches the
+	threshold, and the next base bar or tick starts a new one.
+
+	Bars are (datetime, bar) tuples stamped with the time of their
+	first tick, the last entry being the bar currently being
+	formed, as for BarAggregator. Each update costs O(1).
+	"""
+
+	def __init__(self, kind, threshold, max_bars=None):
+		"""
+		Parameters:
+			kind - 'volume' or 'dollar'
+			threshold - Volume (or traded value) per bar.
+			max_bars - Optional number of most recent bars to keep.
+		"""
+		if kind not in ('volume', 'dollar'):
+			raise ValueError("Unknown bar type: {}".format(kind))
+		self.kind = kind
+		self.threshold = threshold
+		self.max_bars = max_bars
+		self.bars = []
+		self._filled = 0.0
+
+	def update(self, bar_datetime, bar):
+		"""
+		Adds one tick or base bar to the aggregated series.
+
+		Parameters:
+			bar_datetime - Timestamp of the tick or base bar.
+			bar - Tick or bar exposing open/high/low/close/volume/adj_close.
+		"""
+		if self.kind == 'volume':
+			amount = bar.volume
+		else:
+			amount = bar.close * bar.volume
+
+		if not self.bars or self._filled >= self.threshold:
+			self._filled = amount
+			self.bars.append((pd.Timestamp(bar_datetime), AggregatedBar(bar)))
+			if self.max_bars and len(self.bars) > 2 * self.max_bars:
+				del self.bars[:-self.max_bars]
+		else:
+			self._filled += amount
+			self.bars[-1][1].merge(bar)
+
+
+def make_aggregator(timeframe, max_bars=None):
+	"""
+	Returns the aggregator for a timeframe given either as a
+	fixed pandas offset string e.g. '1h' (time bars) or as a
+	('volume', threshold) or ('dollar', threshold) tuple.
+	"""
+	if isinstance(timeframe, tuple):
+		return ThresholdBarAggregator(timeframe[0], timeframe[1], max_bars)
+	return BarAggregator(timeframe, max_bars)
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import queue
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+pytest.importorskip('ib.ext.Contract')
+
+from eventhandler import OrderEvent
+from ib_connection import IBConnectionManager, MockGateway
+from ib_execution import IBExecutionHandler
+
+
+def wait_for(condition, timeout=5.0):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		if time.monotonic() > deadline:
+			raise AssertionError("timed out")
+		time.sleep(0.01)
+
+
+def drain(events):
+	fills = []
+	while not events.empty():
+		fills.append(events.get())
+	return fills
+
+
+def test_reconnect_recovers_missed_fills_once_and_sends_held_orders_once():
+	gateway = MockGateway(next_order_id=100)
+	gateway.set_price('AAPL', 10.0)
+	manager = IBConnectionManager(connection_factory=gateway.connect, reconnect_interval=0.05)
+	events = queue.Queue()
+	handler = IBExecutionHandler(events, connection_manager=manager)
+	session = manager.execution
+	try:
+		wait_for(lambda: handler._id_conn is not None)
+
+		# Reported normally
+		handler.execute_order(OrderEvent('AAPL', 'MKT', 10, 'BUY'))
+		wait_for(lambda: events.qsize() == 1)
+
+		# Fills at the gateway, the connection drops before its report
+		gateway.hold_reports = True
+		handler.execute_order(OrderEvent('AAPL', 'MKT', 20, 'SELL'))
+		gateway.accept_connections = False
+		gateway.drop_connections()
+		wait_for(lambda: not session.connected)
+
+		# Held back while disconnected
+		handler.execute_order(OrderEvent('AAPL', 'MKT', 30, 'BUY'))
+		assert len(handler.unsent_orders) == 1
+
+		gateway.hold_reports = False
+		gateway.accept_connections = True
+		wait_for(lambda: session.reconnects == 1 and events.qsize() == 3)
+		time.sleep(0.2)
+
+		fills = drain(events)
+		assert sorted((f.direction, f.quantity) for f in fills) == \
+			[('BUY', 10), ('BUY', 30), ('SELL', 20)]
+		assert sorted(gateway.orders) == [100, 101, 102]
+		assert handler.unsent_orders == []
+	finally:
+		manager.stop()
@@ -0,0 +1,69 @@
+import pandas as pd
+import numpy as np
+
+
+def _frame_keys(df, on):
+    if on is None:
+        keys = df.index
+    else:
+        keys = pd.MultiIndex.from_frame(df[on]) if len(on) > 1 else pd.Index(df[on[0]])
+    if not keys.is_unique:
+        raise ValueError("align_frames requires unique keys in every frame")
+    return keys
+
+def _output_names(frames, on, suffixes):
+    # Columns found in more than one frame get that frame's suffix
+    value_cols = [[c for c in df.columns if on is None or c not in on] for df in frames]
+    counts = pd.Series([c for cols in value_cols for c in cols]).value_counts()
+    names = []
+    for i, cols in enumerate(value_cols):
+        renamed = []
+        for c in cols:
+            if counts[c] > 1:
+                if suffixes is None:
+                    raise ValueError("Column '{}' is in several frames, pass suffixes".format(c))
+                c_out = "{}{}".format(c, suffixes[i])
+            else:
+                c_out = c
+            renamed.append(c_out)
+        names.append((cols, renamed))
+    flat = [c for _, renamed in names for c in renamed]
+    if len(set(flat)) != len(flat):
+        raise ValueError("Suffixes do not make the output columns unique")
+    return names
+
+def align_frames(frames, on=None, how='inner', suffixes=None):
+    # Joins N frames on shared keys in a single pass: the output key set is
+    # built once (intersection or sorted union), each frame is mapped onto it
+    # with one hash lookup, and every output column is filled by one take.
+    # on - key column names, or None to align on the index
+    # how - 'inner' (keys in every frame, first frame's order) or 'outer'
+    # suffixes - one per frame, appended only to columns found in several frames
+    if isinstance(on, str):
+        on = [on]
+    frame_keys = [_frame_keys(df, on) for df in frames]
+
+    keys = frame_keys[0]
+    if how == 'inner':
+        for other in frame_keys[1:]:
+            keys = keys[keys.isin(other)]
+    elif how == 'outer':
+        keys = keys.append(frame_keys[1:]).unique().sort_values()
+    else:
+        raise ValueError("how must be 'inner' or 'outer'")
+
+    columns = {}
+    if on is not None:
+        key_frame = keys.to_frame(index=False) if isinstance(keys, pd.MultiIndex) else pd.DataFrame({on[0]: keys})
+        for c in on:
+            columns[c] = key_frame[c].array
+
+    names = _output_names(frames, on, suffixes)
+    for df, fkeys, (cols, renamed) in zip(frames, frame_keys, names):
+        indexer = fkeys.get_indexer(keys)
+        fill = how == 'outer' and (indexer < 0).any()
+        for c, c_out in zip(cols, renamed):
+            columns[c_out] = df[c].array.take(indexer, allow_fill=fill)
+
+    index = keys if on is None else pd.RangeIndex(len(keys))
+    return pd.DataFrame(columns, index=index)
@@ -0,0 +1,43 @@
+import pandas as pd
+import numpy as np
+
+
+# Day of the month on which week 1 starts, by weekday of the 1st (Mon=0): the
+# first day d with d.day > d.weekday(), as in the original week_of_month loop.
+_WEEK1_START = np.array([min(k for k in range(1, 8) if k > (w + k - 1) % 7) for w in range(7)])
+
+# Features already computed, indexed by unique (normalised) date
+_cache = pd.DataFrame(columns=['WoM', 'DoW', 'period'], index=pd.DatetimeIndex([]))
+
+
+def _compute_features(days):
+    # days: unique datetime64[D] array
+    days = pd.DatetimeIndex(days)
+    first_wday = (days - pd.to_timedelta(days.day - 1, unit='D')).weekday
+    start = _WEEK1_START[np.asarray(first_wday)]
+    return pd.DataFrame({'WoM': (np.asarray(days.day) - start) // 7 + 1,
+                         'DoW': np.asarray(days.weekday),
+                         'period': days.to_period('M')}, index=days)
+
+def calendar_features(dates):
+    # Week of month, day of week (Mon=0) and monthly period of each date.
+    # Returns a DataFrame positionally aligned with `dates`. Each unique date
+    # is computed once and memoised across calls.
+    global _cache
+    days = pd.DatetimeIndex(dates).values.astype('datetime64[D]')
+    uniq, inverse = np.unique(days, return_inverse=True)
+
+    missing = uniq[~pd.DatetimeIndex(uniq).isin(_cache.index)]
+    if len(missing):
+        new = _compute_features(missing)
+        _cache = new if len(_cache) == 0 else pd.concat([_cache, new])
+
+    feats = _cache.loc[pd.DatetimeIndex(uniq)]
+    return feats.iloc[inverse.ravel()].reset_index(drop=True)
+
+def week_of_month_index(dates):
+    return calendar_features(dates)['WoM'].to_numpy(dtype=np.int64)
+
+def clear_calendar_cache():
+    global _cache
+    _cache = _cache.iloc[:0]
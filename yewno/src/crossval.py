@@ -0,0 +1,120 @@
+try:
+    from .pipeline import hash_data
+except ImportError:
+    from pipeline import hash_data
+
+import copy
+import multiprocessing
+import os
+import pandas as pd
+import numpy as np
+
+
+def walk_forward_folds(n_obs, n_folds=5, test_size=None, min_train_size=None,
+                       mode='expanding', train_size=None):
+    # Positional (train, test) slices for walk-forward validation. Test blocks
+    # follow each other to the end of the data; 'expanding' trains on all
+    # earlier rows, 'rolling' on the last train_size rows (default min_train_size).
+    if min_train_size is None:
+        min_train_size = n_obs // (n_folds + 1)
+    if test_size is None:
+        test_size = (n_obs - min_train_size) // n_folds
+    if test_size < 1 or min_train_size < 1:
+        raise ValueError("Not enough observations for {} folds".format(n_folds))
+    if train_size is None:
+        train_size = min_train_size
+
+    first_test = n_obs - n_folds * test_size
+    if first_test < min_train_size:
+        raise ValueError("{} folds of {} test rows leave {} training rows, fewer than {}".format(
+            n_folds, test_size, first_test, min_train_size))
+
+    folds = []
+    for k in range(n_folds):
+        test_start = first_test + k * test_size
+        if mode == 'expanding':
+            train_start = 0
+        elif mode == 'rolling':
+            train_start = max(test_start - train_size, 0)
+        else:
+            raise ValueError("mode must be 'expanding' or 'rolling'")
+        folds.append((slice(train_start, test_start), slice(test_start, test_start + test_size)))
+    return folds
+
+def _fold_features(data, features, target, folds, cache_dir):
+    # Writes each fold's train/test arrays once to cache_dir, keyed by the data
+    # content and the fold bounds, and returns the file paths
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    data_key = hash_data(data[features + [target]])[:16]
+    X = data[features].to_numpy(dtype=np.float64)
+    y = data[target].to_numpy()
+
+    paths = []
+    for train, test in folds:
+        path = os.path.join(cache_dir, "{}_{}_{}_{}_{}.npz".format(
+            data_key, train.start, train.stop, test.start, test.stop))
+        if not os.path.exists(path):
+            np.savez(path, X_train=X[train], y_train=y[train], X_test=X[test], y_test=y[test])
+        paths.append(path)
+    return paths
+
+def _score(y_true, y_pred, metrics):
+    scores = {}
+    if 'rmse' in metrics:
+        scores['rmse'] = float(np.sqrt(np.mean((y_true - y_pred) ** 2)))
+    if 'accuracy' in metrics:
+        scores['accuracy'] = float(np.mean(y_true == y_pred))
+    return scores
+
+def _fit_fold(job):
+    fold, estimator, path, metrics = job
+    with np.load(path) as arrays:
+        X_train, y_train = arrays['X_train'], arrays['y_train']
+        X_test, y_test = arrays['X_test'], arrays['y_test']
+    model = copy.deepcopy(estimator)
+    model.fit(X_train, y_train)
+    y_pred = np.asarray(model.predict(X_test))
+    return fold, y_test, y_pred, _score(y_test, y_pred, metrics)
+
+def cross_validate(data, target, estimator, features=None, folds=None, n_folds=5,
+                   mode='expanding', metrics=('accuracy', 'rmse'), processes=1,
+                   cache_dir='.cv_cache'):
+    # Walk-forward evaluation of an estimator (anything with fit(X, y) and
+    # predict(X), copied per fold) on preprocessed data such as the output of
+    # run_preprocessing or preprocess_data. Folds run on a process pool when
+    # processes > 1 and read their features from the on-disk fold cache.
+    # Returns (per-fold DataFrame, aggregate Series): the aggregate holds the
+    # mean of each per-fold metric and the metric over all test predictions.
+    if features is None:
+        features = [c for c in data.columns if c != target]
+    features = list(features)
+    if folds is None:
+        folds = walk_forward_folds(len(data), n_folds=n_folds, mode=mode)
+
+    paths = _fold_features(data, features, target, folds, cache_dir)
+    jobs = [(k, estimator, path, metrics) for k, path in enumerate(paths)]
+    if processes == 1 or len(jobs) <= 1:
+        results = [_fit_fold(job) for job in jobs]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_fit_fold, jobs)
+
+    index = data.index
+    rows = []
+    for (fold, y_test, y_pred, scores), (train, test) in zip(results, folds):
+        row = {'fold': fold,
+               'train_start': index[train.start], 'train_end': index[train.stop - 1],
+               'test_start': index[test.start], 'test_end': index[min(test.stop, len(index)) - 1],
+               'n_train': train.stop - train.start, 'n_test': len(y_test)}
+        row.update(scores)
+        rows.append(row)
+    per_fold = pd.DataFrame(rows).set_index('fold')
+
+    pooled = _score(np.concatenate([r[1] for r in results]),
+                    np.concatenate([r[2] for r in results]), metrics)
+    aggregate = {}
+    for name in pooled:
+        aggregate['mean_' + name] = per_fold[name].mean()
+        aggregate['pooled_' + name] = pooled[name]
+    return per_fold, pd.Series(aggregate)
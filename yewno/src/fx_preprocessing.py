@@ -1,16 +1,26 @@
-from pytrends.request import TrendReq
-from functools import reduce
+try:
+    from .trends_cache import TrendsCache
+    from .calendar_features import week_of_month_index
+    from .alignment import align_frames
+    from .rolling import rolling_slopes
+    from .pipeline import Pipeline
+except ImportError:
+    from trends_cache import TrendsCache
+    from calendar_features import week_of_month_index
+    from alignment import align_frames
+    from rolling import rolling_slopes
+    from pipeline import Pipeline
 import matplotlib.pyplot as plt #plotting/graphics
 
-import datetime
-import calendar
 import pandas as pd
 import numpy as np
 
 
-def get_search_data(keyword, cat_dict, print_data=False):
-    # Login to Google
-    pytrend = TrendReq()
+def get_search_data(keyword, cat_dict, print_data=False, cache=None):
+    # Cached trend histories, missing/stale categories fetched concurrently
+    if cache is None:
+        cache = TrendsCache()
+    trends = cache.get_many(keyword, cat_dict.keys(), geo='US', timeframe='today 5-y')
 
     # List captures each category's trend history dataframe
     data_frames = [] 
@@ -18,51 +28,28 @@ def get_search_data(keyword, cat_dict, print_data=False):
         # Lookup category name
         catName = cat_dict[category]
 
-        # Create payload and capture API tokens.
-        pytrend.build_payload(kw_list=[keyword], cat=str(category), geo='US', timeframe='today 5-y')
-        
-        # Interest Over Time & drop isPartial col
-        interest_over_time_df = pytrend.interest_over_time().drop('isPartial', 1)
+        interest_over_time_df = trends[category].copy()
         interest_over_time_df.columns=[catName]
         data_frames.append(interest_over_time_df)
     
     # Merge the list of data frames to create one dataframe
-    raw_data = reduce(lambda  left,right: pd.merge(left, right, how='outer',left_index=True, right_index=True), data_frames)
+    raw_data = align_frames(data_frames, how='outer')
     if print_data:
         print(raw_data.head())
     raw_data.to_csv("Weekly_{}_Google_Trends_Data_raw.csv".format(keyword), index=True)
     return raw_data
 
-def rolling_slope(ts):
-    x = np.arange(0, len(ts))
-    y = np.array(ts)
-    A = np.vstack([x, np.ones(len(x))]).T
-    m, c = np.linalg.lstsq(A, y)[0]
-    return m
-
-def get_GTrend_slopes(data):
-    for colName in data:
-        data = data.reset_index()
-        data[colName] = data[colName].rolling(window=4, min_periods=4).apply(rolling_slope).shift(1)
-        data = data.set_index('date')
-        #data.dropna(inplace=True)
-    return data
+def get_GTrend_slopes(data, window=4):
+    # Slope of each trend over the previous `window` weeks, all columns at once
+    return rolling_slopes(data, window).shift(1)
 
 def week_of_month(tgtdate):
-    tgtdate = tgtdate.to_pydatetime()
-
-    days_this_month = calendar.mdays[tgtdate.month]
-    for i in range(1, days_this_month):
-        d = datetime.datetime(tgtdate.year, tgtdate.month, i)
-        if d.day - d.weekday() > 0:
-            startdate = d
-            break
-    # now we can use the modulo 7 appraoch
-    return (tgtdate - startdate).days //7 + 1
+    # Scalar version, see calendar_features for whole columns
+    return int(week_of_month_index([tgtdate])[0])
 
 def add_wom(df):
     df = df.reset_index()
-    df['WoM'] = df['date'].apply(week_of_month)
+    df['WoM'] = week_of_month_index(df['date'])
     df['date_orig'] = df['date']
     df['date'] = df['date'].dt.to_period('M')
     #df = df.set_index('date')
@@ -93,12 +80,13 @@ def run_preprocessing(fx_file,
                       search_key1, 
                       search_key2, 
                       news_categories, 
-                      travel_categories):
+                      travel_categories,
+                      cache=None):
     
-    us_GTNews = get_search_data(search_key1, news_categories)
-    eu_GTNews = get_search_data(search_key2, news_categories)
-    us_GTravel = get_search_data(search_key1, travel_categories)
-    eu_GTravel = get_search_data(search_key2, travel_categories)
+    us_GTNews = get_search_data(search_key1, news_categories, cache=cache)
+    eu_GTNews = get_search_data(search_key2, news_categories, cache=cache)
+    us_GTravel = get_search_data(search_key1, travel_categories, cache=cache)
+    eu_GTravel = get_search_data(search_key2, travel_categories, cache=cache)
     
     # Convert to rolling window slopes
     us_N = get_GTrend_slopes(us_GTNews)
@@ -115,18 +103,48 @@ def run_preprocessing(fx_file,
     # Load FX Data & Process
     fx_data = load_fx_data(fx_file)
     
-    # Load all dataframes
-    df_list = [df1_GTNews, df2_GTravel, df3_GTNews, df4_GTravel, fx_data]
-    merged_data = reduce(lambda  left,right: pd.merge(left, 
-                                                  right, 
-                                                  how='inner',
-                                                  left_on=['date','WoM'], 
-                                                  right_on = ['date','WoM']), df_list)
-    # Drop WoM
-    merged_data = merged_data.reset_index()
-    merged_data['date'] = merged_data['date_orig_x']
-    merged_data= merged_data.drop('date_orig_x', 1)
-    merged_data = merged_data.set_index('date')
-    merged_data = merged_data.drop('WoM', 1)
-    merged_data = merged_data.drop('index', 1)
+    return merge_features(df1_GTNews, df2_GTravel, df3_GTNews, df4_GTravel, fx_data,
+                          search_key1=search_key1, search_key2=search_key2)
+
+def merge_features(df1_GTNews, df2_GTravel, df3_GTNews, df4_GTravel, fx_data,
+                   search_key1, search_key2):
+    # Join all dataframes on (month, WoM) in one pass. Only the first frame's
+    # original dates are kept, trend columns shared by both search keys are
+    # suffixed with their key e.g. 'Biz_News_US', 'Biz_News_Europe'
+    df_list = [df1_GTNews] + [df.drop('date_orig', axis=1) for df in 
+                              (df2_GTravel, df3_GTNews, df4_GTravel, fx_data)]
+    suffixes = ['_' + search_key1, '_' + search_key1, 
+                '_' + search_key2, '_' + search_key2, '']
+    merged_data = align_frames(df_list, on=['date', 'WoM'], how='inner', suffixes=suffixes)
+
+    # Index on the original dates & drop the join keys
+    merged_data = merged_data.set_index('date_orig').drop(['date', 'WoM'], axis=1)
+    merged_data.index.name = 'date'
     return merged_data.dropna()
+
+def build_fx_pipeline(fx_file, 
+                      search_key1, 
+                      search_key2, 
+                      news_categories, 
+                      travel_categories,
+                      cache=None,
+                      cache_dir='.pipeline_cache'):
+    # Same stages as run_preprocessing as a cached DAG: pipeline.run('merged')
+    # only recomputes what changed, and when new weeks are appended the slope
+    # and WoM stages only process the tail.
+    pipe = Pipeline(cache_dir, name='fx')
+    frames = []
+    for key in (search_key1, search_key2):
+        for group, cats in (('news', news_categories), ('travel', travel_categories)):
+            name = "{}_{}".format(key, group)
+            pipe.add('trends_' + name, get_search_data, 
+                     params={'keyword': key, 'cat_dict': cats, 'cache': cache})
+            pipe.add('slopes_' + name, get_GTrend_slopes, ['trends_' + name], lookback=4)
+            pipe.add('wom_' + name, add_wom, ['slopes_' + name], lookback=0)
+            frames.append('wom_' + name)
+    pipe.add('fx', load_fx_data, params={'fileName': fx_file})
+
+    # Frame order must match merge_features: us news, us travel, eu news, eu travel
+    pipe.add('merged', merge_features, frames + ['fx'], 
+             params={'search_key1': search_key1, 'search_key2': search_key2})
+    return pipe
@@ -0,0 +1,240 @@
+from collections import OrderedDict
+
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sysconfig
+import pandas as pd
+import numpy as np
+
+
+def hash_data(obj):
+    # Content hash of a stage output
+    h = hashlib.sha1()
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+        h.update(repr(list(obj.columns) if isinstance(obj, pd.DataFrame) else obj.name).encode('utf-8'))
+    else:
+        h.update(pickle.dumps(obj))
+    return h.hexdigest()
+
+def _row_hashes(df):
+    return pd.util.hash_pandas_object(df, index=True).to_numpy()
+
+_STDLIB = os.path.abspath(sysconfig.get_paths()['stdlib'])
+
+def _is_project_module(module):
+    # Modules of this code base, i.e. with a source file outside the
+    # standard library and installed packages
+    path = getattr(module, '__file__', None)
+    if not path or not path.endswith('.py'):
+        return False
+    path = os.path.abspath(path)
+    return 'site-packages' not in path and 'dist-packages' not in path and \
+        not path.startswith(_STDLIB)
+
+def _referenced_modules(module):
+    # Project modules imported by module, directly or through imported names
+    found = []
+    for value in list(vars(module).values()):
+        ref = value if inspect.ismodule(value) else inspect.getmodule(value) \
+            if (inspect.isfunction(value) or inspect.isclass(value)) else None
+        if ref is not None and ref is not module and _is_project_module(ref):
+            found.append(ref)
+    return found
+
+def _source_hashes(func):
+    # Source hashes of the module defining func and of every project module
+    # it depends on, so editing a callee (e.g. rolling.rolling_slopes) also
+    # changes the key
+    while isinstance(func, functools.partial):
+        func = func.func
+    root = inspect.getmodule(func)
+    if root is None or not _is_project_module(root):
+        return []
+    seen, stack, hashes = set(), [root], []
+    while stack:
+        module = stack.pop()
+        if module.__name__ in seen:
+            continue
+        seen.add(module.__name__)
+        with open(module.__file__, 'rb') as f:
+            hashes.append((module.__name__, hashlib.sha1(f.read()).hexdigest()))
+        stack.extend(_referenced_modules(module))
+    return sorted(hashes)
+
+def _func_signature(func, params, version=None):
+    try:
+        code = inspect.getsource(func)
+    except (OSError, TypeError):
+        code = getattr(getattr(func, '__code__', None), 'co_code', repr(func))
+    h = hashlib.sha1()
+    h.update(repr(code).encode('utf-8'))
+    h.update(repr(_source_hashes(func)).encode('utf-8'))
+    h.update(repr(sorted(params.items())).encode('utf-8'))
+    h.update(repr(version).encode('utf-8'))
+    return h.hexdigest()
+
+
+class Stage(object):
+    # One node of the pipeline: func(*dep_outputs, **params).
+    # lookback - None for stages recomputed in full whenever an input changes.
+    #   An int marks a row-preserving stage (output row i depends only on input
+    #   rows i-lookback..i of its first dependency), which is recomputed only on
+    #   the appended tail when that input grows.
+    # version - Optional extra key input, e.g. the version of data or code the
+    #   stage depends on that is not part of this code base.
+    def __init__(self, name, func, deps=(), params=None, lookback=None, version=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = params or {}
+        self.lookback = lookback
+        self.version = version
+        self.signature = _func_signature(func, self.params, version) if self.deps else None
+
+
+class Pipeline(object):
+    # DAG of stages with content-hashed, on-disk cached outputs. Stages without
+    # dependencies are sources (file loads, cached fetches) and always run; every
+    # other stage is keyed by its code, the source of the project modules it
+    # depends on, its params and version and the hashes of its inputs and is
+    # only recomputed when that key changes. Each named pipeline keeps its
+    # manifest and outputs in its own subdirectory of cache_dir, so pipelines
+    # sharing a cache_dir and stage names do not overwrite each other.
+    def __init__(self, cache_dir='.pipeline_cache', name='default'):
+        self.cache_dir = cache_dir
+        self.name = name
+        self.stages = OrderedDict()
+        self.last_run = {}
+        self._dir = os.path.join(cache_dir, name)
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir)
+        self._manifest_path = os.path.join(self._dir, 'manifest.pkl')
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, 'rb') as f:
+                self.manifest = pickle.load(f)
+        else:
+            self.manifest = {}
+
+    def add(self, name, func, deps=(), params=None, lookback=None, version=None):
+        # Stages must be added after their dependencies, which keeps the graph acyclic
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError("Unknown dependency '{}' for stage '{}'".format(dep, name))
+        self.stages[name] = Stage(name, func, deps, params, lookback, version)
+        return self
+
+    def _required(self, targets):
+        needed = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                stack.extend(self.stages[name].deps)
+        return [name for name in self.stages if name in needed]
+
+    def _load(self, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _save(self, path, obj):
+        with open(path, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _incremental(self, stage, inputs, input_hashes):
+        # Returns the output recomputed only where the first input changed, or
+        # None if the previous run cannot be extended. The new input must contain
+        # a contiguous run of the previous rows (checked with per-row hashes):
+        # rows may be appended, dropped from the front (e.g. a rolling
+        # 'today 5-y' window) or changed at the front (e.g. lost context).
+        record = self.manifest.get(stage.name)
+        if stage.lookback is None or record is None or record['signature'] != stage.signature:
+            return None
+        if record['other_hashes'] != input_hashes[1:] or not os.path.exists(record['path']):
+            return None
+
+        primary = inputs[0]
+        old_rows = record['row_hashes']
+        new_rows = _row_hashes(primary)
+        found = np.isin(new_rows, old_rows)
+        if not found.any():
+            return None
+        first_new = int(np.argmax(found))
+        first_old = np.flatnonzero(old_rows == new_rows[first_new])
+        if len(first_old) != 1:
+            return None
+        first_old = int(first_old[0])
+        n_kept = len(old_rows) - first_old
+        end_new = first_new + n_kept
+        if n_kept <= stage.lookback or end_new > len(new_rows):
+            return None
+        if not np.array_equal(old_rows[first_old:], new_rows[first_new:end_new]):
+            return None
+
+        # Rows whose whole lookback window is unchanged are reused from the old
+        # output, the rows before them and the appended rows are recomputed
+        old_out = self._load(record['path'])
+        lookback = stage.lookback
+        parts = []
+        if first_new == 0 and first_old == 0:
+            parts.append(old_out)
+        else:
+            head = first_new + lookback
+            parts.append(stage.func(primary.iloc[:head], *inputs[1:], **stage.params))
+            parts.append(old_out.iloc[first_old + lookback:])
+        if len(primary) > end_new:
+            start = max(end_new - lookback, 0)
+            tail_out = stage.func(primary.iloc[start:], *inputs[1:], **stage.params)
+            parts.append(tail_out.iloc[end_new - start:])
+        return pd.concat(parts, ignore_index=isinstance(old_out.index, pd.RangeIndex))
+
+    def run(self, targets=None):
+        # Runs the stages needed for targets (default: all). Returns the output
+        # of a single target name, or {name: output} for a list. last_run maps
+        # each stage to 'source', 'cached', 'incremental' or 'computed'.
+        single = isinstance(targets, str)
+        targets = [targets] if single else list(targets or self.stages)
+        results, hashes = {}, {}
+        self.last_run = {}
+
+        for name in self._required(targets):
+            stage = self.stages[name]
+            if not stage.deps:
+                results[name] = stage.func(**stage.params)
+                hashes[name] = hash_data(results[name])
+                self.last_run[name] = 'source'
+                continue
+
+            inputs = [results[d] for d in stage.deps]
+            input_hashes = [hashes[d] for d in stage.deps]
+            key = hashlib.sha1((stage.signature + ''.join(input_hashes)).encode('utf-8')).hexdigest()
+            path = os.path.join(self._dir, "{}_{}.pkl".format(name, key[:16]))
+
+            if os.path.exists(path):
+                output = self._load(path)
+                self.last_run[name] = 'cached'
+            else:
+                output = self._incremental(stage, inputs, input_hashes)
+                self.last_run[name] = 'incremental'
+                if output is None:
+                    output = stage.func(*inputs, **stage.params)
+                    self.last_run[name] = 'computed'
+                self._save(path, output)
+
+            # Keep only the latest output of each stage on disk
+            record = self.manifest.get(name)
+            if record is not None and record['path'] != path and os.path.exists(record['path']):
+                os.remove(record['path'])
+            self.manifest[name] = {'signature': stage.signature, 'path': path,
+                                   'row_hashes': _row_hashes(inputs[0]) if stage.lookback is not None else None,
+                                   'other_hashes': input_hashes[1:]}
+            results[name] = output
+            hashes[name] = key
+
+        with open(self._manifest_path, 'wb') as f:
+            pickle.dump(self.manifest, f)
+        return results[targets[0]] if single else dict((t, results[t]) for t in targets)
@@ -1,15 +1,24 @@
-from pytrends.request import TrendReq
-from functools import reduce
+try:
+    from .trends_cache import TrendsCache
+    from .calendar_features import week_of_month_index
+    from .alignment import align_frames
+    from .pipeline import Pipeline
+except ImportError:
+    from trends_cache import TrendsCache
+    from calendar_features import week_of_month_index
+    from alignment import align_frames
+    from pipeline import Pipeline
 
-import datetime
-import calendar
+import multiprocessing
 import pandas as pd
 import numpy as np
 
 
-def get_search_data(keyword, cat_dict, print_data=False):
-    # Login to Google
-    pytrend = TrendReq()
+def get_search_data(keyword, cat_dict, print_data=False, cache=None):
+    # Cached trend histories, missing/stale categories fetched concurrently
+    if cache is None:
+        cache = TrendsCache()
+    trends = cache.get_many(keyword, cat_dict.keys(), geo='US', timeframe='today 8-y')
 
     # List captures each category's trend history dataframe
     data_frames = [] 
@@ -17,16 +26,12 @@ def get_search_data(keyword, cat_dict, print_data=False):
         # Lookup category name
         catName = cat_dict[category]
 
-        # Create payload and capture API tokens.
-        pytrend.build_payload(kw_list=[keyword], cat=str(category), geo='US', timeframe='today 8-y')
-        
-        # Interest Over Time & drop isPartial col
-        interest_over_time_df = pytrend.interest_over_time().drop('isPartial', 1)
+        interest_over_time_df = trends[category].copy()
         interest_over_time_df.columns=[catName]
         data_frames.append(interest_over_time_df)
     
     # Merge the list of data frames to create one dataframe
-    merged_data = reduce(lambda  left,right: pd.merge(left, right, how='outer',left_index=True, right_index=True), data_frames)
+    merged_data = align_frames(data_frames, how='outer')
     if print_data:
         print(merged_data.head())
     merged_data.to_csv("Weekly_{}_Google_Trends_Data_raw.csv".format(keyword), index=True)
@@ -46,20 +51,12 @@ def test_train_split(data, train_start='2013-01-01', test_start='2018-01-01'):
     return train_df, test_df
 
 def week_of_month(tgtdate):
-    tgtdate = tgtdate.to_pydatetime()
-
-    days_this_month = calendar.mdays[tgtdate.month]
-    for i in range(1, days_this_month):
-        d = datetime.datetime(tgtdate.year, tgtdate.month, i)
-        if d.day - d.weekday() > 0:
-            startdate = d
-            break
-    # now we can use the modulo 7 appraoch
-    return (tgtdate - startdate).days //7 + 1
+    # Scalar version, see calendar_features for whole columns
+    return int(week_of_month_index([tgtdate])[0])
 
 def extract_weekly_trend(data, week_num=3):
     df = data.reset_index()
-    df['calendar_wom'] = df['date'].apply(week_of_month)
+    df['calendar_wom'] = week_of_month_index(df['date'])
     df = df.loc[df['calendar_wom'] == week_num]
     df = df.drop('calendar_wom', 1)
     df['date'] = pd.to_datetime(df['date'])
@@ -111,4 +108,59 @@ def preprocess_data(y_raw, raw_trend_data, train_start, test_start, week_num=3):
     test_data = pd.merge(X_test, y_test, how='inner', left_index=True, right_index=True)
     
     return train_data, test_data
-    
\ No newline at end of file
+
+def _weekly_trends(raw_trend_data, week_nums):
+    # Trend rows of each requested week of month, from one WoM pass over the
+    # whole history. Original dates are kept so splits match preprocess_data.
+    wom = week_of_month_index(raw_trend_data.index)
+    return dict((w, raw_trend_data.loc[wom == w]) for w in set(week_nums))
+
+def _feature_set(y, trend):
+    # Lags of y joined with the monthly trend rows, as in preprocess_data
+    trend = trend.set_axis(trend.index.to_period('M').rename('date'))
+    X = pd.DataFrame({'lag1': y['Value'].shift(1), 'lag2': y['Value'].shift(2)})
+    X = X.join(trend, how='outer').dropna()
+    return X.join(y, how='inner')
+
+def _build_feature_sets(y_log, weekly, week_num, train_start, test_start):
+    y_train, y_test = test_train_split(y_log, train_start, test_start)
+    _tr, _te = test_train_split(weekly[week_num], train_start, test_start)
+    return _feature_set(y_train, _tr), _feature_set(y_test, _te)
+
+_shared_inputs = {}
+
+def _init_batch_worker(y_log, weekly):
+    _shared_inputs['y_log'] = y_log
+    _shared_inputs['weekly'] = weekly
+
+def _batch_worker(spec):
+    return _build_feature_sets(_shared_inputs['y_log'], _shared_inputs['weekly'], *spec)
+
+def preprocess_data_batch(y_raw, raw_trend_data, specs, processes=1):
+    # Builds preprocess_data's (train_data, test_data) for every
+    # (week_num, train_start, test_start) in specs. The log of y and the
+    # week-of-month filtering are computed once and shared by all specs; with
+    # processes > 1 the specs are spread over a process pool that receives the
+    # shared inputs once per worker. Returns {spec: (train_data, test_data)}.
+    specs = [tuple(spec) for spec in specs]
+    y_log = np.log(y_raw)
+    weekly = _weekly_trends(raw_trend_data, [spec[0] for spec in specs])
+
+    if processes == 1 or len(specs) <= 1:
+        results = [_build_feature_sets(y_log, weekly, *spec) for spec in specs]
+    else:
+        with multiprocessing.Pool(processes, _init_batch_worker, (y_log, weekly)) as pool:
+            results = pool.map(_batch_worker, specs)
+    return dict(zip(specs, results))
+
+def build_home_sales_pipeline(fileName, search_term, cat_dict, train_start, test_start,
+                              week_num=3, cache=None, cache_dir='.pipeline_cache'):
+    # preprocess_data as a cached DAG: pipeline.run('datasets') returns the cached
+    # (train_data, test_data) unless the sales file or the search data changed
+    pipe = Pipeline(cache_dir, name='home_sales')
+    pipe.add('home_sales', get_home_sales_data, params={'fileName': fileName})
+    pipe.add('trends', get_search_data, 
+             params={'keyword': search_term, 'cat_dict': cat_dict, 'cache': cache})
+    pipe.add('datasets', preprocess_data, ['home_sales', 'trends'], 
+             params={'train_start': train_start, 'test_start': test_start, 'week_num': week_num})
+    return pipe
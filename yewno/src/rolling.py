@@ -0,0 +1,53 @@
+from numpy.lib.stride_tricks import sliding_window_view
+
+import pandas as pd
+import numpy as np
+
+
+# Closed-form OLS of each column on x = 0..window-1 over every rolling window.
+# The windows are strided views of the data (no copies), so one matrix product
+# gives the slopes of all windows of all columns. A window containing a NaN
+# gives NaN, matching rolling(window, min_periods=window).
+def _rolling_ols(values, window, stats):
+    n_rows, n_cols = values.shape
+    out = dict((stat, np.full((n_rows, n_cols), np.nan)) for stat in stats)
+    if n_rows < window:
+        return out
+
+    # windows: (n_rows - window + 1, n_cols, window)
+    windows = sliding_window_view(values, window, axis=0)
+    x = np.arange(window, dtype=np.float64)
+    x_c = x - x.mean()
+    sxx = np.dot(x_c, x_c)
+
+    slope = np.dot(windows, x_c) / sxx
+    out['slope'][window - 1:] = slope
+    if 'intercept' in stats or 'r2' in stats:
+        y_mean = windows.mean(axis=2)
+        if 'intercept' in stats:
+            out['intercept'][window - 1:] = y_mean - slope * x.mean()
+        if 'r2' in stats:
+            syy = ((windows - y_mean[:, :, None]) ** 2).sum(axis=2)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out['r2'][window - 1:] = slope ** 2 * sxx / syy
+    return out
+
+def rolling_regression(data, window=4, stats=('slope',)):
+    # Rolling OLS slope (and optionally 'intercept', 'r2') of every column of a
+    # DataFrame/Series against time. Returns {stat: DataFrame}, or for a list of
+    # window sizes {window: {stat: DataFrame}}.
+    if not np.isscalar(window):
+        return dict((w, rolling_regression(data, w, stats)) for w in window)
+
+    stats = tuple(stats)
+    if 'slope' not in stats:
+        stats = ('slope',) + stats
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    values = frame.to_numpy(dtype=np.float64)
+    out = _rolling_ols(values, int(window), stats)
+    return dict((stat, pd.DataFrame(out[stat], index=frame.index, columns=frame.columns))
+                for stat in stats)
+
+def rolling_slopes(data, window=4):
+    # Rolling OLS slope of every column, same shape as data
+    return rolling_regression(data, window)['slope']
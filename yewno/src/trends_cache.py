@@ -0,0 +1,191 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import hashlib
+import os
+import re
+import threading
+import time
+import pandas as pd
+
+
+# Google Trends only returns weekly points for windows longer than ~9 months,
+# shorter requests come back daily. Incremental requests are therefore never
+# shorter than this so they line up with the cached weekly series.
+MIN_INCREMENTAL_SPAN = pd.Timedelta(days=270)
+
+# Weeks of already cached history re-requested with every incremental fetch.
+# Each request is normalised to 0-100 on its own, the overlap is used to
+# rescale the new rows onto the cached series.
+OVERLAP_WEEKS = 8
+
+
+class PyTrendsProvider(object):
+    # Live provider backed by pytrends. TrendReq keeps per-payload state, so
+    # each worker thread gets its own session.
+    def __init__(self, **trendreq_kwargs):
+        self.trendreq_kwargs = trendreq_kwargs
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, 'pytrend'):
+            from pytrends.request import TrendReq
+            self._local.pytrend = TrendReq(**self.trendreq_kwargs)
+        return self._local.pytrend
+
+    def __call__(self, keyword, category, geo, timeframe):
+        pytrend = self._session()
+        pytrend.build_payload(kw_list=[keyword], cat=str(category), geo=geo, timeframe=timeframe)
+        df = pytrend.interest_over_time()
+        if 'isPartial' in df.columns:
+            df = df.drop('isPartial', axis=1)
+        return df
+
+
+class FixtureProvider(object):
+    # Offline provider serving saved interest-over-time frames, either from a
+    # dict {(keyword, category): DataFrame} or from '{keyword}_{category}.csv'
+    # files in a directory. Explicit 'YYYY-MM-DD YYYY-MM-DD' timeframes are
+    # sliced so incremental fetching can be exercised without network access.
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+        self.calls = []
+
+    def _load(self, keyword, category):
+        if isinstance(self.fixtures, dict):
+            return self.fixtures[(keyword, category)].copy()
+        fileName = os.path.join(self.fixtures, "{}_{}.csv".format(keyword, category))
+        return pd.read_csv(fileName, index_col=0, parse_dates=True)
+
+    def __call__(self, keyword, category, geo, timeframe):
+        self.calls.append((keyword, category, geo, timeframe))
+        df = self._load(keyword, category)
+        start_end = _explicit_window(timeframe)
+        if start_end is not None:
+            df = df.loc[start_end[0]:start_end[1]]
+        return df
+
+
+class RateLimiter(object):
+    # Spaces request start times at least min_interval seconds apart across
+    # all threads.
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class TrendsCache(object):
+    # On-disk cache of Google Trends series keyed by (keyword, category, geo,
+    # timeframe). Entries older than ttl are refreshed by fetching only the
+    # recent weeks missing from the cache, requests for many categories run on
+    # a bounded thread pool behind a shared rate limiter. Explicit
+    # 'YYYY-MM-DD YYYY-MM-DD' windows that have ended are never refreshed,
+    # empty entries are always fetched again.
+    def __init__(self, cache_dir='.trends_cache', provider=None, ttl=pd.Timedelta(days=7),
+                 max_workers=4, min_interval=1.0):
+        self.cache_dir = cache_dir
+        self.provider = provider if provider is not None else PyTrendsProvider()
+        self.ttl = pd.Timedelta(ttl)
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(min_interval)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def cache_path(self, keyword, category, geo, timeframe):
+        key = "|".join(str(k) for k in (keyword, category, geo, timeframe))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        # The digest keeps keys apart, the slug only makes the name readable
+        return os.path.join(self.cache_dir, "{}_{}_{}.csv".format(_slugify(keyword), category, digest))
+
+    def _fetch(self, keyword, category, geo, timeframe):
+        self.rate_limiter.wait()
+        df = self.provider(keyword, category, geo, timeframe)
+        df = df.iloc[:, :1].astype(float)
+        df.columns = ['interest']
+        df.index.name = 'date'
+        return df
+
+    def _is_fresh(self, path):
+        # Both sides in epoch seconds, so the local UTC offset cancels out
+        return time.time() - os.path.getmtime(path) < self.ttl.total_seconds()
+
+    def _refresh(self, cached, keyword, category, geo, timeframe, now):
+        # Explicit windows are only extended up to their end date
+        explicit = _explicit_window(timeframe)
+        end = now if explicit is None else min(now, explicit[1])
+        last_date = cached.index[-1]
+        start = last_date - pd.Timedelta(weeks=OVERLAP_WEEKS)
+        start = min(start, end - MIN_INCREMENTAL_SPAN)
+        window = "{} {}".format(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        recent = self._fetch(keyword, category, geo, window)
+
+        # Rescale the new request onto the cached series using the overlap
+        overlap = recent.index.intersection(cached.index)
+        if len(overlap):
+            new_level = recent.loc[overlap, 'interest'].mean()
+            if new_level > 0:
+                recent = recent * (cached.loc[overlap, 'interest'].mean() / new_level)
+
+        updated = pd.concat([cached, recent.loc[(recent.index > last_date) & (recent.index <= end)]])
+        window_start = _relative_window_start(timeframe, now)
+        if window_start is not None:
+            updated = updated.loc[updated.index >= window_start]
+        return updated
+
+    def get(self, keyword, category, geo='US', timeframe='today 5-y', now=None):
+        now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+        path = self.cache_path(keyword, category, geo, timeframe)
+
+        cached = None
+        if os.path.exists(path):
+            cached = pd.read_csv(path, index_col=0, parse_dates=True, float_precision='round_trip')
+        if cached is not None and len(cached):
+            explicit = _explicit_window(timeframe)
+            if self._is_fresh(path) or (explicit is not None and explicit[1] < now):
+                return cached
+            data = self._refresh(cached, keyword, category, geo, timeframe, now)
+        else:
+            data = self._fetch(keyword, category, geo, timeframe)
+
+        data.to_csv(path, index=True)
+        return data
+
+    def get_many(self, keyword, categories, geo='US', timeframe='today 5-y', now=None):
+        # Returns {category: DataFrame}, fetching categories concurrently
+        categories = list(categories)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            frames = pool.map(lambda cat: self.get(keyword, cat, geo, timeframe, now), categories)
+            return dict(zip(categories, frames))
+
+
+def _slugify(text):
+    # Keyword -> file name safe text ('/', spaces etc. replaced by '-')
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '-', str(text)).strip('-.')
+    return slug or 'keyword'
+
+def _explicit_window(timeframe):
+    # 'YYYY-MM-DD YYYY-MM-DD' -> (start, end) Timestamps, else None
+    parts = timeframe.split()
+    if len(parts) == 2 and parts[0] != 'today' and parts[0] != 'now':
+        return pd.Timestamp(parts[0]), pd.Timestamp(parts[1])
+    return None
+
+def _relative_window_start(timeframe, now):
+    # 'today N-y' / 'today N-m' -> first date inside that window, else None
+    parts = timeframe.split()
+    if len(parts) != 2 or parts[0] != 'today':
+        return None
+    num, unit = parts[1].split('-')
+    if unit == 'y':
+        return now - pd.DateOffset(years=int(num))
+    if unit == 'm':
+        return now - pd.DateOffset(months=int(num))
+    return None